@@ -0,0 +1,99 @@
+# ######## assets.py (Piece Sprite Atlas for the Client) ########
+# The twelve piece images are scaled once and packed into one atlas surface: a row per color,
+# a CELL-sized column per piece. The atlas is saved raw (RGBA bytes, nothing to decompress) in
+# the cache directory, so later starts read one file instead of decoding and scaling twelve
+# PNGs. It is converted to the display's pixel format with convert_alpha(), so blitting a
+# piece is a straight alpha blend rather than a per-pixel format conversion as well, and each
+# piece is a subsurface of it.
+import hashlib
+import os
+import time
+
+import pygame
+
+# --- Constants ---
+PIECE_NAMES = ('pawn', 'queen', 'king', 'knight', 'rook', 'bishop')
+COLORS = ('white', 'black')
+CELL = 80 # Atlas column width and row height, in pixels
+PIECE_SIZES = {'pawn': 65} # Drawn size in pixels; other pieces fill the cell
+IMAGE_DIR = os.path.join('assets', 'images')
+ASSET_CACHE_DIR = os.path.join('assets', 'cache')
+ATLAS_FORMAT_VERSION = 1 # Bump when the atlas layout changes, so old cache files are not read
+ATLAS_SIZE = (CELL * len(PIECE_NAMES), CELL * len(COLORS))
+
+
+def piece_size(name):
+    return PIECE_SIZES.get(name, CELL)
+
+def source_path(image_dir, color, name):
+    return os.path.join(image_dir, f'{color} {name}.png')
+
+def atlas_cache_path(image_dir=IMAGE_DIR, cache_dir=ASSET_CACHE_DIR):
+    """Cache file for the source images as they are now; editing one gives a new file name."""
+    digest = hashlib.sha1(f'{ATLAS_FORMAT_VERSION} {CELL} {sorted(PIECE_SIZES.items())}'.encode())
+    for color in COLORS:
+        for name in PIECE_NAMES:
+            stat = os.stat(source_path(image_dir, color, name))
+            digest.update(f'{color} {name} {stat.st_size} {stat.st_mtime_ns}'.encode())
+    return os.path.join(cache_dir, f'pieces-{digest.hexdigest()[:16]}.rgba')
+
+def build_atlas(image_dir=IMAGE_DIR):
+    """Loads and scales the twelve source images into a fresh (unconverted) atlas."""
+    atlas = pygame.Surface(ATLAS_SIZE, pygame.SRCALPHA)
+    for row, color in enumerate(COLORS):
+        for column, name in enumerate(PIECE_NAMES):
+            size = piece_size(name)
+            image = pygame.transform.scale(pygame.image.load(source_path(image_dir, color, name)), (size, size))
+            # MAX onto transparent black copies the pixels as they are; a normal blit would blend them
+            atlas.blit(image, (column * CELL, row * CELL), special_flags=pygame.BLEND_RGBA_MAX)
+    return atlas
+
+def load_atlas(image_dir=IMAGE_DIR, cache_dir=ASSET_CACHE_DIR):
+    """(atlas converted for the display, True if it came from the cache). Needs a display mode set.
+
+    Raises pygame.error or FileNotFoundError if a source image is missing or unreadable; a cache
+    that cannot be read or written only costs the rebuild.
+    """
+    path = atlas_cache_path(image_dir, cache_dir)
+    try:
+        with open(path, 'rb') as cache_file:
+            atlas = pygame.image.frombytes(cache_file.read(), ATLAS_SIZE, 'RGBA')
+        return atlas.convert_alpha(), True
+    except (OSError, ValueError): pass # Not cached yet (or a truncated file): rebuild it
+
+    atlas = build_atlas(image_dir)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as cache_file:
+            cache_file.write(pygame.image.tobytes(atlas, 'RGBA'))
+        os.replace(temp_path, path) # Another client starting at once never reads half a file
+    except OSError as e: print(f"Could not cache piece sprites in {cache_dir}: {e}")
+    return atlas.convert_alpha(), False
+
+
+class PieceSprites:
+    """Piece images by (color, name), cut from the atlas the first time one is needed."""
+    def __init__(self, image_dir=IMAGE_DIR, cache_dir=ASSET_CACHE_DIR):
+        self.image_dir = image_dir
+        self.cache_dir = cache_dir
+        self._sprites = None
+
+    @property
+    def loaded(self):
+        return self._sprites is not None
+
+    def load(self):
+        start = time.perf_counter()
+        atlas, cached = load_atlas(self.image_dir, self.cache_dir)
+        self._sprites = {}
+        for row, color in enumerate(COLORS):
+            for column, name in enumerate(PIECE_NAMES):
+                size = piece_size(name)
+                self._sprites[(color, name)] = atlas.subsurface((column * CELL, row * CELL, size, size))
+        print(f"Piece sprites {'read from cache' if cached else 'built and cached'} "
+              f"in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    def get(self, color, name):
+        if self._sprites is None: self.load()
+        return self._sprites[(color, name)]
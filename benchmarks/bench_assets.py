@@ -0,0 +1,92 @@
+# ######## bench_assets.py (Piece Sprites: Startup Time and Blit Cost) ########
+# Compares the client's old asset loading (twelve PNGs decoded and scaled at import, never
+# converted to the display format) with assets.py's atlas: built from the PNGs on the first
+# start, read back from the raw cache file after that, and converted with convert_alpha().
+# Part 1 times loading each way; part 2 times blitting a full board of 32 pieces onto the
+# window with each set of surfaces. Runs with SDL's dummy video driver unless --window is
+# given; blit costs depend on the real display's pixel format, so check both if you can.
+# Usage: python benchmarks/bench_assets.py [--loads N] [--frames F] [--window]
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The board as the game starts: (color, piece) on each square that has one
+START_ROW = ('rook', 'knight', 'bishop', 'king', 'queen', 'bishop', 'knight', 'rook')
+FULL_BOARD = [('white', name, (x, 0)) for x, name in enumerate(START_ROW)] + \
+             [('white', 'pawn', (x, 1)) for x in range(8)] + \
+             [('black', 'pawn', (x, 6)) for x in range(8)] + \
+             [('black', name, (x, 7)) for x, name in enumerate(START_ROW)]
+
+
+def load_unconverted(image_dir):
+    """{(color, name): surface} the way the client used to load them."""
+    sprites = {}
+    for color in assets.COLORS:
+        for name in assets.PIECE_NAMES:
+            size = assets.piece_size(name)
+            sprites[(color, name)] = pygame.transform.scale(pygame.image.load(assets.source_path(image_dir, color, name)), (size, size))
+    return sprites
+
+
+def best_ms(function, loads):
+    best = float('inf')
+    for _ in range(loads):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def blit_us(screen, sprite_for, frames):
+    """us per piece blit, drawing FULL_BOARD frames times."""
+    start = time.perf_counter()
+    for _ in range(frames):
+        for color, name, (x, y) in FULL_BOARD:
+            offset = 17 if name == 'pawn' else 10
+            screen.blit(sprite_for(color, name), (x * 100 + offset, y * 100 + offset))
+    return (time.perf_counter() - start) / (frames * len(FULL_BOARD)) * 1e6
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Piece sprites: startup time and blit cost")
+    parser.add_argument('--loads', type=int, default=5, help="repeats of each load (best counts)")
+    parser.add_argument('--frames', type=int, default=200, help="full boards blitted per surface set")
+    parser.add_argument('--window', action='store_true', help="use the real video driver instead of SDL's dummy one")
+    args = parser.parse_args()
+    if not args.window: os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+    import pygame
+    import assets
+    pygame.init()
+    screen = pygame.display.set_mode((1000, 900))
+    image_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), assets.IMAGE_DIR)
+    cache_dir = tempfile.mkdtemp(prefix='bench-assets-')
+    try:
+        def cold():
+            shutil.rmtree(cache_dir, ignore_errors=True)
+            assets.load_atlas(image_dir, cache_dir)
+        unconverted_ms = best_ms(lambda: load_unconverted(image_dir), args.loads)
+        cold_ms = best_ms(cold, args.loads)
+        cached_ms = best_ms(lambda: assets.load_atlas(image_dir, cache_dir), args.loads)
+
+        unconverted = load_unconverted(image_dir)
+        atlas_sprites = assets.PieceSprites(image_dir, cache_dir)
+        atlas_sprites.load()
+        old_us = blit_us(screen, lambda color, name: unconverted[(color, name)], args.frames)
+        new_us = blit_us(screen, atlas_sprites.get, args.frames)
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    print(f"Video driver:                       {pygame.display.get_driver()} "
+          f"({screen.get_bitsize()} bpp display, sources {unconverted[('white', 'king')].get_bitsize()} bpp)")
+    print(f"Load, 12 PNGs unconverted (old):    {unconverted_ms:8.2f} ms")
+    print(f"Load, atlas built from PNGs:        {cold_ms:8.2f} ms (first start; writes the cache)")
+    print(f"Load, atlas from cache:             {cached_ms:8.2f} ms")
+    print(f"Blit per piece, unconverted (old):  {old_us:8.2f} us")
+    print(f"Blit per piece, atlas:              {new_us:8.2f} us")
+    print(f"Full board of {len(FULL_BOARD)} pieces:           {old_us * len(FULL_BOARD) / 1000:8.2f} ms -> {new_us * len(FULL_BOARD) / 1000:.2f} ms")
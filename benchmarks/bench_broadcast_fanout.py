@@ -0,0 +1,103 @@
+# ######## bench_broadcast_fanout.py (Per-Recipient Encoding vs Serialize-Once Fan-Out) ########
+# Plays random moves in one game watched by N sockets and times each broadcast two ways: the
+# old shape (encode every message again for every recipient) and the current one (FrameBatch
+# for deltas, Game.snapshot_frame for snapshots, one shared buffer written to every socket).
+# Usage: python benchmarks/bench_broadcast_fanout.py [--recipients 2,16,128] [--moves M] [--codec pickle|binary]
+import argparse
+import contextlib
+import io
+import os
+import random
+import selectors
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import server
+import wire
+
+
+class Sink:
+    """N connected socket pairs whose far ends are drained by one background thread."""
+    def __init__(self, count):
+        self.pairs = [socket.socketpair() for _ in range(count)]
+        self.selector = selectors.DefaultSelector()
+        for _, far in self.pairs: self.selector.register(far, selectors.EVENT_READ)
+        self.running = True
+        self.thread = threading.Thread(target=self._drain, daemon=True)
+        self.thread.start()
+
+    def _drain(self):
+        while self.running:
+            for key, _ in self.selector.select(timeout=0.1):
+                try: key.fileobj.recv(1 << 16)
+                except OSError: pass
+
+    @property
+    def senders(self):
+        return [near for near, _ in self.pairs]
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        for near, far in self.pairs: near.close(); far.close()
+
+
+def play(game, rng, plies):
+    """Yields after each applied move; the game restarts when it ends or runs out of moves."""
+    for _ in range(plies):
+        color = 'white' if game.turn_step < 2 else 'black'
+        options = game.white_options if color == 'white' else game.black_options
+        choices = [(i, target) for i, moves in enumerate(options) for target in moves]
+        if game.game_over or not choices:
+            game._initialize_board(); game.game_started = True
+            continue
+        game.apply_move(color, *rng.choice(choices))
+        yield
+
+def run(recipients, moves, codec, seed, serialize_once):
+    rng = random.Random(seed)
+    sink = Sink(recipients)
+    senders = sink.senders
+    with contextlib.redirect_stdout(io.StringIO()): # Game logs every move
+        game = server.Game('bench')
+        game.game_started = True
+        elapsed = 0.0
+        broadcasts = 0
+        for _ in play(game, rng, moves):
+            start = time.perf_counter()
+            if serialize_once:
+                batch = wire.FrameBatch(game.take_deltas())
+                for sock in senders: sock.sendall(batch.frame_for(codec))
+            else:
+                deltas = game.take_deltas()
+                for sock in senders:
+                    for delta in deltas: sock.sendall(wire.frame_message(delta, codec))
+            # A late joiner / resync every tenth move gets a full snapshot
+            if broadcasts % 10 == 0:
+                if serialize_once:
+                    for sock in senders: sock.sendall(game.snapshot_frame(codec))
+                else:
+                    for sock in senders: sock.sendall(wire.frame_message(game.get_state(), codec))
+            elapsed += time.perf_counter() - start
+            broadcasts += 1
+    sink.close()
+    return elapsed / max(1, broadcasts)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-recipient encoding vs serialize-once fan-out")
+    parser.add_argument('--recipients', default='2,16,128')
+    parser.add_argument('--moves', type=int, default=400)
+    parser.add_argument('--codec', choices=('pickle', 'binary'), default='pickle')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    codec = wire.PICKLE_CODEC if args.codec == 'pickle' else wire.BINARY_CODEC
+
+    print(f"{'recipients':>10}{'per-recipient us':>18}{'serialize-once us':>19}{'speedup':>9}")
+    for recipients in (int(n) for n in args.recipients.split(',')):
+        old = run(recipients, args.moves, codec, args.seed, serialize_once=False)
+        new = run(recipients, args.moves, codec, args.seed, serialize_once=True)
+        print(f"{recipients:>10}{old * 1e6:>18.1f}{new * 1e6:>19.1f}{old / new:>8.1f}x")
@@ -0,0 +1,106 @@
+# ######## bench_clock_scheduler.py (Polled Timers vs Deadline Scheduler) ########
+# Starts many games with short random clocks that nobody moves in, next to a larger pool of
+# idle games whose clocks are nowhere near running out, then measures how late each flag-fall
+# is detected and how much CPU the timer machinery burns: once with the old once-per-interval
+# polling loop and once with clocks.ClockScheduler.
+# Usage: python benchmarks/bench_clock_scheduler.py [--games N] [--idle-games M] [--max-clock S]
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import server
+from clocks import ClockScheduler
+
+OLD_POLL_INTERVAL = 1.0 # periodic_updates used to wake once per second
+
+
+def make_games(count, idle_count, max_clock, seed):
+    rng = random.Random(seed)
+    games = {}
+    with contextlib.redirect_stdout(io.StringIO()): # Game logs on init and on flag-fall
+        for number in range(count + idle_count):
+            game = server.Game(f"bench-{number}")
+            game.game_started = True
+            if number < count: game.white_time = rng.uniform(0.2, max_clock)
+            games[game.game_id] = game
+    return games, count
+
+def start_clocks(games, listener=None):
+    deadlines = {}
+    for game_id, game in games.items():
+        game.deadline_listener = listener
+        with game.game_state_lock:
+            game.last_timer_update = time.monotonic()
+            deadlines[game_id] = game.flag_deadline()
+            game._notify_deadline()
+    return deadlines
+
+
+def run_polling(games, flagging, interval):
+    """The old periodic_updates shape: call update_timers on every game once per interval."""
+    detected = {}
+    deadlines = start_clocks(games)
+    cpu_start = time.process_time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        while len(detected) < flagging:
+            for game_id, game in games.items():
+                if game_id not in detected and game.update_timers(): detected[game_id] = time.monotonic()
+            time.sleep(interval)
+    return deadlines, detected, time.process_time() - cpu_start
+
+def run_scheduler(games, flagging):
+    detected = {}
+    finished = threading.Event()
+    def on_expire(game_id):
+        if games[game_id].update_timers():
+            detected[game_id] = time.monotonic()
+            if len(detected) == flagging: finished.set()
+    scheduler = ClockScheduler(on_expire)
+    with contextlib.redirect_stdout(io.StringIO()):
+        deadlines = start_clocks(games, scheduler.arm)
+        cpu_start = time.process_time()
+        threading.Thread(target=scheduler.run, daemon=True).start()
+        finished.wait()
+    scheduler.stop()
+    return deadlines, detected, time.process_time() - cpu_start
+
+
+def idle_tick_cost(games):
+    """CPU seconds one polling pass spends on games whose clocks are nowhere near zero."""
+    start_clocks(games)
+    cpu_start = time.process_time()
+    for game in games.values(): game.update_timers()
+    return time.process_time() - cpu_start
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def report(label, deadlines, detected, cpu_seconds):
+    lateness = [(detected[game_id] - deadlines[game_id]) * 1000 for game_id in detected]
+    print(f"{label:<12}{len(detected):>8}{percentile(lateness, 0.5):>10.2f}{percentile(lateness, 0.99):>10.2f}"
+          f"{max(lateness):>10.2f}{cpu_seconds:>8.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Polled timers vs deadline scheduler")
+    parser.add_argument('--games', type=int, default=5000, help="games whose clock runs out")
+    parser.add_argument('--idle-games', type=int, default=20000, help="games with a full clock")
+    parser.add_argument('--max-clock', type=float, default=3.0)
+    parser.add_argument('--interval', type=float, default=OLD_POLL_INTERVAL)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'mode':<12}{'flagged':>8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'CPU s':>8}")
+    report('polling', *run_polling(*make_games(args.games, args.idle_games, args.max_clock, args.seed), args.interval))
+    report('scheduler', *run_scheduler(*make_games(args.games, args.idle_games, args.max_clock, args.seed)))
+    idle_games, _ = make_games(0, args.idle_games, args.max_clock, args.seed)
+    print(f"Polling pass over {args.idle_games} idle games: {idle_tick_cost(idle_games) * 1000:.1f} ms CPU "
+          f"every {args.interval}s; the scheduler does no work for them between moves.")
@@ -0,0 +1,63 @@
+# ######## bench_delta_bytes.py (Full Snapshot vs Delta Broadcast Size) ########
+# Plays random games with some chat and compares the framed size of what each broadcast
+# used to send (get_state()) with what it sends now (the queued deltas), under each wire
+# codec. Under pickle every delta still carries its dict keys and the changed pieces' whole
+# option lists, so the cut is largest with the binary codec.
+# Usage: python benchmarks/bench_delta_bytes.py [--games N] [--chat-rate P] [--seed S]
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import server
+import wire
+
+
+def add_sizes(totals, kind, state, deltas):
+    for codec in wire.CODECS.values():
+        totals[f'{codec.name}_{kind}_full'] += len(wire.frame_message(state, codec))
+        totals[f'{codec.name}_{kind}_delta'] += sum(len(wire.frame_message(d, codec)) for d in deltas)
+
+
+def measure(games, chat_rate, seed, max_plies=120):
+    rng = random.Random(seed)
+    totals = {'moves': 0, 'ticks': 0}
+    for codec in wire.CODECS.values():
+        for key in ('move_full', 'move_delta', 'tick_full', 'tick_delta'): totals[f'{codec.name}_{key}'] = 0
+    for game_number in range(games):
+        game = server.Game(f"bench-{game_number}")
+        game.game_started = True
+        for ply in range(max_plies):
+            if game.game_over: break
+            color = 'white' if game.turn_step < 2 else 'black'
+            options = game.white_options if color == 'white' else game.black_options
+            choices = [(i, target) for i, moves in enumerate(options) for target in moves]
+            if not choices: break
+            game.apply_move(color, *rng.choice(choices))
+            if rng.random() < chat_rate:
+                game.add_chat_message(color, f"message number {ply} from {color}", "12:00 PM")
+            # What a move broadcast costs each way, then a once-per-second timer broadcast
+            add_sizes(totals, 'move', game.get_state(), game.take_deltas())
+            add_sizes(totals, 'tick', game.get_state(), game.take_deltas(include_clocks=True))
+            totals['moves'] += 1
+            totals['ticks'] += 1
+    return totals
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Full snapshot vs delta broadcast size")
+    parser.add_argument('--games', type=int, default=50)
+    parser.add_argument('--chat-rate', type=float, default=0.3)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(io.StringIO()): # Game logs every move
+        t = measure(args.games, args.chat_rate, args.seed)
+    for name in (codec.name for codec in wire.CODECS.values()):
+        for kind, label in (('move', 'Move broadcast'), ('tick', 'Timer broadcast')):
+            full = t[f'{name}_{kind}_full'] / max(1, t[f'{kind}s'])
+            delta = t[f'{name}_{kind}_delta'] / max(1, t[f'{kind}s'])
+            print(f"{name:<7} {label:<16} full {full:8.0f} B   delta {delta:6.0f} B   ratio {full / delta if delta else float('inf'):6.1f}x")
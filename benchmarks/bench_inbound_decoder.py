@@ -0,0 +1,90 @@
+# ######## bench_inbound_decoder.py (Inbound Stream Parsing: Old Loop vs FrameDecoder) ########
+# Pipelines a burst of move and chat messages through a socketpair and times how long the
+# server side takes to turn the byte stream back into messages, comparing the original
+# "concatenate bytes and retry pickle.loads" loop with wire.FrameDecoder.
+# Usage: python benchmarks/bench_inbound_decoder.py [--messages N] [--chat-size B] [--seed S]
+import argparse
+import os
+import pickle
+import random
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import wire
+
+
+def make_messages(count, chat_size, seed):
+    rng = random.Random(seed)
+    messages = []
+    for i in range(count):
+        if rng.random() < 0.7:
+            messages.append({'type': 'move', 'data': (rng.randrange(16), (rng.randrange(8), rng.randrange(8)))})
+        else:
+            messages.append({'type': 'chat', 'data': {'text': 'x' * rng.randrange(1, chat_size), 'timestamp': '12:00 PM'}})
+    return messages
+
+def send_all(sock, payload):
+    sock.sendall(payload)
+    sock.shutdown(socket.SHUT_WR)
+
+
+# --- Receivers ---
+def old_receive_loop(sock):
+    """The original server loop: one pickle per successful loads, buffer cleared afterwards."""
+    received = []
+    data_buffer = b""
+    while True:
+        chunk = sock.recv(4096)
+        if not chunk: break
+        data_buffer += chunk
+        try:
+            received.append(pickle.loads(data_buffer))
+            data_buffer = b"" # Anything pipelined behind the first pickle is lost here
+        except (pickle.UnpicklingError, EOFError):
+            continue
+    return received
+
+def decoder_receive_loop(sock, decoder):
+    received = []
+    while decoder.recv_into(sock):
+        received.extend(decoder.messages())
+    return received
+
+
+def run(label, payload, receive):
+    reader, writer = socket.socketpair()
+    sender = threading.Thread(target=send_all, args=(writer, payload))
+    start = time.perf_counter()
+    sender.start()
+    received = receive(reader)
+    elapsed = time.perf_counter() - start
+    sender.join()
+    reader.close(); writer.close()
+    return label, len(received), elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inbound stream parsing benchmark")
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--chat-size', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    messages = make_messages(args.messages, args.chat_size, args.seed)
+    legacy_stream = b''.join(pickle.dumps(message) for message in messages)
+    framed_pickle = b''.join(wire.frame_message(message, wire.PICKLE_CODEC) for message in messages)
+    framed_binary = b''.join(wire.frame_message(message, wire.BINARY_CODEC) for message in messages)
+
+    results = [
+        run('old loop (unframed pickle)', legacy_stream, old_receive_loop),
+        run('LegacyPickleDecoder', legacy_stream, lambda s: decoder_receive_loop(s, wire.LegacyPickleDecoder())),
+        run('FrameDecoder (pickle)', framed_pickle, lambda s: decoder_receive_loop(s, wire.FrameDecoder(wire.PICKLE_CODEC))),
+        run('FrameDecoder (binary)', framed_binary, lambda s: decoder_receive_loop(s, wire.FrameDecoder(wire.BINARY_CODEC))),
+    ]
+    print(f"{len(messages)} pipelined messages, {len(legacy_stream)} bytes unframed")
+    print(f"{'receiver':<30}{'decoded':>9}{'lost':>8}{'ms':>10}{'us/msg':>9}")
+    for label, decoded, elapsed in results:
+        print(f"{label:<30}{decoded:>9}{len(messages) - decoded:>8}{elapsed * 1000:>10.1f}{elapsed * 1e6 / max(decoded, 1):>9.2f}")
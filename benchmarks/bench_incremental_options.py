@@ -0,0 +1,64 @@
+# ######## bench_incremental_options.py (Full vs Incremental Option Recalculation) ########
+# Plays random games through Game.apply_move and times only the option recalculation step.
+# Usage: python benchmarks/bench_incremental_options.py [--games N] [--seed S]
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import server
+
+
+class TimedGame(server.Game):
+    """Game that accumulates time spent recalculating options after each move."""
+    recalc_seconds = 0.0
+    recalc_calls = 0
+
+    def _recalculate_options(self, *args):
+        start = time.perf_counter()
+        super()._recalculate_options(*args)
+        TimedGame.recalc_seconds += time.perf_counter() - start
+        TimedGame.recalc_calls += 1
+
+
+def play_random_games(games, seed, max_plies=200):
+    rng = random.Random(seed)
+    for game_number in range(games):
+        game = TimedGame(f"bench-{game_number}")
+        for _ in range(max_plies):
+            if game.game_over: break
+            color = 'white' if game.turn_step < 2 else 'black'
+            options = game.white_options if color == 'white' else game.black_options
+            choices = [(i, target) for i, moves in enumerate(options) for target in moves]
+            if not choices: break
+            game.apply_move(color, *rng.choice(choices))
+
+
+def run(incremental, games, seed):
+    server.INCREMENTAL_OPTIONS = incremental
+    server.OPTIONS_CACHE_ENABLED = False # Both runs play the same games; time generation, not cache hits
+    TimedGame.recalc_seconds = 0.0
+    TimedGame.recalc_calls = 0
+    with contextlib.redirect_stdout(io.StringIO()): # Game logs every move
+        play_random_games(games, seed)
+    return TimedGame.recalc_seconds, TimedGame.recalc_calls
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Full vs incremental option recalculation")
+    parser.add_argument('--games', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    full_seconds, full_calls = run(False, args.games, args.seed)
+    incr_seconds, incr_calls = run(True, args.games, args.seed)
+    full_us = full_seconds / max(1, full_calls) * 1e6
+    incr_us = incr_seconds / max(1, incr_calls) * 1e6
+    print(f"Moves replayed:          {incr_calls}")
+    print(f"Full rebuild per move:   {full_us:8.1f} us")
+    print(f"Incremental per move:    {incr_us:8.1f} us")
+    print(f"Speedup:                 {full_us / incr_us if incr_us else float('inf'):8.2f}x")
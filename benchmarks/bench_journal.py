@@ -0,0 +1,122 @@
+# ######## bench_journal.py (Move Journal: Throughput Cost and Recovery Time) ########
+# Part 1 runs the many-games load of bench_lock_contention.py against server.py with and
+# without --journal and reports moves/s and move round trips; with the journal every update
+# waits for its group-committed fsync before it reaches the players.
+# Part 2 journals --recovery-games games of --moves-per-game random moves in-process, then
+# times server.recover_games() rebuilding them from the raw log and again after a checkpoint
+# has compacted the log into one snapshot per game.
+# Usage: python benchmarks/bench_journal.py [--games N] [--duration S] [--recovery-games G] [--moves-per-game M]
+import argparse
+import asyncio
+import contextlib
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.join(REPO_ROOT, 'benchmarks'))
+from bench_server_modes import start_server, percentile, process_stats
+from bench_lock_contention import connect_games, play_game
+import server
+from journal import Journal, list_segments
+from registry import GameRegistry
+
+
+async def drive(port, games, duration, seed):
+    groups = await connect_games(port, games)
+    rng = random.Random(seed)
+    latencies = []
+    started = time.perf_counter()
+    moves = await asyncio.gather(*(play_game(g, random.Random(rng.random()), started + duration, latencies) for g in groups))
+    elapsed = time.perf_counter() - started
+    for group in groups:
+        for player in group.values(): player.writer.close()
+    return sum(moves) / elapsed, latencies
+
+
+def throughput(args, journal_dir):
+    extra = ('--journal', journal_dir) if journal_dir else ()
+    proc = start_server('threaded', args.port, extra)
+    try:
+        moves_per_second, latencies = asyncio.run(drive(args.port, args.games, args.duration, args.seed))
+        stats = process_stats(proc.pid)
+    finally:
+        proc.kill(); proc.wait()
+    return moves_per_second, latencies, stats
+
+
+def journal_games(directory, games, moves_per_game, seed):
+    """Plays games in-process with a journal attached, as a server would. Returns the record count."""
+    journal = Journal(directory)
+    journal.start(lambda: ()) # Nothing to snapshot yet
+    rng = random.Random(seed)
+    for n in range(games):
+        game = server.Game(f"bench-{n:06d}")
+        game.journal = journal
+        game.seat_tokens = {'white': f"w{n}", 'black': f"b{n}"}
+        with game.game_state_lock:
+            game.add_player(object(), 'white')
+            game.add_player(object(), 'black')
+        game.start_game()
+        for _ in range(moves_per_game):
+            color = 'white' if game.turn_step < 2 else 'black'
+            options = game.white_options if color == 'white' else game.black_options
+            choices = [(i, target) for i, targets in enumerate(options) for target in targets]
+            if not choices or game.game_over: break
+            game.apply_move(color, *rng.choice(choices))
+        game.take_deltas()
+    journal.close() # Writes out whatever is still buffered
+    return journal.records
+
+
+def time_recovery(directory):
+    server.game_registry = GameRegistry()
+    journal = Journal(directory)
+    started = time.perf_counter()
+    recovered = server.recover_games(journal)
+    elapsed = time.perf_counter() - started
+    return journal, recovered, elapsed
+
+
+def recovery(args):
+    directory = tempfile.mkdtemp(prefix='bench-journal-')
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull): # Game prints every move
+            records = journal_games(directory, args.recovery_games, args.moves_per_game, args.seed)
+            log_bytes = sum(os.path.getsize(path) for _, path in list_segments(directory))
+            journal, recovered, raw_seconds = time_recovery(directory)
+            journal.start(server.game_registry.values) # Checkpoint: one snapshot per live game
+            journal.close()
+            snapshot_bytes = sum(os.path.getsize(path) for _, path in list_segments(directory))
+            _, recovered_again, snapshot_seconds = time_recovery(directory)
+        print(f"recovery of {len(recovered)} games ({records} records, {log_bytes / 1e6:.1f} MB log): {raw_seconds:.2f} s")
+        print(f"recovery of {len(recovered_again)} games after a checkpoint ({snapshot_bytes / 1e6:.1f} MB): {snapshot_seconds:.2f} s")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cost of the move journal and time to recover from it")
+    parser.add_argument('--games', type=int, default=100, help="concurrent games for the throughput runs")
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--recovery-games', type=int, default=10000)
+    parser.add_argument('--moves-per-game', type=int, default=40)
+    parser.add_argument('--port', type=int, default=5721)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--skip-throughput', action='store_true')
+    args = parser.parse_args()
+
+    if not args.skip_throughput:
+        journal_dir = tempfile.mkdtemp(prefix='bench-journal-')
+        try:
+            for label, directory in (('journal off', None), ('journal on', journal_dir)):
+                moves_per_second, latencies, stats = throughput(args, directory)
+                print(f"{label:12} moves/s {moves_per_second:7.0f}  round trip p50 {percentile(latencies, 0.5) * 1000:.2f} ms  "
+                      f"p99 {percentile(latencies, 0.99) * 1000:.2f} ms  server cpu {stats.get('cpu_seconds')} s")
+        finally:
+            shutil.rmtree(journal_dir, ignore_errors=True)
+    recovery(args)
@@ -0,0 +1,228 @@
+# ######## bench_legal_moves.py (Legal Move Generation: Perft Check and Per-Move Cost) ########
+# Part 1 walks the legal move tree of well-known positions with movegen.perft and compares
+# the leaf counts with the published ones, which catches any check, pin, castling, en passant
+# or promotion bug. Part 2 plays random games through Game.apply_move and compares the time
+# spent updating options after each move (incremental pseudo-legal lists plus the legal
+# filter) with a full rebuild of both sides on the same positions: the budget is the original
+# list-based check_options the server ran before movegen; the bitboard check_options rebuild
+# (pseudo-legal only) is shown alongside for reference.
+# Usage: python benchmarks/bench_legal_moves.py [--depth D] [--games N] [--seed S]
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+from bench_incremental_options import TimedGame
+import server
+from movegen import perft, position_from_fen, check_options, START_FEN, PROMOTION_PIECES
+
+# (name, FEN, leaf counts for depth 1, 2, 3...) from the usual perft reference positions
+PERFT_POSITIONS = (
+    ('start', START_FEN, (20, 400, 8902, 197281, 4865609)),
+    ('kiwipete', 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1', (48, 2039, 97862, 4085603)),
+    ('endgame', '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1', (14, 191, 2812, 43238, 674624)),
+    ('promotions', 'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1', (6, 264, 9467, 422333)),
+    ('discovered', 'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8', (44, 1486, 62379, 2103487)),
+    ('middlegame', 'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10', (46, 2079, 89890, 3894594)),
+)
+
+
+# --- The Original Generator ---
+# The per-move budget is set against what the server did before this series: rebuild both
+# sides' lists after every move with the list-based helpers below (the pre-series code, renamed).
+def original_check_options(pieces, locations, turn_color, white_locations_global, black_locations_global):
+    """server.check_options as it was before movegen: every target probed in the location lists."""
+    moves_list = []
+    all_moves_list = []
+    current_white_locations = white_locations_global
+    current_black_locations = black_locations_global
+
+    for i in range(len(pieces)):
+        if not (0 <= i < len(locations)): continue # Safety check
+        location = locations[i]
+        piece = pieces[i]
+        if piece not in ['pawn', 'rook', 'knight', 'bishop', 'queen', 'king']: continue
+
+        w_locs_context = current_white_locations
+        b_locs_context = current_black_locations
+
+        if piece == 'pawn':
+            moves_list = original_check_pawn(location, turn_color, w_locs_context, b_locs_context)
+        elif piece == 'rook':
+            moves_list = original_check_rook(location, turn_color, w_locs_context, b_locs_context)
+        elif piece == 'knight':
+            moves_list = original_check_knight(location, turn_color, w_locs_context, b_locs_context)
+        elif piece == 'bishop':
+            moves_list = original_check_bishop(location, turn_color, w_locs_context, b_locs_context)
+        elif piece == 'queen':
+            moves_list = original_check_queen(location, turn_color, w_locs_context, b_locs_context)
+        elif piece == 'king':
+            moves_list = original_check_king(location, turn_color, w_locs_context, b_locs_context)
+        all_moves_list.append(moves_list)
+    return all_moves_list
+
+def original_check_pawn(position, color, w_locs, b_locs):
+    moves_list = []
+    if color == 'white':
+        if (position[0], position[1] + 1) not in w_locs and \
+           (position[0], position[1] + 1) not in b_locs and position[1] < 7:
+            moves_list.append((position[0], position[1] + 1))
+        if position[1] == 1 and \
+           (position[0], position[1] + 1) not in w_locs and \
+           (position[0], position[1] + 1) not in b_locs and \
+           (position[0], position[1] + 2) not in w_locs and \
+           (position[0], position[1] + 2) not in b_locs and position[1] < 6:
+            moves_list.append((position[0], position[1] + 2))
+        if position[0] < 7 and position[1] < 7 and (position[0] + 1, position[1] + 1) in b_locs:
+            moves_list.append((position[0] + 1, position[1] + 1))
+        if position[0] > 0 and position[1] < 7 and (position[0] - 1, position[1] + 1) in b_locs:
+            moves_list.append((position[0] - 1, position[1] + 1))
+    else: # Black's turn
+        if (position[0], position[1] - 1) not in w_locs and \
+           (position[0], position[1] - 1) not in b_locs and position[1] > 0:
+            moves_list.append((position[0], position[1] - 1))
+        if position[1] == 6 and \
+           (position[0], position[1] - 1) not in w_locs and \
+           (position[0], position[1] - 1) not in b_locs and \
+           (position[0], position[1] - 2) not in w_locs and \
+           (position[0], position[1] - 2) not in b_locs and position[1] > 1:
+            moves_list.append((position[0], position[1] - 2))
+        if position[0] < 7 and position[1] > 0 and (position[0] + 1, position[1] - 1) in w_locs:
+            moves_list.append((position[0] + 1, position[1] - 1))
+        if position[0] > 0 and position[1] > 0 and (position[0] - 1, position[1] - 1) in w_locs:
+            moves_list.append((position[0] - 1, position[1] - 1))
+    return moves_list
+
+def original_check_rook(position, color, w_locs, b_locs):
+    moves_list = []
+    friends_list = w_locs if color == 'white' else b_locs
+    enemies_list = b_locs if color == 'white' else w_locs
+    directions = [(0, 1), (0, -1), (1, 0), (-1, 0)]
+    for dx, dy in directions:
+        for i in range(1, 8):
+            target_x, target_y = position[0] + i * dx, position[1] + i * dy
+            target_coords = (target_x, target_y)
+            if 0 <= target_x <= 7 and 0 <= target_y <= 7:
+                if target_coords not in friends_list:
+                    moves_list.append(target_coords)
+                    if target_coords in enemies_list: break
+                else: break
+            else: break
+    return moves_list
+
+def original_check_knight(position, color, w_locs, b_locs):
+    moves_list = []
+    friends_list = w_locs if color == 'white' else b_locs
+    targets = [(1, 2), (1, -2), (2, 1), (2, -1), (-1, 2), (-1, -2), (-2, 1), (-2, -1)]
+    for dx, dy in targets:
+        target_x, target_y = position[0] + dx, position[1] + dy
+        target_coords = (target_x, target_y)
+        if 0 <= target_x <= 7 and 0 <= target_y <= 7:
+            if target_coords not in friends_list:
+                moves_list.append(target_coords)
+    return moves_list
+
+def original_check_bishop(position, color, w_locs, b_locs):
+    moves_list = []
+    friends_list = w_locs if color == 'white' else b_locs
+    enemies_list = b_locs if color == 'white' else w_locs
+    directions = [(1, 1), (1, -1), (-1, 1), (-1, -1)]
+    for dx, dy in directions:
+        for i in range(1, 8):
+            target_x, target_y = position[0] + i * dx, position[1] + i * dy
+            target_coords = (target_x, target_y)
+            if 0 <= target_x <= 7 and 0 <= target_y <= 7:
+                if target_coords not in friends_list:
+                    moves_list.append(target_coords)
+                    if target_coords in enemies_list: break
+                else: break
+            else: break
+    return moves_list
+
+def original_check_queen(position, color, w_locs, b_locs):
+    moves_list = original_check_bishop(position, color, w_locs, b_locs)
+    moves_list.extend(original_check_rook(position, color, w_locs, b_locs))
+    return moves_list
+
+def original_check_king(position, color, w_locs, b_locs):
+    moves_list = []
+    friends_list = w_locs if color == 'white' else b_locs
+    targets = [(1, 0), (1, 1), (1, -1), (-1, 0), (-1, 1), (-1, -1), (0, 1), (0, -1)]
+    for dx, dy in targets:
+        target_x, target_y = position[0] + dx, position[1] + dy
+        target_coords = (target_x, target_y)
+        if 0 <= target_x <= 7 and 0 <= target_y <= 7:
+            if target_coords not in friends_list:
+                moves_list.append(target_coords)
+    # Add check validation and castling later
+    return moves_list
+
+
+def run_perft(depth):
+    """Prints one line per position; returns True if every count matched."""
+    all_ok = True
+    for name, fen, expected in PERFT_POSITIONS:
+        d = min(depth, len(expected))
+        started = time.perf_counter()
+        nodes = perft(position_from_fen(fen), d)
+        elapsed = time.perf_counter() - started
+        ok = nodes == expected[d - 1]
+        all_ok = all_ok and ok
+        print(f"perft {name:<11} depth {d}: {nodes:>9} nodes (expected {expected[d - 1]:>9}) "
+              f"{'ok' if ok else 'MISMATCH'}  {nodes / elapsed if elapsed else 0:9.0f} nodes/s")
+    return all_ok
+
+
+def per_move_cost(games, seed, max_plies=200):
+    """(moves, us per move updating options, us per move for an original list-based rebuild of
+    both sides, us per move for a bitboard check_options rebuild of both sides)."""
+    server.INCREMENTAL_OPTIONS = True
+    server.OPTIONS_CACHE_ENABLED = False # Time generation, not cache hits
+    TimedGame.recalc_seconds = 0.0
+    TimedGame.recalc_calls = 0
+    original_seconds = rebuild_seconds = 0.0
+    rng = random.Random(seed)
+    with contextlib.redirect_stdout(io.StringIO()): # Game logs every move
+        for game_number in range(games):
+            game = TimedGame(f"bench-{game_number}")
+            for _ in range(max_plies):
+                if game.game_over: break
+                color = 'white' if game.turn_step < 2 else 'black'
+                options = game.white_options if color == 'white' else game.black_options
+                index, target = rng.choice([(i, target) for i, moves in enumerate(options) for target in moves])
+                pieces = game.white_pieces if color == 'white' else game.black_pieces
+                promotion = rng.choice(PROMOTION_PIECES) if pieces[index] == 'pawn' and target[1] in (0, 7) else None
+                game.apply_move(color, index, target, promotion)
+                started = time.perf_counter()
+                original_check_options(game.white_pieces, game.white_locations, 'white', game.white_locations, game.black_locations)
+                original_check_options(game.black_pieces, game.black_locations, 'black', game.white_locations, game.black_locations)
+                original_seconds += time.perf_counter() - started
+                started = time.perf_counter()
+                check_options(game.white_pieces, game.white_locations, 'white', game.white_locations, game.black_locations)
+                check_options(game.black_pieces, game.black_locations, 'black', game.white_locations, game.black_locations)
+                rebuild_seconds += time.perf_counter() - started
+    calls = max(1, TimedGame.recalc_calls)
+    return (TimedGame.recalc_calls, TimedGame.recalc_seconds / calls * 1e6,
+            original_seconds / calls * 1e6, rebuild_seconds / calls * 1e6)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Perft check and per-move cost of legal move generation")
+    parser.add_argument('--depth', type=int, default=3, help="perft depth (4 takes a minute or so)")
+    parser.add_argument('--games', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    perft_ok = run_perft(args.depth)
+    moves, legal_us, original_us, rebuild_us = per_move_cost(args.games, args.seed)
+    print(f"Moves played:                          {moves}")
+    print(f"Legal options update per move:         {legal_us:8.1f} us")
+    print(f"Original check_options (both sides):   {original_us:8.1f} us  (budget)")
+    print(f"Bitboard check_options (both sides):   {rebuild_us:8.1f} us  (pseudo-legal only, {legal_us / rebuild_us:.2f}x)")
+    print(f"Within budget:                         {'yes' if legal_us <= original_us else 'NO'} ({legal_us / original_us:.2f}x)")
+    if not perft_ok: sys.exit(1)
@@ -0,0 +1,107 @@
+# ######## bench_lock_contention.py (Threaded Server Under Many Simultaneous Games) ########
+# Starts server.py, opens hundreds of games at once and has every game play random moves as
+# fast as its two players can round-trip them, while extra clients keep connecting, pairing
+# and disconnecting (the paths that used to close sockets under the global games_lock).
+# Reports total move throughput and the round-trip latency each mover sees.
+# Usage: python benchmarks/bench_lock_contention.py [--games N] [--duration S] [--churn-pairs C]
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.join(REPO_ROOT, 'benchmarks'))
+from bench_server_modes import start_server, percentile, process_stats
+from bench_spectators import Player
+
+
+async def connect_games(port, games):
+    """Connects 2 * games players and groups them by the game the server put them in."""
+    players = []
+    for i in range(2 * games):
+        players.append(asyncio.create_task(Player.connect(port)))
+        if i % 100 == 99: await asyncio.sleep(0.05)
+    players = await asyncio.gather(*players)
+    async def assigned(player):
+        while player.color is None or not player.state: await player.receive()
+    await asyncio.gather(*(assigned(p) for p in players))
+    by_game = {}
+    for player in players:
+        by_game.setdefault(player.state['game_id'], {})[player.color] = player
+    return list(by_game.values())
+
+
+async def play_game(players, rng, deadline, latencies):
+    white, black = players['white'], players['black']
+    moves = 0
+    while time.perf_counter() < deadline and not white.state.get('game_over'):
+        mover = white if white.state['turn_step'] < 2 else black
+        options = mover.state[f'{mover.color}_options']
+        choices = [(i, target) for i, targets in enumerate(options) for target in targets]
+        if not choices: break
+        seq_before = mover.state['seq']
+        sent_at = time.perf_counter()
+        mover.send('move', rng.choice(choices))
+        while mover.state.get('seq', 0) <= seq_before: await mover.receive()
+        latencies.append(time.perf_counter() - sent_at)
+        other = black if mover is white else white
+        while other.state.get('seq', 0) < mover.state['seq']: await other.receive()
+        moves += 1
+    return moves
+
+
+async def churn(port, deadline, counter):
+    """Pairs two fresh clients, waits for their game to start, then drops both."""
+    while time.perf_counter() < deadline:
+        first = await Player.connect(port)
+        second = await Player.connect(port)
+        for player in (first, second):
+            while player.color is None or not player.state: await player.receive()
+            player.writer.close()
+        counter[0] += 1
+
+
+async def run(port, args, server_pid):
+    games = await connect_games(port, args.games)
+    rng = random.Random(args.seed)
+    latencies, churned = [], [0]
+    started = time.perf_counter()
+    deadline = started + args.duration
+    churners = [asyncio.create_task(churn(port, deadline, churned)) for _ in range(args.churn_pairs)]
+    moves = await asyncio.gather(*(play_game(g, random.Random(rng.random()), deadline, latencies) for g in games))
+    await asyncio.gather(*churners)
+    elapsed = time.perf_counter() - started
+    stats = process_stats(server_pid) # Before the players disconnect
+    for game in games:
+        for player in game.values(): player.writer.close()
+    return len(games), sum(moves) / elapsed, latencies, churned[0] / elapsed, stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move throughput of server.py with many concurrent games")
+    parser.add_argument('--games', type=int, default=300)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--churn-pairs', type=int, default=4, help="clients repeatedly pairing and disconnecting")
+    parser.add_argument('--port', type=int, default=5711)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+    proc = start_server('threaded', args.port)
+    try:
+        games, moves_per_second, latencies, churn_per_second, stats = asyncio.run(run(args.port, args, proc.pid))
+    finally:
+        proc.kill(); proc.wait()
+    print(f"games {games}  moves/s {moves_per_second:.0f}  pairings+disconnects/s {churn_per_second:.1f}")
+    print(f"move round trip  p50 {percentile(latencies, 0.5) * 1000:.2f} ms  "
+          f"p99 {percentile(latencies, 0.99) * 1000:.2f} ms  max {max(latencies or [0]) * 1000:.2f} ms")
+    print(f"server threads {stats.get('threads')}  cpu {stats.get('cpu_seconds')} s")
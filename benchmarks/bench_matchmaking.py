@@ -0,0 +1,96 @@
+# ######## bench_matchmaking.py (Matchmaking Simulation: Wait Times, Match Quality, CPU) ########
+# Feeds synthetic player arrivals (Poisson, normally distributed ratings) through the
+# Matchmaker on a simulated clock, with the periodic widening sweep servers run, and compares
+# it with the old waiting_players.popitem() pairing. Reports wait and rating-gap percentiles
+# (simulated seconds / rating points) and the real CPU time spent per pairing.
+# Usage: python benchmarks/bench_matchmaking.py [--arrivals-per-minute N] [--minutes M] [--rating-sd SD]
+import argparse
+import os
+import random
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+from matchmaking import Matchmaker, MATCH_SWEEP_INTERVAL
+
+
+def arrivals(rate_per_second, seconds, rating_mean, rating_sd, seed):
+    rng = random.Random(seed)
+    now = 0.0
+    while True:
+        now += rng.expovariate(rate_per_second)
+        if now >= seconds: return
+        yield now, max(1, min(3000, int(rng.gauss(rating_mean, rating_sd))))
+
+
+def percentile(samples, fraction):
+    if not samples: return float('nan')
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def simulate_matchmaker(events):
+    clock = [0.0]
+    matchmaker = Matchmaker(clock=lambda: clock[0])
+    waits, gaps = [], []
+    next_sweep = MATCH_SWEEP_INTERVAL
+    cpu = 0.0
+    for key, (at, rating) in enumerate(events):
+        while next_sweep <= at: # Sweeps that would have run before this arrival
+            clock[0] = next_sweep
+            started = time.process_time()
+            pairs = matchmaker.sweep()
+            cpu += time.process_time() - started
+            for first, second in pairs:
+                waits += [clock[0] - first.enqueued_at, clock[0] - second.enqueued_at]
+                gaps.append(abs(first.rating - second.rating))
+            next_sweep += MATCH_SWEEP_INTERVAL
+        clock[0] = at
+        started = time.process_time()
+        opponent = matchmaker.join(key, rating)
+        cpu += time.process_time() - started
+        if opponent:
+            waits += [at - opponent.enqueued_at, 0.0]
+            gaps.append(abs(opponent.rating - rating))
+    return waits, gaps, matchmaker.pairings, cpu, len(matchmaker)
+
+
+def simulate_popitem(events):
+    waiting = {} # {key: (arrived_at, rating)}, paired exactly like the old handle_client
+    waits, gaps = [], []
+    cpu = 0.0
+    for key, (at, rating) in enumerate(events):
+        started = time.process_time()
+        if waiting:
+            _, (waited_since, other_rating) = waiting.popitem()
+            paired = True
+        else:
+            waiting[key] = (at, rating)
+            paired = False
+        cpu += time.process_time() - started
+        if paired:
+            waits += [at - waited_since, 0.0]
+            gaps.append(abs(rating - other_rating))
+    return waits, gaps, len(gaps), cpu, len(waiting)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Matchmaking simulation")
+    parser.add_argument('--arrivals-per-minute', type=int, default=100000)
+    parser.add_argument('--minutes', type=float, default=1.0)
+    parser.add_argument('--rating-mean', type=int, default=1500)
+    parser.add_argument('--rating-sd', type=int, default=350)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    seconds = args.minutes * 60
+    events = list(arrivals(args.arrivals_per_minute / 60.0, seconds, args.rating_mean, args.rating_sd, args.seed))
+    print(f"{len(events)} arrivals over {seconds:.0f} simulated s, ratings ~ N({args.rating_mean}, {args.rating_sd})")
+    print(f"{'policy':<12}{'pairs':>8}{'left':>6}{'wait p50 s':>12}{'wait p99 s':>12}{'gap p50':>9}{'gap p99':>9}"
+          f"{'cpu ms':>9}{'us/pair':>9}")
+    for name, simulate in (('popitem', simulate_popitem), ('matchmaker', simulate_matchmaker)):
+        waits, gaps, pairs, cpu, left = simulate(events)
+        print(f"{name:<12}{pairs:>8}{left:>6}{percentile(waits, 0.5):>12.3f}{percentile(waits, 0.99):>12.3f}"
+              f"{percentile(gaps, 0.5):>9.0f}{percentile(gaps, 0.99):>9.0f}{cpu * 1000:>9.1f}"
+              f"{cpu / max(1, pairs) * 1e6:>9.2f}")
@@ -0,0 +1,116 @@
+# ######## bench_metrics.py (Metrics Instrumentation Overhead) ########
+# Part 1 times each recording primitive of metrics.py: Counter.inc, Histogram.observe, a call
+# through Histogram.timed and a with-block on a TimedLock, each next to the bare operation it
+# is added to. Part 2 checks that per-thread cells lose nothing: --threads threads increment
+# one Counter and observe into one Histogram at once, and the totals must come out exact.
+# Part 3 replays random games through server.Game.apply_move (as bench_options_cache does)
+# and reads the server's own histograms to find how many recordings one move makes, which
+# gives the instrumentation cost per move next to the move's own time. It also times a scrape.
+# Usage: python benchmarks/bench_metrics.py [--calls N] [--threads T] [--games G] [--plies P]
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+from bench_options_cache import random_move
+import metrics
+import server
+
+
+def per_call_ns(function, calls):
+    start = time.perf_counter()
+    for _ in range(calls): function()
+    return (time.perf_counter() - start) / calls * 1e9
+
+
+def primitive_costs(calls):
+    """{name: (ns bare, ns instrumented)}."""
+    registry = metrics.Registry()
+    counter = metrics.Counter('bench_total', "bench", registry=registry)
+    histogram = metrics.Histogram('bench_seconds', "bench", registry=registry)
+    plain_lock, timed_lock = threading.Lock(), metrics.TimedLock(histogram)
+    noop = lambda: None
+    timed_noop = histogram.timed(noop)
+    def with_plain():
+        with plain_lock: pass
+    def with_timed():
+        with timed_lock: pass
+    return {
+        'Counter.inc': (per_call_ns(noop, calls), per_call_ns(counter.inc, calls)),
+        'Histogram.observe': (per_call_ns(noop, calls), per_call_ns(lambda: histogram.observe(0.003), calls)),
+        'Histogram.timed call': (per_call_ns(noop, calls), per_call_ns(timed_noop, calls)),
+        'with lock (free)': (per_call_ns(with_plain, calls), per_call_ns(with_timed, calls)),
+    }
+
+
+def threaded_totals(threads, calls):
+    """(counter total, histogram count, expected) after threads record calls times each at once."""
+    registry = metrics.Registry()
+    counter = metrics.Counter('bench_threads_total', "bench", registry=registry)
+    histogram = metrics.Histogram('bench_threads_seconds', "bench", registry=registry)
+    def work():
+        for i in range(calls):
+            counter.inc()
+            histogram.observe(i * 1e-6)
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    for worker in workers: worker.start()
+    for worker in workers: worker.join()
+    return counter.value, histogram.snapshot()[1], threads * calls
+
+
+def replay_moves(games, plies, seed):
+    """(moves played, seconds in apply_move) for random games, played straight through Game."""
+    rng = random.Random(seed)
+    moves, seconds = 0, 0.0
+    with contextlib.redirect_stdout(io.StringIO()): # Game logs every move
+        for game_number in range(games):
+            game = server.Game(f"bench-{game_number}")
+            for _ in range(plies):
+                move = None if game.game_over else random_move(game, rng)
+                if move is None: break
+                started = time.perf_counter()
+                game.apply_move(*move)
+                seconds += time.perf_counter() - started
+                moves += 1
+    return moves, seconds
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Metrics instrumentation overhead")
+    parser.add_argument('--calls', type=int, default=200000, help="calls per primitive timed")
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--games', type=int, default=40)
+    parser.add_argument('--plies', type=int, default=60)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    costs = primitive_costs(args.calls)
+    for name, (bare_ns, instrumented_ns) in costs.items():
+        print(f"{name + ':':<22} {instrumented_ns:7.0f} ns (bare {bare_ns:.0f} ns, +{instrumented_ns - bare_ns:.0f} ns)")
+
+    counted, observed, expected = threaded_totals(args.threads, args.calls // args.threads)
+    print(f"{args.threads} threads at once:      counter {counted}, histogram {observed}, expected {expected}"
+          f" -> {'exact' if counted == observed == expected else 'LOST UPDATES'}")
+
+    recordings = (server.APPLY_MOVE_SECONDS, server.OPTIONS_UPDATE_SECONDS, server.CHECK_OPTIONS_SECONDS, server.GAME_LOCK_WAIT)
+    before = [histogram.snapshot()[1] for histogram in recordings]
+    moves, seconds = replay_moves(args.games, args.plies, args.seed)
+    per_move = {histogram.name + (f"{{lock={histogram.labels['lock']}}}" if histogram.labels else ''): (histogram.snapshot()[1] - count) / moves
+                for histogram, count in zip(recordings, before)}
+    timed_ns = costs['Histogram.timed call'][1] - costs['Histogram.timed call'][0]
+    lock_ns = costs['with lock (free)'][1] - costs['with lock (free)'][0]
+    lock_key = 'chess_lock_wait_seconds{lock=game_state}'
+    overhead_ns = sum(n for name, n in per_move.items() if name != lock_key) * timed_ns + per_move[lock_key] * lock_ns
+    print(f"Moves replayed:         {moves}, {seconds / moves * 1e6:.1f} us each in apply_move")
+    print("Recordings per move:    " + ', '.join(f"{name} {n:.2f}" for name, n in per_move.items()))
+    print(f"Instrumentation:        ~{overhead_ns / 1000:.2f} us per move = {overhead_ns / 1000 / (seconds / moves * 1e6):.1%} of apply_move")
+
+    start = time.perf_counter()
+    text = metrics.REGISTRY.render()
+    print(f"Scrape:                 {(time.perf_counter() - start) * 1000:.2f} ms for {len(text)} bytes, {text.count(chr(10))} lines")
@@ -0,0 +1,88 @@
+# ######## bench_options_cache.py (Shared Options Cache: Hit Rate and Per-Move Cost) ########
+# Real games share their openings, so the same positions come up again and again across the
+# games of one process. This plays games that each start with one of --lines opening lines
+# (random, but fixed by --seed) of --book-plies moves and then carry on at random, and times
+# the option update after every move with the shared cache on and off. The two alternate for
+# --repeats rounds and the best round of each counts, since timings on a busy box are noisy.
+# Usage: python benchmarks/bench_options_cache.py [--games N] [--lines L] [--book-plies P] [--repeats R] [--seed S]
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+from bench_incremental_options import TimedGame
+import server
+from zobrist import options_cache
+
+
+def random_move(game, rng):
+    """(color, index, target) of a random legal move, or None if there is none."""
+    color = 'white' if game.turn_step < 2 else 'black'
+    options = game.white_options if color == 'white' else game.black_options
+    choices = [(i, target) for i, moves in enumerate(options) for target in moves]
+    return (color, *rng.choice(choices)) if choices else None
+
+
+def opening_book(lines, plies, seed):
+    """lines random opening lines, each a list of (color, index, target)."""
+    rng = random.Random(seed)
+    book = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for line_number in range(lines):
+            game = server.Game(f"book-{line_number}")
+            line = []
+            for _ in range(plies):
+                move = random_move(game, rng)
+                if move is None or not game.apply_move(*move) or game.game_over: break
+                line.append(move)
+            book.append(line)
+    return book
+
+
+def run(cached, book, games, seed, max_plies=120):
+    """(moves, us per move updating options, cache stats) for games opening from book."""
+    server.INCREMENTAL_OPTIONS = True
+    server.OPTIONS_CACHE_ENABLED = cached
+    options_cache.clear()
+    TimedGame.recalc_seconds = 0.0
+    TimedGame.recalc_calls = 0
+    rng = random.Random(seed)
+    with contextlib.redirect_stdout(io.StringIO()): # Game logs every move
+        for game_number in range(games):
+            game = TimedGame(f"bench-{game_number}")
+            for move in rng.choice(book): game.apply_move(*move)
+            for _ in range(max_plies):
+                move = None if game.game_over else random_move(game, rng)
+                if move is None: break
+                game.apply_move(*move)
+    calls = max(1, TimedGame.recalc_calls)
+    return TimedGame.recalc_calls, TimedGame.recalc_seconds / calls * 1e6, options_cache.stats()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hit rate and per-move cost of the shared options cache")
+    parser.add_argument('--games', type=int, default=500)
+    parser.add_argument('--lines', type=int, default=20, help="distinct opening lines the games share")
+    parser.add_argument('--book-plies', type=int, default=12, help="moves in each opening line")
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    book = opening_book(args.lines, args.book_plies, args.seed)
+    off_us = on_us = float('inf')
+    for _ in range(args.repeats):
+        moves, us, _ = run(False, book, args.games, args.seed)
+        off_us = min(off_us, us)
+        _, us, stats = run(True, book, args.games, args.seed)
+        on_us = min(on_us, us)
+    book_moves = sum(len(line) for line in book) / len(book)
+    print(f"Moves played:                {moves} ({book_moves:.1f} from the book per game)")
+    print(f"Cache hit rate:              {stats['hit_rate']:8.1%} ({stats['hits']} hits, {stats['misses']} misses, "
+          f"{stats['evictions']} evicted, {stats['entries']} kept)")
+    print(f"Options update, cache off:   {off_us:8.1f} us per move")
+    print(f"Options update, cache on:    {on_us:8.1f} us per move")
+    print(f"Speedup:                     {off_us / on_us if on_us else float('inf'):8.2f}x")
@@ -0,0 +1,103 @@
+# ######## bench_position_view.py (Client Per-Frame Position Lookups: List Scans vs PositionView) ########
+# Every frame the client finds the pieces to draw, whether a king is in check and, on a click,
+# which piece is under the mouse. It used to answer those from the state's lists: flattening
+# both sides' options and scanning them for the kings, list.index for the king and the clicked
+# square. Now it builds a position.PositionView once per received state and does dict and set
+# lookups. This replays the positions of random games (the first --plies moves, so the boards
+# are full) and times that per-frame work both ways, plus the cost of building each view.
+# No drawing is timed; see client.py --frame-stats for that.
+# Usage: python benchmarks/bench_position_view.py [--games N] [--plies P] [--frames F] [--seed S]
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+from bench_options_cache import random_move
+import server
+from position import PositionView
+
+
+def collect_states(games, plies, seed):
+    """State dicts, as the client receives them, after each of the first plies moves of games."""
+    rng = random.Random(seed)
+    states = []
+    with contextlib.redirect_stdout(io.StringIO()): # Game logs every move
+        for game_number in range(games):
+            game = server.Game(f"bench-{game_number}")
+            for _ in range(plies):
+                states.append(game.get_state())
+                move = None if game.game_over else random_move(game, rng)
+                if move is None: break
+                game.apply_move(*move)
+    return states
+
+
+def frame_from_lists(state, click):
+    """The lookups a frame used to do against the state's lists."""
+    scene = {}
+    for color in ('white', 'black'):
+        for i, (piece, loc) in enumerate(zip(state[f'{color}_pieces'], state[f'{color}_locations'])):
+            scene[tuple(loc)] = (color, piece, i)
+    w_flat = [move for moves in state['white_options'] for move in moves]
+    b_flat = [move for moves in state['black_options'] for move in moves]
+    check = None
+    w_king = state['white_locations'][state['white_pieces'].index('king')]
+    b_king = state['black_locations'][state['black_pieces'].index('king')]
+    if w_king in b_flat: check = w_king
+    elif b_king in w_flat: check = b_king
+    locations = state['white_locations']
+    clicked = locations.index(click) if click in locations else None
+    return scene, check, clicked
+
+
+def frame_from_view(view, click):
+    """The same lookups against a PositionView."""
+    scene = {square: entry for square, entry in view.pieces.items()}
+    return scene, view.check, view.piece_at(click, 'white')
+
+
+def run(states, frames, seed):
+    """(us per frame from lists, us per frame from views, us per view built)."""
+    rng = random.Random(seed)
+    clicks = [(rng.randrange(8), rng.randrange(8)) for _ in range(frames)]
+
+    start = time.perf_counter()
+    for state in states:
+        for click in clicks: frame_from_lists(state, click)
+    lists_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    views = [PositionView(state) for state in states]
+    build_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for view in views:
+        for click in clicks: frame_from_view(view, click)
+    view_seconds = time.perf_counter() - start
+
+    frame_count = len(states) * frames
+    return lists_seconds / frame_count * 1e6, view_seconds / frame_count * 1e6, build_seconds / len(states) * 1e6
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Client per-frame position lookups: list scans vs PositionView")
+    parser.add_argument('--games', type=int, default=50)
+    parser.add_argument('--plies', type=int, default=20, help="moves replayed per game (early, full boards)")
+    parser.add_argument('--frames', type=int, default=60, help="frames drawn per received state")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    states = collect_states(args.games, args.plies, args.seed)
+    lists_us, view_us, build_us = run(states, args.frames, args.seed)
+    pieces = sum(len(state['white_pieces']) + len(state['black_pieces']) for state in states) / len(states)
+    per_state_view_us = view_us + build_us / args.frames
+    print(f"Positions:                   {len(states)} ({pieces:.1f} pieces on average)")
+    print(f"Per frame, list scans:       {lists_us:8.2f} us")
+    print(f"Per frame, PositionView:     {view_us:8.2f} us (+ {build_us:.1f} us per state to build the view)")
+    print(f"Per frame incl. build:       {per_state_view_us:8.2f} us at {args.frames} frames per state")
+    print(f"Speedup:                     {lists_us / per_state_view_us if per_state_view_us else float('inf'):8.2f}x")
@@ -0,0 +1,176 @@
+# ######## bench_server_modes.py (Threaded vs Event-Loop Server Load Comparison) ########
+# Starts each server mode as a subprocess, opens many client connections over loopback,
+# lets a subset of games play random moves, and reports latency and server resource use.
+# Usage: python benchmarks/bench_server_modes.py [--connections N] [--active-games K] [--duration S]
+import argparse
+import asyncio
+import os
+import pickle
+import random
+import socket
+import struct
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+from protocol import apply_delta, is_delta, is_full_state
+
+SERVER_SCRIPTS = {'threaded': 'server.py', 'async': 'server_async.py'}
+HEADER_SIZE = struct.calcsize('>I')
+
+
+# --- Server Process Helpers ---
+def start_server(mode, port, extra_args=()):
+    proc = subprocess.Popen([sys.executable, os.path.join(REPO_ROOT, SERVER_SCRIPTS[mode]), '--host', '127.0.0.1', '--port', str(port), *extra_args],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=REPO_ROOT)
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f"{mode} server did not start on port {port}")
+
+def process_stats(pid):
+    """Resident memory (KiB), thread count and CPU seconds from /proc (Linux only)."""
+    stats = {'rss_kib': None, 'threads': None, 'cpu_seconds': None}
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'): stats['rss_kib'] = int(line.split()[1])
+                elif line.startswith('Threads:'): stats['threads'] = int(line.split()[1])
+        with open(f'/proc/{pid}/stat') as stat:
+            fields = stat.read().rsplit(')', 1)[1].split()
+            stats['cpu_seconds'] = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        pass
+    return stats
+
+
+# --- Bot Client ---
+class BotStats:
+    def __init__(self):
+        self.connected = 0
+        self.failed = 0
+        self.moves = 0
+        self.latencies = []
+
+async def read_frame(reader):
+    header = await reader.readexactly(HEADER_SIZE)
+    return pickle.loads(await reader.readexactly(struct.unpack('>I', header)[0]))
+
+async def run_bot(port, stats, active, stop_at, rng):
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), timeout=30)
+    except (OSError, asyncio.TimeoutError):
+        stats.failed += 1
+        return
+    stats.connected += 1
+    my_color = None
+    state = {}
+    pending_move_at = None
+    last_turn = None
+    try:
+        while time.time() < stop_at:
+            try:
+                message = await asyncio.wait_for(read_frame(reader), timeout=max(0.1, stop_at - time.time()))
+            except asyncio.TimeoutError:
+                break
+            if isinstance(message, str) and message in ('white', 'black'):
+                my_color = message
+                continue
+            if is_full_state(message):
+                state = message
+            elif is_delta(message):
+                if message['seq'] <= state.get('seq', -1): continue
+                new_state = apply_delta(state, message)
+                if new_state is None:
+                    writer.write(pickle.dumps({'type': 'resync', 'data': None}))
+                    continue
+                state = new_state
+            else: continue
+            if state.get('game_over'): continue
+            turn = 'white' if state['turn_step'] < 2 else 'black'
+            if pending_move_at is not None and turn != last_turn:
+                stats.latencies.append(time.perf_counter() - pending_move_at)
+                stats.moves += 1
+                pending_move_at = None
+            last_turn = turn
+            if active and turn == my_color and pending_move_at is None:
+                options = state.get(f'{my_color}_options', [])
+                choices = [(i, target) for i, moves in enumerate(options) for target in moves]
+                if not choices: continue
+                pending_move_at = time.perf_counter()
+                writer.write(pickle.dumps({'type': 'move', 'data': rng.choice(choices)}))
+    except (OSError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+async def drive_load(port, connections, active_games, duration, seed):
+    stats = BotStats()
+    rng = random.Random(seed)
+    stop_at = time.time() + duration
+    tasks = []
+    for i in range(connections):
+        # Consecutive connections get paired, so game number is i // 2
+        tasks.append(asyncio.create_task(run_bot(port, stats, i // 2 < active_games, stop_at, rng)))
+        if i % 100 == 99: await asyncio.sleep(0.05) # Stagger connects a little
+    await asyncio.sleep(max(0, stop_at - time.time() - 1))
+    await asyncio.gather(*tasks)
+    return stats
+
+
+def percentile(samples, fraction):
+    if not samples: return float('nan')
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def run_mode(mode, port, args):
+    proc = start_server(mode, port)
+    try:
+        cpu_before = process_stats(proc.pid)['cpu_seconds'] or 0.0
+        loop_stats = {}
+        async def drive_and_sample():
+            task = asyncio.create_task(drive_load(port, args.connections, args.active_games, args.duration, args.seed))
+            await asyncio.sleep(max(0.5, args.duration - 1)) # Sample while every connection is still open
+            loop_stats.update(process_stats(proc.pid))
+            return await task
+        stats = asyncio.run(drive_and_sample())
+        cpu_after = process_stats(proc.pid)['cpu_seconds'] or 0.0
+    finally:
+        proc.kill(); proc.wait()
+    return {
+        'mode': mode, 'connected': stats.connected, 'failed': stats.failed, 'moves': stats.moves,
+        'p50_ms': percentile(stats.latencies, 0.5) * 1000, 'p99_ms': percentile(stats.latencies, 0.99) * 1000,
+        'threads': loop_stats.get('threads'), 'rss_mib': (loop_stats.get('rss_kib') or 0) / 1024,
+        'cpu_seconds': cpu_after - cpu_before,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Threaded vs event-loop server load comparison")
+    parser.add_argument('--connections', type=int, default=1000)
+    parser.add_argument('--active-games', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=15.0)
+    parser.add_argument('--port', type=int, default=5601)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--modes', default='threaded,async')
+    args = parser.parse_args()
+
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+    results = [run_mode(mode, args.port + i, args) for i, mode in enumerate(args.modes.split(','))]
+    print(f"{'mode':<10}{'connected':>10}{'failed':>8}{'moves':>8}{'p50 ms':>9}{'p99 ms':>9}{'threads':>9}{'RSS MiB':>9}{'CPU s':>8}")
+    for r in results:
+        print(f"{r['mode']:<10}{r['connected']:>10}{r['failed']:>8}{r['moves']:>8}{r['p50_ms']:>9.2f}{r['p99_ms']:>9.2f}"
+              f"{r['threads'] or 0:>9}{r['rss_mib']:>9.1f}{r['cpu_seconds']:>8.2f}")
@@ -0,0 +1,166 @@
+# ######## bench_spectators.py (Player Move Latency Under Spectator Load) ########
+# Starts a server, pairs two player bots, attaches N spectators to their game from a separate
+# process (some of which stop reading, to force coalescing), then has the players play random
+# moves and reports the round-trip latency each mover sees, with and without the spectators.
+# Usage: python benchmarks/bench_spectators.py [--spectators N] [--slow-fraction F] [--moves M] [--modes threaded,async]
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import struct
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.join(REPO_ROOT, 'benchmarks'))
+import wire
+from protocol import apply_delta, is_delta, is_full_state
+from bench_server_modes import start_server, percentile, process_stats
+
+HEADER = struct.Struct('>I')
+
+
+# --- Player Bots ---
+class Player:
+    def __init__(self, reader, writer, codec):
+        self.reader, self.writer, self.codec = reader, writer, codec
+        self.color = None
+        self.state = {}
+
+    @classmethod
+    async def connect(cls, port):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(wire.client_handshake())
+        codec = wire.parse_handshake_ack(await reader.readexactly(wire.HANDSHAKE_ACK_SIZE))
+        return cls(reader, writer, codec)
+
+    async def receive(self):
+        length = HEADER.unpack(await self.reader.readexactly(HEADER.size))[0]
+        message = self.codec.decode(await self.reader.readexactly(length))
+        if isinstance(message, str): self.color = message
+        elif is_full_state(message): self.state = message
+        elif is_delta(message) and message['seq'] > self.state.get('seq', -1):
+            self.state = apply_delta(self.state, message) or self.state
+        return message
+
+    def send(self, message_type, data):
+        self.writer.write(wire.frame_message({'type': message_type, 'data': data}, self.codec))
+
+
+async def play(port, moves, seed, game_id_ready, spectators_ready):
+    first = await Player.connect(port)
+    await asyncio.sleep(0.05) # Make sure the first one is queued before the second connects
+    second = await Player.connect(port)
+    for player in (first, second):
+        while player.color is None or not player.state: await player.receive()
+    game_id_ready(first.state['game_id'])
+    await spectators_ready()
+
+    players = {first.color: first, second.color: second}
+    rng = random.Random(seed)
+    latencies = []
+    for _ in range(moves):
+        if first.state.get('game_over'): break
+        mover = players['white' if first.state['turn_step'] < 2 else 'black']
+        options = mover.state[f'{mover.color}_options']
+        choices = [(i, target) for i, targets in enumerate(options) for target in targets]
+        if not choices: break
+        seq_before = mover.state['seq']
+        sent_at = time.perf_counter()
+        mover.send('move', rng.choice(choices))
+        while mover.state.get('seq', 0) <= seq_before: await mover.receive()
+        latencies.append(time.perf_counter() - sent_at)
+        other = second if mover is first else first
+        while other.state.get('seq', 0) < mover.state['seq']: await other.receive()
+    for player in (first, second): player.writer.close()
+    return latencies
+
+
+# --- Spectator Swarm (separate process so it does not share a CPU with the player bots) ---
+def spectator_swarm(port, game_id, count, slow_fraction, ready, stop, received):
+    async def watch(index, connected):
+        try:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        except OSError:
+            return
+        writer.write(wire.client_handshake(spectate_game_id=game_id))
+        try:
+            await reader.readexactly(wire.HANDSHAKE_ACK_SIZE)
+            connected.append(index)
+            if index < count * slow_fraction:
+                while not stop.is_set(): await asyncio.sleep(0.1) # Never reads: the server must coalesce
+                return
+            while not stop.is_set():
+                chunk = await asyncio.wait_for(reader.read(65536), 0.5)
+                if not chunk: return
+                received.value += len(chunk)
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            if not stop.is_set(): await asyncio.sleep(0) # Timed out between moves; loop again
+        finally:
+            writer.close()
+
+    async def main():
+        connected = []
+        tasks = []
+        for i in range(count):
+            tasks.append(asyncio.create_task(watch(i, connected)))
+            if i % 50 == 49: await asyncio.sleep(0.05) # threaded server listens with a small backlog
+        while len(connected) < count and any(not t.done() for t in tasks): await asyncio.sleep(0.05)
+        ready.set()
+        await asyncio.gather(*tasks)
+    asyncio.run(main())
+
+
+def run_mode(mode, port, args, spectators):
+    proc = start_server(mode, port)
+    ready, stop = multiprocessing.Event(), multiprocessing.Event()
+    received = multiprocessing.Value('q', 0)
+    swarm = []
+    def game_id_ready(game_id):
+        if not spectators: return ready.set()
+        swarm.append(multiprocessing.Process(target=spectator_swarm, daemon=True,
+                                             args=(port, game_id, spectators, args.slow_fraction, ready, stop, received)))
+        swarm[0].start()
+    async def spectators_ready():
+        while not ready.is_set(): await asyncio.sleep(0.05)
+    try:
+        latencies = asyncio.run(play(port, args.moves, args.seed, game_id_ready, spectators_ready))
+        server_stats = process_stats(proc.pid)
+    finally:
+        stop.set()
+        for process in swarm: process.join(timeout=5)
+        proc.kill(); proc.wait()
+    return {
+        'mode': mode, 'spectators': spectators, 'moves': len(latencies),
+        'p50_ms': percentile(latencies, 0.5) * 1000, 'p99_ms': percentile(latencies, 0.99) * 1000,
+        'spectator_mib': received.value / (1 << 20), 'threads': server_stats.get('threads'),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Player move latency under spectator load")
+    parser.add_argument('--spectators', type=int, default=1000)
+    parser.add_argument('--slow-fraction', type=float, default=0.05, help="share of spectators that never read")
+    parser.add_argument('--moves', type=int, default=200)
+    parser.add_argument('--port', type=int, default=5611)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--modes', default='threaded,async')
+    args = parser.parse_args()
+
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+    print(f"{'mode':<10}{'spectators':>11}{'moves':>7}{'p50 ms':>9}{'p99 ms':>9}{'to viewers MiB':>16}{'threads':>9}")
+    port = args.port
+    for mode in args.modes.split(','):
+        for spectators in (0, args.spectators):
+            r = run_mode(mode, port, args, spectators)
+            port += 1
+            print(f"{r['mode']:<10}{r['spectators']:>11}{r['moves']:>7}{r['p50_ms']:>9.2f}{r['p99_ms']:>9.2f}"
+                  f"{r['spectator_mib']:>16.1f}{r['threads'] or 0:>9}")
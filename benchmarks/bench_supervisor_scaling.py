@@ -0,0 +1,107 @@
+# ######## bench_supervisor_scaling.py (Move Throughput vs Worker Processes) ########
+# Runs the same many-games random-move load against server.py and against supervisor.py with
+# 1, 2, 4... workers, driving it from several client processes so the load generator is not
+# the bottleneck, and reports total moves/s plus how the CPU time split across workers.
+# Usage: python benchmarks/bench_supervisor_scaling.py [--games N] [--duration S] [--workers 1,2,4] [--client-procs P]
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.join(REPO_ROOT, 'benchmarks'))
+from bench_server_modes import percentile, process_stats
+from bench_lock_contention import connect_games, play_game
+
+
+def start(workers, port):
+    """workers == 0 runs the single-process server.py for comparison."""
+    command = [sys.executable, os.path.join(REPO_ROOT, 'supervisor.py' if workers else 'server.py'),
+               '--host', '127.0.0.1', '--port', str(port)]
+    if workers: command += ['--workers', str(workers)]
+    proc = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=REPO_ROOT)
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f"server with {workers} workers did not start on port {port}")
+
+def server_pids(proc):
+    """The server process and, for the supervisor, its forked workers."""
+    try:
+        with open(f'/proc/{proc.pid}/task/{proc.pid}/children') as children:
+            return [proc.pid] + [int(pid) for pid in children.read().split()]
+    except OSError:
+        return [proc.pid]
+
+
+# --- Client Processes ---
+def client_process(port, games, duration, seed, start_barrier, results):
+    async def main():
+        game_players = await connect_games(port, games)
+        start_barrier.wait()
+        latencies = []
+        deadline = time.perf_counter() + duration
+        rng = random.Random(seed)
+        moves = await asyncio.gather(*(play_game(g, random.Random(rng.random()), deadline, latencies) for g in game_players))
+        for game in game_players:
+            for player in game.values(): player.writer.close()
+        return sum(moves), latencies
+    results.put(asyncio.run(main()))
+
+
+def run(workers, port, args):
+    proc = start(workers, port)
+    context = multiprocessing.get_context('spawn')
+    barrier = context.Barrier(args.client_procs + 1)
+    results = context.Queue()
+    per_process = max(1, args.games // args.client_procs)
+    clients = [context.Process(target=client_process, daemon=True,
+                               args=(port, per_process, args.duration, args.seed + i, barrier, results))
+               for i in range(args.client_procs)]
+    try:
+        for client in clients: client.start()
+        barrier.wait(timeout=120) # Everyone connected and paired
+        pids = server_pids(proc)
+        cpu_before = {pid: process_stats(pid)['cpu_seconds'] or 0.0 for pid in pids}
+        started = time.perf_counter()
+        collected = [results.get(timeout=args.duration + 60) for _ in clients]
+        elapsed = time.perf_counter() - started
+        cpu = {pid: (process_stats(pid)['cpu_seconds'] or 0.0) - cpu_before[pid] for pid in pids}
+    finally:
+        for client in clients: client.join(timeout=5)
+        proc.kill(); proc.wait()
+    latencies = [latency for _, sample in collected for latency in sample]
+    return sum(moves for moves, _ in collected) / elapsed, latencies, [cpu[pid] for pid in pids]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move throughput of the multi-process supervisor")
+    parser.add_argument('--games', type=int, default=200)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--workers', default=None, help="comma list; default 1,2,4.. up to the core count")
+    parser.add_argument('--client-procs', type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument('--port', type=int, default=5811)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    cores = os.cpu_count() or 1
+    counts = [int(n) for n in args.workers.split(',')] if args.workers else \
+             [0] + [n for n in (1, 2, 4, 8, 16, 32) if n <= cores]
+    print(f"{cores} cores, {args.games} games, {args.client_procs} client processes")
+    print(f"{'server':<14}{'moves/s':>9}{'p50 ms':>9}{'p99 ms':>9}   cpu s per process (supervisor first)")
+    for offset, workers in enumerate(counts):
+        moves_per_second, latencies, cpu = run(workers, args.port + offset, args)
+        name = f"{workers} workers" if workers else "server.py"
+        print(f"{name:<14}{moves_per_second:>9.0f}{percentile(latencies, 0.5) * 1000:>9.2f}"
+              f"{percentile(latencies, 0.99) * 1000:>9.2f}   {' '.join(f'{c:.1f}' for c in cpu)}")
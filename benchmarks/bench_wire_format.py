@@ -0,0 +1,68 @@
+# ######## bench_wire_format.py (Pickle vs Binary Wire Codec) ########
+# Collects representative messages of every type from random games and reports encode time,
+# decode time and payload size per message for each codec.
+# Usage: python benchmarks/bench_wire_format.py [--games N] [--repeat R] [--seed S]
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import server
+import wire
+
+
+def collect_messages(games, seed, max_plies=120):
+    rng = random.Random(seed)
+    samples = {'assign': ['white', 'black'], 'error': ['error:server_full'], 'state': [], 'delta': [], 'move': [], 'chat': []}
+    for game_number in range(games):
+        game = server.Game(f"bench-{game_number}")
+        game.game_started = True
+        for ply in range(max_plies):
+            if game.game_over: break
+            color = 'white' if game.turn_step < 2 else 'black'
+            options = game.white_options if color == 'white' else game.black_options
+            choices = [(i, target) for i, moves in enumerate(options) for target in moves]
+            if not choices: break
+            move = rng.choice(choices)
+            samples['move'].append({'type': 'move', 'data': move})
+            game.apply_move(color, *move)
+            if rng.random() < 0.3:
+                chat = {'text': f"good move number {ply}", 'timestamp': '12:00 PM'}
+                samples['chat'].append({'type': 'chat', 'data': chat})
+                game.add_chat_message(color, chat['text'], chat['timestamp'])
+            samples['delta'].extend(game.take_deltas(include_clocks=True))
+            if ply % 10 == 0: samples['state'].append(game.get_state())
+    return samples
+
+
+def measure(codec, messages, repeat):
+    payloads = [codec.encode(m) for m in messages]
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for m in messages: codec.encode(m)
+    encode_us = (time.perf_counter() - start) / (repeat * len(messages)) * 1e6
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for p in payloads: codec.decode(p)
+    decode_us = (time.perf_counter() - start) / (repeat * len(messages)) * 1e6
+    return encode_us, decode_us, sum(len(p) for p in payloads) / len(payloads)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pickle vs binary wire codec")
+    parser.add_argument('--games', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(io.StringIO()): # Game logs every move
+        samples = collect_messages(args.games, args.seed)
+    print(f"{'message':<8}{'codec':<8}{'encode us':>11}{'decode us':>11}{'bytes':>8}")
+    for kind, messages in samples.items():
+        for codec in (wire.PICKLE_CODEC, wire.BINARY_CODEC):
+            encode_us, decode_us, size = measure(codec, messages, args.repeat)
+            print(f"{kind:<8}{codec.name:<8}{encode_us:>11.2f}{decode_us:>11.2f}{size:>8.0f}")
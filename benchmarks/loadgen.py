@@ -0,0 +1,217 @@
+# ######## loadgen.py (Headless Load Generator: Scripted Bot Games Against a Server) ########
+# Puts realistic load on a server without any pygame windows. Every bot speaks the real wire
+# protocol (handshake, negotiated codec, deltas): it connects, gets a color, and whenever it is
+# its turn waits a random think time (exponential, mean --think) and plays a random legal move
+# from the options it was sent. It also chats at --chat-per-minute on average. When its game
+# ends it disconnects and queues for a new one, so the number of games stays about the same.
+# Bots connect at --connect-rate per second; once they have all started, the next --duration
+# seconds are measured. Reported: move round trip (sending a move until the delta with it comes
+# back) percentiles, messages the bots received per second, server CPU, and connection
+# failures. Several --client-procs share the bots, so the load generator itself can use more
+# than one core; its own CPU is reported as well, to show when it is the bottleneck.
+# Usage: python benchmarks/loadgen.py [--server threaded|async|supervisor|none] [--games N] [--duration S]
+#        [--think S] [--chat-per-minute C] [--client-procs P] [--workers W] [--port P] [--server-pid PID]
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.join(REPO_ROOT, 'benchmarks'))
+from bench_server_modes import start_server, percentile, process_stats
+from bench_spectators import Player
+from bench_supervisor_scaling import start as start_supervisor, server_pids
+from protocol import is_delta, is_full_state
+
+CONNECT_TIMEOUT = 30.0 # Seconds to connect and complete the handshake
+RETRY_DELAY = 1.0 # After a failed connect
+WHOLE_RUN_COUNTS = ('connected', 'connect_failures', 'dropped') # Ramp-up failures matter too
+
+
+# --- Bots ---
+class LoadStats:
+    """What one client process saw: connections over the whole run, everything else inside the
+    measured window [window_start, window_end)."""
+    def __init__(self, window_start, window_end):
+        self.window_start, self.window_end = window_start, window_end
+        self.counts = {'connected': 0, 'connect_failures': 0, 'dropped': 0, 'games_finished': 0,
+                       'moves': 0, 'unanswered_moves': 0, 'chats_sent': 0,
+                       'deltas': 0, 'snapshots': 0, 'chat_events': 0, 'other_messages': 0}
+        self.latencies = []
+
+    def measuring(self):
+        return self.window_start <= time.time() < self.window_end
+
+    def count(self, name, amount=1):
+        if self.measuring() or name in WHOLE_RUN_COUNTS: self.counts[name] += amount
+
+    def received(self, message):
+        if is_delta(message): self.count('deltas')
+        elif is_full_state(message): self.count('snapshots')
+        elif isinstance(message, dict) and message.get('type') in ('chat_append', 'chat_sync'): self.count('chat_events')
+        else: self.count('other_messages')
+
+
+async def chatter(player, rng, per_minute, stats):
+    while True:
+        await asyncio.sleep(rng.expovariate(per_minute / 60))
+        player.send('chat', {'text': f"gg {rng.randrange(1000)}"})
+        stats.count('chats_sent')
+
+
+async def play(player, rng, args, stats):
+    """Plays one game to its end. Raises OSError/IncompleteReadError if the server drops us."""
+    loop = asyncio.get_running_loop()
+    pending = None # (state seq when our move was sent, perf_counter then)
+    move_timer = None
+    def make_move():
+        nonlocal pending, move_timer
+        move_timer = None
+        options = player.state.get(f'{player.color}_options', [])
+        choices = [(i, target) for i, targets in enumerate(options) for target in targets]
+        if not choices or player.state.get('game_over'): return
+        pending = (player.state.get('seq', 0), time.perf_counter())
+        player.send('move', rng.choice(choices))
+
+    chat_task = asyncio.create_task(chatter(player, rng, args.chat_per_minute, stats)) if args.chat_per_minute > 0 else None
+    try:
+        while True:
+            message = await player.receive()
+            stats.received(message)
+            state = player.state
+            if not state or player.color not in ('white', 'black'): continue
+            if pending and state.get('seq', 0) > pending[0]: # The first state change after a move is that move
+                if stats.measuring(): stats.latencies.append(time.perf_counter() - pending[1])
+                stats.count('moves')
+                pending = None
+            if state.get('game_over'):
+                stats.count('games_finished')
+                return
+            my_turn = (state.get('turn_step', 0) < 2) == (player.color == 'white')
+            if my_turn and state.get('game_started', True) and pending is None and move_timer is None:
+                move_timer = loop.call_later(rng.expovariate(1 / args.think) if args.think > 0 else 0, make_move)
+    finally:
+        if move_timer: move_timer.cancel()
+        if chat_task: chat_task.cancel()
+        if pending: stats.count('unanswered_moves')
+
+
+async def bot(port, rng, args, stats, stop_at):
+    """Plays game after game until stop_at."""
+    while time.time() < stop_at:
+        try:
+            player = await asyncio.wait_for(Player.connect(port), CONNECT_TIMEOUT)
+            if player.codec is None: raise ConnectionError("handshake refused")
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            stats.count('connect_failures')
+            await asyncio.sleep(RETRY_DELAY)
+            continue
+        stats.count('connected')
+        try:
+            await asyncio.wait_for(play(player, rng, args, stats), max(0.01, stop_at - time.time()))
+        except asyncio.TimeoutError: return # The run is over
+        except (OSError, asyncio.IncompleteReadError): stats.count('dropped')
+        finally: player.writer.close()
+
+
+def client_process(port, bots, start_at, window_start, window_end, args, seed, results):
+    async def main():
+        stats = LoadStats(window_start, window_end)
+        rng = random.Random(seed)
+        await asyncio.sleep(max(0.0, start_at - time.time()))
+        tasks = []
+        for i in range(bots):
+            tasks.append(asyncio.create_task(bot(port, random.Random(rng.random()), args, stats, window_end)))
+            await asyncio.sleep(args.client_procs / args.connect_rate) # Processes connect side by side
+        await asyncio.gather(*tasks)
+        return stats
+    cpu_before = time.process_time()
+    stats = asyncio.run(main())
+    results.put((stats.counts, stats.latencies, time.process_time() - cpu_before))
+
+
+# --- Driver ---
+def start_target(args):
+    """(server process or None, pids to measure CPU of)."""
+    if args.server == 'none': return None, [args.server_pid] if args.server_pid else []
+    if args.server == 'supervisor': proc = start_supervisor(args.workers, args.port)
+    else: proc = start_server(args.server, args.port)
+    time.sleep(0.5) # Let the supervisor fork its workers
+    return proc, server_pids(proc)
+
+def cpu_seconds(pids):
+    return {pid: process_stats(pid)['cpu_seconds'] or 0.0 for pid in pids}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless load generator: scripted bot games against a server")
+    parser.add_argument('--server', choices=('threaded', 'async', 'supervisor', 'none'), default='threaded',
+                        help="server to start; 'none' uses one already listening on --port")
+    parser.add_argument('--server-pid', type=int, help="with --server none: process to report CPU for")
+    parser.add_argument('--workers', type=int, default=2, help="supervisor worker processes")
+    parser.add_argument('--port', type=int, default=5901)
+    parser.add_argument('--games', type=int, default=1000, help="concurrent games (two bots each)")
+    parser.add_argument('--duration', type=float, default=30.0, help="measured seconds, after every bot has started")
+    parser.add_argument('--think', type=float, default=2.0, help="mean seconds a bot waits before moving")
+    parser.add_argument('--chat-per-minute', type=float, default=2.0, help="chat lines each bot sends per minute")
+    parser.add_argument('--connect-rate', type=float, default=500.0, help="new connections per second while ramping up")
+    parser.add_argument('--client-procs', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard)) # Inherited by the server and client processes
+    except (ImportError, ValueError, OSError):
+        pass
+
+    proc, pids = start_target(args)
+    try:
+        bots = 2 * args.games
+        context = multiprocessing.get_context('spawn')
+        results = context.Queue()
+        start_at = time.time() + 2.0 # Time for the client processes to start up
+        window_start = start_at + bots / args.connect_rate + 1.0
+        window_end = window_start + args.duration
+        clients = [context.Process(target=client_process, daemon=True,
+                                   args=(args.port, bots // args.client_procs + (i < bots % args.client_procs),
+                                         start_at, window_start, window_end, args, args.seed + i, results))
+                   for i in range(args.client_procs)]
+        for client in clients: client.start()
+        time.sleep(max(0.0, window_start - time.time()))
+        cpu_before = cpu_seconds(pids)
+        time.sleep(max(0.0, window_end - time.time()))
+        cpu = {pid: seconds - cpu_before[pid] for pid, seconds in cpu_seconds(pids).items()}
+        collected = [results.get(timeout=CONNECT_TIMEOUT + 60) for _ in clients]
+        for client in clients: client.join(timeout=5)
+    finally:
+        if proc: proc.kill(); proc.wait()
+
+    counts = {name: sum(c[name] for c, _, _ in collected) for name in collected[0][0]}
+    latencies = [latency for _, sample, _ in collected for latency in sample]
+    client_cpu = sum(seconds for _, _, seconds in collected)
+    received = counts['deltas'] + counts['snapshots'] + counts['chat_events'] + counts['other_messages']
+    per_second = lambda n: n / args.duration
+    print(f"Load:        {args.games} games ({bots} bots) against {args.server}"
+          f"{f' with {args.workers} workers' if args.server == 'supervisor' else ''}, think {args.think:g} s, "
+          f"chat {args.chat_per_minute:g}/min per bot, measured {args.duration:g} s")
+    print(f"Connections: {counts['connected']} made, {counts['connect_failures']} failed, {counts['dropped']} dropped by the server "
+          f"(whole run); {counts['games_finished']} game ends seen")
+    print(f"Moves:       {counts['moves']} ({per_second(counts['moves']):.1f}/s), {counts['unanswered_moves']} unanswered; round trip "
+          f"p50 {percentile(latencies, 0.5) * 1000:.2f} ms  p90 {percentile(latencies, 0.9) * 1000:.2f} ms  "
+          f"p99 {percentile(latencies, 0.99) * 1000:.2f} ms  max {max(latencies or [float('nan')]) * 1000:.2f} ms")
+    print(f"Received:    {per_second(received):.1f} messages/s ({per_second(counts['deltas']):.1f} deltas, "
+          f"{per_second(counts['snapshots']):.1f} snapshots, {per_second(counts['chat_events']):.1f} chat events); "
+          f"{per_second(counts['chats_sent']):.1f} chat lines sent/s")
+    if cpu:
+        total = sum(cpu.values())
+        print(f"Server CPU:  {total:.2f} s = {total / args.duration:.1%} of a core"
+              f"{' (' + ', '.join(f'{seconds:.2f}' for seconds in cpu.values()) + ' s per process, supervisor first)' if len(cpu) > 1 else ''}")
+    else:
+        print("Server CPU:  not measured (pass --server-pid with --server none)")
+    print(f"Loadgen CPU: {client_cpu:.2f} s = {client_cpu / (window_end - start_at):.1%} of a core over the whole run")
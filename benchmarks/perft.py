@@ -0,0 +1,196 @@
+# ######## perft.py (Perft Tool: Move Generator Correctness, Speed and Profile) ########
+# Walks the legal move tree of a position to a given depth with movegen.perft, which uses the
+# same piece generators, legal_overrides and plan_move as Game.apply_move, and counts the leaves.
+# Counts are compared with the published numbers for the reference positions (see
+# bench_legal_moves.PERFT_POSITIONS) or with --expected for a --fen of your own, so a wrong
+# number means a generator bug. Each position is also timed (best of --repeats, in nodes/s).
+#   --divide   splits a position's count by root move, to find where a wrong count comes from
+#   --profile  times the piece generators, the legal filter and move making by piece type
+#   --baseline compares with a stored run (PERFT_BASELINE by default): counts must match,
+#              and speed more than --tolerance below it is flagged. --save-baseline stores one.
+# Exits with 1 on any count mismatch (and on a flagged slowdown with --fail-slower).
+# Usage: python benchmarks/perft.py [--depth D] [--positions a,b] [--fen FEN [--expected N,N..]]
+#        [--divide] [--profile] [--repeats R] [--baseline [FILE]] [--save-baseline [FILE]] [--fail-slower]
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.join(REPO_ROOT, 'benchmarks'))
+from bench_legal_moves import PERFT_POSITIONS
+import movegen
+from movegen import perft, position_from_fen, position_legal_options, play_move, FEN_PIECES, PROMOTION_PIECES
+
+PERFT_BASELINE = os.path.join(REPO_ROOT, 'benchmarks', 'perft_baseline.json')
+DEFAULT_TOLERANCE = 0.2 # Fraction of baseline speed a run may lose before it is flagged
+FEN_LETTERS = {name: letter for letter, name in FEN_PIECES.items()}
+
+
+# --- Counting and Timing ---
+def square_name(coords):
+    """Algebraic name of a board square (this board's x axis runs from the h file to the a file)."""
+    return f"{chr(ord('a') + 7 - coords[0])}{coords[1] + 1}"
+
+def root_moves(position):
+    """[(name, index, target, promotion)] for every legal move of the side to move."""
+    pieces = position[f"{position['turn']}_pieces"]
+    locations = position[f"{position['turn']}_locations"]
+    promote_row = 7 if position['turn'] == 'white' else 0
+    moves = []
+    for index, targets in enumerate(position_legal_options(position)):
+        for target in targets:
+            promotions = PROMOTION_PIECES if pieces[index] == 'pawn' and target[1] == promote_row else (None,)
+            for promotion in promotions:
+                name = square_name(locations[index]) + square_name(target) + (FEN_LETTERS[promotion] if promotion else '')
+                moves.append((name, index, target, promotion))
+    return moves
+
+def divide(position, depth):
+    """{root move name: leaf count below it}; the values sum to perft(position, depth)."""
+    return {name: perft(play_move(position, index, target, promotion), depth - 1)
+            for name, index, target, promotion in root_moves(position)}
+
+def timed_perft(position, depth, repeats):
+    """(nodes, best seconds over repeats)."""
+    best = float('inf')
+    for _ in range(repeats):
+        started = time.perf_counter()
+        nodes = perft(position, depth)
+        best = min(best, time.perf_counter() - started)
+    return nodes, best
+
+
+# --- Profile ---
+class Profile:
+    """Swaps timing wrappers into movegen while a perft runs; restore() puts the originals back."""
+    def __init__(self):
+        self.pieces = {name: {'calls': 0, 'seconds': 0.0, 'pseudo': 0, 'legal': 0} for name in movegen.PIECE_GENERATORS}
+        self.phases = {'legal filter': 0.0, 'make move': 0.0}
+        self._originals = (dict(movegen.PIECE_GENERATORS), movegen.legal_options, movegen.play_move)
+        for name, generator in self._originals[0].items():
+            movegen.PIECE_GENERATORS[name] = self._timed_generator(self.pieces[name], generator)
+        legal_options, make_move = self._originals[1], self._originals[2]
+        def timed_legal_options(options, pieces, *args, **kwargs):
+            started = time.perf_counter()
+            legal = legal_options(options, pieces, *args, **kwargs)
+            self.phases['legal filter'] += time.perf_counter() - started
+            for name, moves in zip(pieces, legal): self.pieces[name]['legal'] += len(moves)
+            return legal
+        def timed_play_move(*args, **kwargs):
+            started = time.perf_counter()
+            result = make_move(*args, **kwargs)
+            self.phases['make move'] += time.perf_counter() - started
+            return result
+        movegen.legal_options, movegen.play_move = timed_legal_options, timed_play_move
+
+    @staticmethod
+    def _timed_generator(stats, generator):
+        def timed(*args):
+            started = time.perf_counter()
+            moves = generator(*args)
+            stats['seconds'] += time.perf_counter() - started
+            stats['calls'] += 1
+            stats['pseudo'] += len(moves)
+            return moves
+        return timed
+
+    def restore(self):
+        movegen.PIECE_GENERATORS.update(self._originals[0])
+        movegen.legal_options, movegen.play_move = self._originals[1], self._originals[2]
+
+def print_profile(position, depth):
+    profile = Profile()
+    try:
+        started = time.perf_counter()
+        perft(position, depth)
+        total = time.perf_counter() - started
+    finally:
+        profile.restore()
+    generation = sum(stats['seconds'] for stats in profile.pieces.values())
+    print(f"  profile (timers included; {total * 1000:.0f} ms in all):")
+    print(f"    {'piece':<8}{'calls':>9}{'pseudo':>10}{'legal':>10}{'ms':>9}{'us/call':>9}")
+    for name, stats in sorted(profile.pieces.items(), key=lambda item: -item[1]['seconds']):
+        if not stats['calls']: continue
+        print(f"    {name:<8}{stats['calls']:>9}{stats['pseudo']:>10}{stats['legal']:>10}"
+              f"{stats['seconds'] * 1000:>9.1f}{stats['seconds'] / stats['calls'] * 1e6:>9.2f}")
+    for phase, seconds in (('pseudo-legal generation', generation), *profile.phases.items(),
+                           ('the rest (perft, bitboards)', total - generation - sum(profile.phases.values()))):
+        print(f"    {phase:<28}{seconds * 1000:>9.1f} ms {seconds / total:>6.1%}")
+
+
+# --- Baselines ---
+def load_baseline(path):
+    try:
+        with open(path) as baseline_file: return json.load(baseline_file)
+    except (OSError, ValueError) as e:
+        print(f"No usable baseline at {path}: {e}")
+        return None
+
+def save_baseline(path, depth, results):
+    baseline = {'depth': depth, 'python': platform.python_version(), 'machine': platform.machine(),
+                'positions': {name: {'depth': d, 'nodes': nodes, 'nodes_per_second': round(rate)}
+                              for name, d, nodes, rate in results}}
+    with open(path, 'w') as baseline_file:
+        json.dump(baseline, baseline_file, indent=2)
+        baseline_file.write('\n')
+    print(f"Baseline saved to {path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Perft: move generator correctness, speed and profile")
+    parser.add_argument('--depth', type=int, default=3, help="plies to walk (capped at the reference table's length)")
+    parser.add_argument('--positions', default=None, help="comma list of reference positions (default: all, or none with --fen)")
+    parser.add_argument('--fen', action='append', default=[], help="a custom position; may be repeated")
+    parser.add_argument('--expected', action='append', default=[],
+                        help="leaf counts for depth 1, 2... of the --fen in the same place, comma separated")
+    parser.add_argument('--divide', action='store_true', help="print the count below each root move")
+    parser.add_argument('--profile', action='store_true', help="print a per-piece-type profile of each position")
+    parser.add_argument('--repeats', type=int, default=3, help="timed runs per position; the fastest counts")
+    parser.add_argument('--baseline', nargs='?', const=PERFT_BASELINE, help="compare with a stored baseline")
+    parser.add_argument('--save-baseline', nargs='?', const=PERFT_BASELINE, help="store this run as the baseline")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument('--fail-slower', action='store_true', help="exit with 1 on a flagged slowdown too")
+    args = parser.parse_args()
+
+    wanted = set(args.positions.split(',')) if args.positions else (set() if args.fen else None)
+    positions = [(name, fen, expected) for name, fen, expected in PERFT_POSITIONS if wanted is None or name in wanted]
+    for i, fen in enumerate(args.fen):
+        expected = tuple(int(n) for n in args.expected[i].split(',')) if i < len(args.expected) else ()
+        positions.append((f'fen-{i + 1}', fen, expected))
+    if not positions: parser.error(f"no positions; reference ones are {', '.join(name for name, _, _ in PERFT_POSITIONS)}")
+
+    baseline = load_baseline(args.baseline) if args.baseline else None
+    counts_ok = speed_ok = True
+    results = []
+    for name, fen, expected in positions:
+        position = position_from_fen(fen)
+        depth = min(args.depth, len(expected)) if expected else args.depth
+        nodes, seconds = timed_perft(position, depth, args.repeats)
+        rate = nodes / seconds if seconds else 0.0
+        results.append((name, depth, nodes, rate))
+        if expected:
+            verdict = 'ok' if nodes == expected[depth - 1] else f'MISMATCH (expected {expected[depth - 1]})'
+            counts_ok = counts_ok and nodes == expected[depth - 1]
+        else: verdict = 'no reference'
+        line = f"perft {name:<11} depth {depth}: {nodes:>9} nodes {verdict:<12} {rate:>9.0f} nodes/s"
+        reference = baseline and baseline.get('positions', {}).get(name)
+        if reference and reference.get('depth') == depth:
+            if reference['nodes'] != nodes:
+                counts_ok = False
+                line += f"  baseline count {reference['nodes']} MISMATCH"
+            ratio = rate / reference['nodes_per_second'] if reference.get('nodes_per_second') else float('inf')
+            slower = ratio < 1 - args.tolerance
+            speed_ok = speed_ok and not slower
+            line += f"  {ratio:5.2f}x baseline{' SLOWER' if slower else ''}"
+        elif baseline: line += "  (not in baseline at this depth)"
+        print(line)
+        if args.divide:
+            for move, count in sorted(divide(position, depth).items()): print(f"  {move}: {count}")
+        if args.profile: print_profile(position, depth)
+
+    if args.save_baseline: save_baseline(args.save_baseline, args.depth, results)
+    if not counts_ok or (args.fail_slower and not speed_ok): sys.exit(1)
@@ -0,0 +1,77 @@
+# ######## chat.py (Numbered Chat Ring Buffer) ########
+# A game keeps its last CHAT_CAPACITY chat lines in a ring buffer; adding to a full one
+# overwrites the oldest in O(1). Lines are numbered 1, 2, 3... per game, so chat no longer
+# rides along in state snapshots: each new line goes out once as a 'chat_append' event,
+# and a client that missed some (it reconnected, or a lagging spectator had its backlog
+# dropped) asks for everything after the last id it holds with 'chat_sync', and gets the
+# lines back in a 'chat_sync' reply.
+# The same class holds the client's copy, fed from those events.
+from collections import deque
+from itertools import islice
+
+# --- Constants ---
+CHAT_CAPACITY = 100 # Lines kept per game (and shown by the client)
+
+
+def chat_append_message(messages):
+    """Server -> client event carrying numbered lines, oldest first."""
+    return {'type': 'chat_append', 'messages': messages}
+
+def chat_sync_message(messages):
+    """Server -> client reply to a client's {'type': 'chat_sync', 'data': last_id}."""
+    return {'type': 'chat_sync', 'messages': messages}
+
+
+class ChatLog:
+    """The most recent chat lines of one game, each {'id', 'sender', 'text', 'timestamp'}.
+
+    Not thread-safe; the server's Game lock (or the client's state lock) guards it.
+    """
+    def __init__(self, capacity=CHAT_CAPACITY):
+        self._messages = deque(maxlen=capacity)
+        self.last_id = 0 # Id of the newest line ever added (0: none yet)
+
+    @classmethod
+    def restored(cls, messages, last_id, capacity=CHAT_CAPACITY):
+        """A log holding messages (oldest first, without ids) whose newest line was last_id."""
+        log = cls(capacity)
+        messages = list(messages)[-capacity:]
+        first_id = last_id - len(messages) + 1
+        for offset, message in enumerate(messages):
+            log._messages.append(dict(message, id=first_id + offset))
+        log.last_id = last_id
+        return log
+
+    def __len__(self):
+        return len(self._messages)
+
+    def __iter__(self):
+        return iter(self._messages)
+
+    def append(self, sender, text, timestamp):
+        """Adds a new line, numbering it. Returns the stored message."""
+        self.last_id += 1
+        message = {'id': self.last_id, 'sender': sender, 'text': text, 'timestamp': timestamp}
+        self._messages.append(message)
+        return message
+
+    def since(self, after_id):
+        """Lines newer than after_id that are still held, oldest first."""
+        if after_id >= self.last_id: return []
+        first_id = self.last_id - len(self._messages) + 1
+        return list(islice(self._messages, max(0, after_id + 1 - first_id), None))
+
+    def extend(self, messages, allow_gap=False):
+        """Adds numbered lines received from a server, skipping ones already held.
+
+        Returns False, adding nothing, if they do not carry on from last_id (something was
+        missed and the caller should chat_sync). A chat_sync reply passes allow_gap, since
+        lines older than the server's buffer are gone for good.
+        """
+        fresh = [message for message in messages if message.get('id', 0) > self.last_id]
+        if not fresh: return True
+        if fresh[0]['id'] != self.last_id + 1 and not allow_gap: return False
+        for message in fresh:
+            self._messages.append(message)
+            self.last_id = message['id']
+        return True
@@ -7,7 +7,14 @@ import sys
 import time
 from datetime import datetime
 import math
+import functools
 import struct # For message framing
+from protocol import apply_delta, is_delta, is_full_state, ClockSync, displayed_clocks, seconds_to_clock_tick
+from chat import ChatLog, CHAT_CAPACITY
+from regions import DirtyRegions
+from position import PositionView
+from assets import PieceSprites, PIECE_NAMES
+import wire
 
 pygame.init()
 
@@ -19,6 +26,21 @@ CHAT_WIDTH = 200
 CHAT_Y = 0
 CHAT_HEIGHT = HEIGHT - 100 # Assuming status bar height is 100
 INITIAL_TIME_SECONDS = 1200.0 # Default for display if state is missing
+TIME_SYNC_PROBES = 5 # Round trips used to estimate the server clock offset at connect
+# `--full-redraw` repaints the whole window every frame, as the client used to; `--frame-stats`
+# prints frame times every FRAME_STATS_INTERVAL seconds, so the two can be compared
+FULL_REDRAW = '--full-redraw' in sys.argv
+FRAME_STATS = '--frame-stats' in sys.argv
+FRAME_STATS_INTERVAL = 5.0
+TEXT_CACHE_SIZE = 256 # Rendered strings kept by rendered() (clock digits, labels, status text...)
+# The main loop sleeps until there is input, the receive thread wakes it, or something animated
+# (chat cursor, check outline, running clock) is due to change. `--poll` runs it at a fixed fps
+# instead, as the client used to, for comparison
+POLL_LOOP = '--poll' in sys.argv
+INPUT_POLL_SECONDS = 1 / 30 # How often a sleeping client looks for mouse and keyboard input
+CURSOR_BLINK_SECONDS = 0.5
+CHECK_BLINK_SECONDS = 0.5 # The check outline shows for the first half of each period
+CLOCK_TICK_SLACK = 0.005 # Wake just after a clock's displayed second changes, not just before
 
 screen = pygame.display.set_mode([WIDTH, HEIGHT])
 pygame.display.set_caption("Networked Chess Client")
@@ -40,7 +62,7 @@ except FileNotFoundError:
     timer_label_font = pygame.font.SysFont(None, 20)
 
 timer = pygame.time.Clock()
-fps = 60
+fps = 60 # Also caps how often a burst of input or messages repaints
 
 # Default initial state
 game_state = {
@@ -49,14 +71,20 @@ game_state = {
     'captured_white': [], 'captured_black': [],
     'turn_step': 0, 'game_over': False, 'winner': '',
     'white_options': [], 'black_options': [],
-    'chat_history': [],
     'white_time': INITIAL_TIME_SECONDS, 'black_time': INITIAL_TIME_SECONDS,
     'game_started': False, 'game_id': None
 }
 game_state_lock = threading.Lock()
+state_version = 0 # Bumped under game_state_lock whenever game_state or chat_log changes
+wakeup = threading.Event() # Set by the receive thread after each message; the main loop sleeps on it
+resync_requested = False # Set after a delta gap until the next full snapshot arrives
+chat_log = ChatLog() # Chat lines of our game, fed by chat_append events; guarded by game_state_lock
+chat_sync_requested = False # Set after a chat id gap until the server's chat_sync reply arrives
+clock_sync = ClockSync() # Server clock offset; clocks are counted down locally from the last anchor
 my_color = None # 'white' or 'black' or None (if waiting)
 selection = 100 # Index of selected piece, 100 means nothing selected
-valid_moves_display = [] # Moves for the selected piece
+valid_moves_display = frozenset() # Target squares of the selected piece
+promotion_choice = None # (selection, target) while picking what a pawn reaching the last rank becomes
 
 # Chat Variables
 chat_input = ""
@@ -65,7 +93,7 @@ chat_scroll_offset = 0
 text_offset = 0
 cursor_visible = True
 cursor_timer = 0
-last_chat_length = 0
+last_chat_id = 0 # Newest line drawn so far; a newer one scrolls the chat to the bottom
 BUBBLE_PADDING = 10
 BUBBLE_MARGIN = 5
 BUBBLE_RADIUS = 8
@@ -77,53 +105,20 @@ BG_COLOR_BOTTOM = (120, 120, 120)
 # Networking Variables
 SERVER_IP = '127.0.0.1' # Change if server is elsewhere
 PORT = 5555
+# `python client.py --spectate <game_id>` watches a running game instead of joining the queue
+SPECTATE_GAME_ID = sys.argv[sys.argv.index('--spectate') + 1] if '--spectate' in sys.argv[:-1] else None
+# `python client.py --rating 1500` asks the matchmaker for an opponent of similar strength
+RATING = int(sys.argv[sys.argv.index('--rating') + 1]) if '--rating' in sys.argv[:-1] else None
+resume_seat = None # (game_id, token) from the server's 'seat' message; reconnecting with it rejoins our game after a server restart
 client_socket = None
 connected = False
 network_error = None
 HEADER_SIZE = struct.calcsize('>I') # Size of the length prefix (4 bytes)
+wire_codec = wire.BINARY_CODEC # Replaced by whatever the server picks during the handshake
 
-# Asset Loading
-white_images = []
-black_images = []
-piece_list = ['pawn', 'queen', 'king', 'knight', 'rook', 'bishop']
-try:
-    base_path = 'assets/images/' # Adjust if your path is different
-    white_pawn = pygame.image.load(base_path + 'white pawn.png')
-    white_pawn = pygame.transform.scale(white_pawn, (65, 65))
-    white_queen = pygame.image.load(base_path + 'white queen.png')
-    white_queen = pygame.transform.scale(white_queen, (80, 80))
-    white_king = pygame.image.load(base_path + 'white king.png')
-    white_king = pygame.transform.scale(white_king, (80, 80))
-    white_knight = pygame.image.load(base_path + 'white knight.png')
-    white_knight = pygame.transform.scale(white_knight, (80, 80))
-    white_rook = pygame.image.load(base_path + 'white rook.png')
-    white_rook = pygame.transform.scale(white_rook, (80, 80))
-    white_bishop = pygame.image.load(base_path + 'white bishop.png')
-    white_bishop = pygame.transform.scale(white_bishop, (80, 80))
-
-    black_pawn = pygame.image.load(base_path + 'black pawn.png')
-    black_pawn = pygame.transform.scale(black_pawn, (65, 65))
-    black_queen = pygame.image.load(base_path + 'black queen.png')
-    black_queen = pygame.transform.scale(black_queen, (80, 80))
-    black_king = pygame.image.load(base_path + 'black king.png')
-    black_king = pygame.transform.scale(black_king, (80, 80))
-    black_knight = pygame.image.load(base_path + 'black knight.png')
-    black_knight = pygame.transform.scale(black_knight, (80, 80))
-    black_rook = pygame.image.load(base_path + 'black rook.png')
-    black_rook = pygame.transform.scale(black_rook, (80, 80))
-    black_bishop = pygame.image.load(base_path + 'black bishop.png')
-    black_bishop = pygame.transform.scale(black_bishop, (80, 80))
-
-    # Ensure order matches piece_list
-    white_images = [white_pawn, white_queen, white_king, white_knight, white_rook, white_bishop]
-    black_images = [black_pawn, black_queen, black_king, black_knight, black_rook, black_bishop]
-
-except pygame.error as e:
-    print(f"Pygame Error loading assets: {e}")
-    pygame.quit(); sys.exit()
-except FileNotFoundError as e:
-    print(f"Asset file not found: {e}. Make sure assets/images directory exists and contains the png files.")
-    pygame.quit(); sys.exit()
+# Asset Loading (see assets.py): the sprite atlas is loaded after the connecting screen is up
+piece_list = list(PIECE_NAMES)
+piece_sprites = PieceSprites()
 
 
 # --- Helper Functions ---
@@ -140,214 +135,201 @@ def format_time(seconds):
     return f"{minutes:02d}:{remaining_seconds:02d}"
 
 # --- Drawing Functions ---
-def draw_board(state):
+# Retained mode (see regions.py): static artwork is painted once into `background`; each frame
+# render_frame() repaints only the regions whose content changed and returns their rects.
+STATUS_RECT = (0, 800, 710, 100) # Turn and seat text; the clocks take the rest of the bar
+TIMERS_RECT = (710, 810, 275, 80)
+GAME_OVER_RECT = (200, 350, 600, 100)
+CHAT_INPUT_HEIGHT = 50
+CHAT_MESSAGES_RECT = (CHAT_X, CHAT_Y, CHAT_WIDTH, CHAT_HEIGHT - CHAT_INPUT_HEIGHT)
+CHAT_INPUT_RECT = (CHAT_X, CHAT_Y + CHAT_HEIGHT - CHAT_INPUT_HEIGHT, CHAT_WIDTH, CHAT_INPUT_HEIGHT)
+
+@functools.lru_cache(maxsize=TEXT_CACHE_SIZE)
+def rendered(text_font, text, color):
+    """text rendered (antialiased) in text_font. Callers only blit the surface, so it is shared."""
+    return text_font.render(text, True, color)
+
+def build_background():
+    """The parts of the window that never change, in the order they used to be drawn each frame."""
+    surface = pygame.Surface((WIDTH, HEIGHT)).convert()
+    surface.fill((40, 40, 40))
     for r in range(8):
         for c in range(8):
             color = 'light gray' if (r + c) % 2 == 0 else 'dark gray'
-            pygame.draw.rect(screen, color, [c * 100, r * 100, 100, 100])
+            pygame.draw.rect(surface, color, [c * 100, r * 100, 100, 100])
+
+    pygame.draw.rect(surface, 'gray', [0, 800, WIDTH, 100])
+    pygame.draw.rect(surface, 'gold', [0, 800, WIDTH, 100], 5)
+    pygame.draw.rect(surface, 'gold', [CHAT_X, CHAT_Y, CHAT_WIDTH, CHAT_HEIGHT + 100], 5) # Border around full right panel
+    for i in range(9):
+        pygame.draw.line(surface, 'black', (0, 100 * i), (800, 100 * i), 2)
+        pygame.draw.line(surface, 'black', (100 * i, 0), (100 * i, 800), 2)
+
+    # Chat background gradient
+    for i in range(CHAT_HEIGHT):
+        ratio = i / CHAT_HEIGHT
+        r = int(BG_COLOR_TOP[0] * (1 - ratio) + BG_COLOR_BOTTOM[0] * ratio)
+        g = int(BG_COLOR_TOP[1] * (1 - ratio) + BG_COLOR_BOTTOM[1] * ratio)
+        b = int(BG_COLOR_TOP[2] * (1 - ratio) + BG_COLOR_BOTTOM[2] * ratio)
+        pygame.draw.line(surface, (r, g, b), (CHAT_X, CHAT_Y + i), (CHAT_X + CHAT_WIDTH, CHAT_Y + i))
+    pygame.draw.rect(surface, 'black', pygame.Rect(CHAT_X, CHAT_Y, CHAT_WIDTH, CHAT_HEIGHT), 2)
+    return surface
 
-    pygame.draw.rect(screen, 'gray', [0, 800, WIDTH, 100])
-    pygame.draw.rect(screen, 'gold', [0, 800, WIDTH, 100], 5)
-    pygame.draw.rect(screen, 'gold', [CHAT_X, CHAT_Y, CHAT_WIDTH, CHAT_HEIGHT + 100], 5) # Border around full right panel
+def paint_background(rect):
+    screen.blit(background, rect[:2], rect)
 
+def draw_status(state):
     status_text = ['White\'s Turn', 'White Moving', 'Black\'s Turn', 'Black Moving']
     current_turn_step = state.get('turn_step', 0)
     turn_idx = current_turn_step if 0 <= current_turn_step < len(status_text) else 0
     turn_indicator = status_text[turn_idx]
     turn_color = 'white' if turn_idx < 2 else 'black'
-    screen.blit(big_font.render(turn_indicator, True, turn_color), (20, 820))
+    screen.blit(rendered(big_font, turn_indicator, turn_color), (20, 820))
 
     if my_color:
-        screen.blit(font.render(f"You are: {my_color.capitalize()}", True, 'black'), (350, 820)) # Adjusted X pos
+        screen.blit(rendered(font, f"You are: {my_color.capitalize()}", 'black'), (350, 820)) # Adjusted X pos
     elif state.get('game_started'):
-         screen.blit(font.render("Assigning...", True, 'orange'), (350, 820))
+         screen.blit(rendered(font, "Assigning...", 'orange'), (350, 820))
     else: # Waiting state
-         screen.blit(font.render("Waiting for opponent...", True, 'yellow'), (350, 820))
-
-
-    for i in range(9):
-        pygame.draw.line(screen, 'black', (0, 100 * i), (800, 100 * i), 2)
-        pygame.draw.line(screen, 'black', (100 * i, 0), (100 * i, 800), 2)
-
-def draw_pieces(state):
-    global selection, my_color
-    w_pieces = state.get('white_pieces', [])
-    w_locs = state.get('white_locations', [])
-    b_pieces = state.get('black_pieces', [])
-    b_locs = state.get('black_locations', [])
-    current_turn_step = state.get('turn_step', 0)
-
-    if len(w_pieces) != len(w_locs): return
-    if len(b_pieces) != len(b_locs): return
-
-    for i in range(len(w_pieces)):
-        try:
-            loc = w_locs[i]; piece = w_pieces[i]
-            if not isinstance(loc, (tuple, list)) or len(loc) != 2: continue
-            if piece not in piece_list: continue
-            index = piece_list.index(piece)
-            if not (0 <= index < len(white_images)): continue
-            image = white_images[index]
-            x_pos = loc[0] * 100 + (17 if piece == 'pawn' else 10)
-            y_pos = loc[1] * 100 + (17 if piece == 'pawn' else 10)
-            screen.blit(image, (x_pos, y_pos))
-            if my_color == 'white' and current_turn_step < 2 and selection == i:
-                pygame.draw.rect(screen, 'red', [loc[0] * 100 + 1, loc[1] * 100 + 1, 98, 98], 3)
-        except Exception as e: print(f"Error drawing white piece {i}: {e}")
-
-    for i in range(len(b_pieces)):
-        try:
-            loc = b_locs[i]; piece = b_pieces[i]
-            if not isinstance(loc, (tuple, list)) or len(loc) != 2: continue
-            if piece not in piece_list: continue
-            index = piece_list.index(piece)
-            if not (0 <= index < len(black_images)): continue
-            image = black_images[index]
-            x_pos = loc[0] * 100 + (17 if piece == 'pawn' else 10)
-            y_pos = loc[1] * 100 + (17 if piece == 'pawn' else 10)
-            screen.blit(image, (x_pos, y_pos))
-            if my_color == 'black' and current_turn_step >= 2 and selection == i:
-                pygame.draw.rect(screen, 'blue', [loc[0] * 100 + 1, loc[1] * 100 + 1, 98, 98], 3)
-        except Exception as e: print(f"Error drawing black piece {i}: {e}")
-
-def draw_valid(moves):
-    global my_color
-    color = 'red' if my_color == 'white' else 'blue'
-    if not isinstance(moves, list): return
-
-    for move in moves:
-        try:
-            if isinstance(move, (list, tuple)) and len(move) == 2 and \
-               all(isinstance(c, int) for c in move) and \
-               0 <= move[0] <= 7 and 0 <= move[1] <= 7:
-                 pygame.draw.circle(screen, color, (move[0] * 100 + 50, move[1] * 100 + 50), 10)
-        except Exception as e: print(f"Error drawing valid move indicator: {e}")
-
-counter = 0 # Global counter for blinking effects
-def draw_check(state):
-    global counter
-    w_locs = state.get('white_locations', [])
-    w_pieces = state.get('white_pieces', [])
-    b_locs = state.get('black_locations', [])
-    b_pieces = state.get('black_pieces', [])
-    w_opts = state.get('white_options', [])
-    b_opts = state.get('black_options', [])
-    w_opts_flat = [move for sublist in w_opts if isinstance(sublist, list) for move in sublist if isinstance(move, (tuple, list)) and len(move) == 2]
-    b_opts_flat = [move for sublist in b_opts if isinstance(sublist, list) for move in sublist if isinstance(move, (tuple, list)) and len(move) == 2]
-
-    king_in_check = False
-    king_location = None
-    check_color = 'dark red'
-
-    try: # Check White King
-        if 'king' in w_pieces:
-            king_index_w = w_pieces.index('king')
-            if 0 <= king_index_w < len(w_locs):
-                king_location_w = w_locs[king_index_w]
-                if king_location_w in b_opts_flat:
-                    king_in_check = True
-                    king_location = king_location_w
-                    check_color = 'dark red'
-    except (ValueError, IndexError, TypeError): pass
-
-    try: # Check Black King (only if white not in check)
-        if not king_in_check and 'king' in b_pieces:
-            king_index_b = b_pieces.index('king')
-            if 0 <= king_index_b < len(b_locs):
-                king_location_b = b_locs[king_index_b]
-                if king_location_b in w_opts_flat:
-                    king_in_check = True
-                    king_location = king_location_b
-                    check_color = 'dark blue'
-    except (ValueError, IndexError, TypeError): pass
-
-    if king_in_check and king_location and isinstance(king_location, (list, tuple)) and len(king_location) == 2:
-        if counter < 15: # Blinking effect
-            try:
-                 pygame.draw.rect(screen, check_color, [king_location[0] * 100 + 1, king_location[1] * 100 + 1, 98, 98], 5)
-            except Exception as e: print(f"Error drawing check rect: {e}")
-
-def draw_game_over(state):
+         screen.blit(rendered(font, "Waiting for opponent...", 'yellow'), (350, 820))
+
+check_blink_on = True # Check outline phase, set by the main loop
+def board_scene(state, view):
+    """{(x, y): [piece, selection outline, check outline, move dot, promotion piece]} for every
+    square that shows more than bare board. piece is (color, name); the rest are colors or None.
+    view is the PositionView of state."""
+    scene = {}
+    mover = 'white' if state.get('turn_step', 0) < 2 else 'black'
+    for square, (color, piece, i) in view.pieces.items():
+        if piece not in piece_list: continue
+        outline = ('red' if color == 'white' else 'blue') if color == my_color == mover and selection == i else None
+        scene[square] = [(color, piece), outline, None, None, None]
+
+    if view.check and check_blink_on: # Blinking effect
+        scene.setdefault(view.check[0], [None, None, None, None, None])[2] = view.check[1]
+
+    if selection != 100:
+        dot_color = 'red' if my_color == 'white' else 'blue'
+        for move in valid_moves_display: # Squares already checked by PositionView
+            scene.setdefault(move, [None, None, None, None, None])[3] = dot_color
+
+    if promotion_choice:
+        for piece, square in zip(PROMOTION_PIECES, promotion_squares(promotion_choice[1])):
+            scene.setdefault(square, [None, None, None, None, None])[4] = piece
+    return scene
+
+def draw_square(square, content):
+    # The square's background was just repainted; content is its board_scene() entry
+    x, y = square
+    piece, outline, check_color, dot_color, promotion_piece = content
+    try:
+        if promotion_piece: # The picker box hides whatever is under it
+            sprite = piece_sprites.get('white' if my_color == 'white' else 'black', promotion_piece)
+            pygame.draw.rect(screen, 'white', [x * 100 + 1, y * 100 + 1, 98, 98])
+            pygame.draw.rect(screen, 'gold', [x * 100 + 1, y * 100 + 1, 98, 98], 3)
+            screen.blit(sprite, (x * 100 + 10, y * 100 + 10))
+            return
+        if piece:
+            color, name = piece
+            image = piece_sprites.get(color, name)
+            offset = 17 if name == 'pawn' else 10
+            screen.blit(image, (x * 100 + offset, y * 100 + offset))
+        if outline: pygame.draw.rect(screen, outline, [x * 100 + 1, y * 100 + 1, 98, 98], 3)
+        if check_color: pygame.draw.rect(screen, check_color, [x * 100 + 1, y * 100 + 1, 98, 98], 5)
+        if dot_color: pygame.draw.circle(screen, dot_color, (x * 100 + 50, y * 100 + 50), 10)
+    except Exception as e: print(f"Error drawing square {square}: {e}")
+
+PROMOTION_PIECES = ('queen', 'rook', 'bishop', 'knight')
+def promotion_squares(target):
+    # The picker's boxes run from the target square down its file, towards our side of the board
+    step = -1 if target[1] == 7 else 1
+    return [(target[0], target[1] + step * i) for i in range(len(PROMOTION_PIECES))]
+
+def game_over_message(state):
+    """Text of the game over banner, or None while the game goes on."""
+    if not state.get('game_over', False): return None
     winner = state.get('winner', '')
-    if winner != '':
+    if winner == '' and state.get('game_started'): # No winner: stalemate, or the side to move could still move (repetition)
+        mover_options = state.get('white_options' if state.get('turn_step', 0) < 2 else 'black_options', [])
+        return f"Draw by {'repetition' if any(mover_options) else 'stalemate'}"
+    if winner == '': return None
+    message = f'{winner.capitalize()} won the game'
+    white_time = state.get('white_time', -1)
+    black_time = state.get('black_time', -1)
+
+    if winner == 'white' and black_time == 0: message += " (on time)!"
+    elif winner == 'black' and white_time == 0: message += " (on time)!"
+    # Add other win reasons if server sends them (e.g., disconnect)
+    else: message += "!"
+    return message
+
+def draw_game_over(message):
+    try:
+        pygame.draw.rect(screen, 'black', GAME_OVER_RECT)
+        screen.blit(rendered(medium_font, message, 'white'), (220, 360))
+        screen.blit(rendered(font, 'Click anywhere to exit', 'white'), (380, 410))
+    except Exception as e: print(f"Error rendering game over text: {e}")
+
+chat_layouts = {} # {(id, text, timestamp, sent by us, width): chat_bubble()}; a message is laid out once
+
+def wrap_text(text, max_width):
+    """text word-wrapped to lines at most max_width pixels wide in font (an overlong word is cut once)."""
+    words = text.split(' '); lines = []; current_line = ""
+    for word in words:
+        if not word: continue
+        test_line = current_line + word + " "
         try:
-            pygame.draw.rect(screen, 'black', [200, 350, 600, 100])
-            message = f'{winner.capitalize()} won the game'
-            white_time = state.get('white_time', -1)
-            black_time = state.get('black_time', -1)
-
-            if winner == 'white' and black_time == 0: message += " (on time)!"
-            elif winner == 'black' and white_time == 0: message += " (on time)!"
-            # Add other win reasons if server sends them (e.g., disconnect)
-            else: message += "!"
-
-            screen.blit(medium_font.render(message, True, 'white'), (220, 360))
-            screen.blit(font.render('Click anywhere to exit', True, 'white'), (380, 410))
-        except Exception as e: print(f"Error rendering game over text: {e}")
-
-def draw_chat(state):
-    global text_offset, chat_scroll_offset, last_chat_length, my_color, chat_input, chat_active, cursor_visible
-    chat_area_rect = pygame.Rect(CHAT_X, CHAT_Y, CHAT_WIDTH, CHAT_HEIGHT)
-
-    # Background Gradient
-    for i in range(CHAT_HEIGHT):
-        ratio = i / CHAT_HEIGHT
-        r = int(BG_COLOR_TOP[0] * (1 - ratio) + BG_COLOR_BOTTOM[0] * ratio)
-        g = int(BG_COLOR_TOP[1] * (1 - ratio) + BG_COLOR_BOTTOM[1] * ratio)
-        b = int(BG_COLOR_TOP[2] * (1 - ratio) + BG_COLOR_BOTTOM[2] * ratio)
-        pygame.draw.line(screen, (r, g, b), (CHAT_X, CHAT_Y + i), (CHAT_X + CHAT_WIDTH, CHAT_Y + i))
-    pygame.draw.rect(screen, 'black', chat_area_rect, 2)
-
-    # Message Rendering
-    chat_history = state.get('chat_history', [])
-    if not isinstance(chat_history, list): chat_history = []
-
+             if font.size(test_line.strip())[0] <= max_width: current_line = test_line
+             else:
+                 if current_line: lines.append(current_line.strip())
+                 if font.size(word)[0] > max_width:
+                      cutoff = 0
+                      for k in range(len(word)):
+                           if font.size(word[:k+1])[0] > max_width: cutoff = k; break
+                      if cutoff > 0: lines.append(word[:cutoff]) # Add cut part
+                      current_line = word[cutoff:] + " " # Start new line with remainder
+                 else: current_line = word + " "
+        except Exception: current_line = word + " " # Fallback
+    if current_line: lines.append(current_line.strip())
+    if not lines and text: lines = [text]
+    return lines
+
+def chat_bubble(message, max_text_width):
+    """{'is_mine', 'lines': rendered lines, 'ts': rendered timestamp, 'w', 'h'} of one message."""
+    is_mine = message.get('sender') == my_color
+    text = message.get('text', ''); timestamp = message.get('timestamp', '')
+    key = (message.get('id'), text, timestamp, is_mine, max_text_width)
+    bubble = chat_layouts.get(key)
+    if bubble: return bubble
+    text_color = 'black' if is_mine else 'white'
+    lines = [font.render(line, True, text_color) for line in wrap_text(text, max_text_width)]
+    bubble_height = len(lines) * font.get_linesize() + BUBBLE_PADDING * 2
+    max_line_wd = max((line.get_width() for line in lines), default=0)
+    bubble_width = max(50, min(max_line_wd + BUBBLE_PADDING * 2, max_text_width + BUBBLE_PADDING * 2))
+    ts_surf = None
+    try:
+        ts_surf = small_font.render(timestamp, True, (100,100,100) if is_mine else (180,180,180))
+        bubble_height += ts_surf.get_height() + 5
+    except Exception: pass
+    if len(chat_layouts) >= 2 * CHAT_CAPACITY: chat_layouts.clear() # Mostly lines that scrolled out of the log
+    bubble = chat_layouts[key] = {'is_mine': is_mine, 'lines': lines, 'ts': ts_surf, 'w': bubble_width, 'h': bubble_height}
+    return bubble
+
+def draw_chat_messages(chat_messages):
+    global chat_scroll_offset, last_chat_id, my_color
+    # Message Layout (cached per message, see chat_bubble)
     max_text_width = CHAT_WIDTH - 2 * BUBBLE_MARGIN - 2 * BUBBLE_PADDING - 10
-    message_data = []
     line_height = font.get_linesize()
-
-    for i, message in enumerate(chat_history):
-         if not isinstance(message, dict): continue
-         is_mine = message.get('sender') == my_color
-         text = message.get('text', ''); timestamp = message.get('timestamp', '')
-         words = text.split(' '); lines = []; current_line = ""
-         # Word wrap logic (same as before)
-         for word in words:
-            if not word: continue
-            test_line = current_line + word + " "
-            try:
-                 test_surface = font.render(test_line.strip(), True, 'black')
-                 if test_surface.get_width() <= max_text_width: current_line = test_line
-                 else:
-                     if current_line: lines.append(current_line.strip())
-                     if font.render(word, True, 'black').get_width() > max_text_width:
-                          cutoff = 0
-                          for k in range(len(word)):
-                               if font.render(word[:k+1], True, 'black').get_width() > max_text_width: cutoff = k; break
-                          if cutoff > 0: lines.append(word[:cutoff]) # Add cut part
-                          current_line = word[cutoff:] + " " # Start new line with remainder
-                     else: current_line = word + " "
-            except Exception: current_line = word + " " # Fallback
-         if current_line: lines.append(current_line.strip())
-         if not lines and text: lines = [text]
-         # Bubble size calculation (same as before)
-         bubble_height = len(lines) * line_height + BUBBLE_PADDING * 2
-         max_line_wd = 0
-         if lines: max_line_wd = max(font.render(line, True, 'black').get_width() for line in lines)
-         bubble_width = max(50, min(max_line_wd + BUBBLE_PADDING * 2, max_text_width + BUBBLE_PADDING * 2))
-         try: ts_surf = small_font.render(timestamp, True, (0,0,0)); bubble_height += ts_surf.get_height() + 5
-         except Exception: pass
-         message_data.append({'is_mine': is_mine, 'lines': lines, 'ts': timestamp, 'w': bubble_width, 'h': bubble_height})
-
+    message_data = [chat_bubble(message, max_text_width) for message in chat_messages if isinstance(message, dict)]
 
     # Scrolling (same as before)
     total_content_height = sum(md['h'] + BUBBLE_MARGIN for md in message_data)
-    input_box_height = 50
-    visible_message_area_height = CHAT_HEIGHT - input_box_height
-    if len(chat_history) > last_chat_length:
+    visible_message_area_height = CHAT_HEIGHT - CHAT_INPUT_HEIGHT
+    newest_id = chat_messages[-1].get('id', 0) if chat_messages else 0
+    if newest_id > last_chat_id:
         if chat_scroll_offset >= -(total_content_height - visible_message_area_height + 2 * line_height) or total_content_height <= visible_message_area_height :
              chat_scroll_offset = -max(0, total_content_height - visible_message_area_height)
-    last_chat_length = len(chat_history)
+    last_chat_id = newest_id
     max_scroll = max(0, total_content_height - visible_message_area_height)
     chat_scroll_offset = max(-max_scroll, min(0, chat_scroll_offset))
 
@@ -363,26 +345,24 @@ def draw_chat(state):
             try:
                 pygame.draw.rect(screen, bubble_color, bubble_rect, border_radius=BUBBLE_RADIUS)
                 text_y = current_y + BUBBLE_PADDING
-                text_color = 'black' if md['is_mine'] else 'white'
-                for line in md['lines']:
-                    text_surface = font.render(line, True, text_color)
-                    screen.blit(text_surface, (bubble_x + BUBBLE_PADDING, text_y))
+                for line_surface in md['lines']:
+                    screen.blit(line_surface, (bubble_x + BUBBLE_PADDING, text_y))
                     text_y += line_height
-                ts_surf = small_font.render(md['ts'], True, (100,100,100) if md['is_mine'] else (180,180,180))
-                screen.blit(ts_surf, (bubble_x + BUBBLE_PADDING, text_y + 2))
+                if md['ts']: screen.blit(md['ts'], (bubble_x + BUBBLE_PADDING, text_y + 2))
             except Exception as e: print(f"Error drawing message bubble: {e}")
         current_y += md['h'] + BUBBLE_MARGIN
     screen.set_clip(None)
 
-    # Draw Input Box (same as before)
-    input_area_y = CHAT_Y + CHAT_HEIGHT - input_box_height + 5
+def draw_chat_input():
+    global text_offset
+    input_area_y = CHAT_Y + CHAT_HEIGHT - CHAT_INPUT_HEIGHT + 5
     input_box_width = CHAT_WIDTH - 40
     input_box_rect = pygame.Rect(CHAT_X + 5, input_area_y, input_box_width, 30)
     visible_text_area_width = input_box_width - 10
     try:
         pygame.draw.rect(screen, (220, 220, 220), input_box_rect)
         pygame.draw.rect(screen, 'black', input_box_rect, 2 if not chat_active else 4)
-        input_surface = font.render(chat_input, True, 'black')
+        input_surface = rendered(font, chat_input, 'black')
         input_width = input_surface.get_width()
         if input_width > visible_text_area_width: text_offset = input_width - visible_text_area_width
         else: text_offset = 0
@@ -400,9 +380,11 @@ def draw_chat(state):
     except Exception as e: print(f"Error drawing chat input: {e}")
 
 
-def draw_timers(state):
-    white_time = state.get('white_time', INITIAL_TIME_SECONDS)
-    black_time = state.get('black_time', INITIAL_TIME_SECONDS)
+def clock_texts(state):
+    white_time, black_time = displayed_clocks(state, time.monotonic(), clock_sync.offset)
+    return format_time(white_time), format_time(black_time)
+
+def draw_timers(texts):
     timer_area_y = 810; timer_box_height = 80; timer_width_each = 130; spacing = 15
     black_timer_x = WIDTH - timer_width_each - 15
     white_timer_x = black_timer_x - timer_width_each - spacing
@@ -411,9 +393,9 @@ def draw_timers(state):
     try:
         pygame.draw.rect(screen, (210, 210, 210), white_timer_rect); pygame.draw.rect(screen, (40, 40, 40), black_timer_rect)
         pygame.draw.rect(screen, 'black', white_timer_rect, 2); pygame.draw.rect(screen, 'white', black_timer_rect, 2)
-        white_time_str = format_time(white_time); black_time_str = format_time(black_time)
-        white_label_surface = timer_label_font.render("White", True, 'black'); black_label_surface = timer_label_font.render("Black", True, 'white')
-        white_timer_surface = timer_display_font.render(white_time_str, True, 'black'); black_timer_surface = timer_display_font.render(black_time_str, True, 'white')
+        white_time_str, black_time_str = texts
+        white_label_surface = rendered(timer_label_font, "White", 'black'); black_label_surface = rendered(timer_label_font, "Black", 'white')
+        white_timer_surface = rendered(timer_display_font, white_time_str, 'black'); black_timer_surface = rendered(timer_display_font, black_time_str, 'white')
         white_label_rect = white_label_surface.get_rect(centerx=white_timer_rect.centerx, top=white_timer_rect.top + 5)
         black_label_rect = black_label_surface.get_rect(centerx=black_timer_rect.centerx, top=black_timer_rect.top + 5)
         label_height = white_label_rect.height + 5
@@ -423,6 +405,42 @@ def draw_timers(state):
         screen.blit(white_timer_surface, white_text_rect); screen.blit(black_timer_surface, black_text_rect)
     except Exception as e: print(f"Error drawing timers: {e}")
 
+def render_frame(state, view, chat_messages):
+    """Repaints the game screen regions whose content changed since the last frame."""
+    banner = game_over_message(state)
+    regions.changed_everywhere('game_over', banner) # It covers parts of the board and the status bar
+    if regions.full: screen.blit(background, (0, 0))
+
+    scene = board_scene(state, view)
+    for y in range(8):
+        for x in range(8):
+            content = scene.get((x, y))
+            rect = (x * 100, y * 100, 100, 100)
+            if regions.changed((x, y), tuple(content) if content else None, rect):
+                paint_background(rect)
+                if content: draw_square((x, y), content)
+
+    if regions.changed('status', (state.get('turn_step', 0), my_color, state.get('game_started')), STATUS_RECT):
+        paint_background(STATUS_RECT)
+        draw_status(state)
+    texts = clock_texts(state)
+    if regions.changed('timers', texts, TIMERS_RECT):
+        paint_background(TIMERS_RECT)
+        draw_timers(texts)
+
+    newest_id = chat_messages[-1].get('id', 0) if chat_messages else 0
+    if regions.changed('chat', (newest_id, len(chat_messages), chat_scroll_offset, my_color), CHAT_MESSAGES_RECT):
+        paint_background(CHAT_MESSAGES_RECT)
+        draw_chat_messages(chat_messages)
+        regions.remember('chat', (newest_id, len(chat_messages), chat_scroll_offset, my_color)) # It may have scrolled
+    if regions.changed('chat_input', (chat_input, chat_active, cursor_visible), CHAT_INPUT_RECT):
+        paint_background(CHAT_INPUT_RECT)
+        draw_chat_input()
+
+    if banner and regions.touched(GAME_OVER_RECT): # Something under it was repainted
+        draw_game_over(banner)
+        regions.mark(GAME_OVER_RECT)
+
 # --- Networking Code ---
 
 def receive_bytes(sock, num_bytes):
@@ -452,18 +470,18 @@ def receive_one_message(sock):
     if message_data is None: return None
 
     try:
-        message = pickle.loads(message_data)
+        message = wire_codec.decode(message_data)
         return message
-    except (pickle.UnpicklingError, ValueError, TypeError) as e: # Catch more potential unpickling errors
-        print(f"Error unpickling message (length {message_length}): {e}")
+    except wire.WireError as e:
+        print(f"Error decoding {wire_codec.name} message (length {message_length}): {e}")
         return None
     except Exception as e:
-        print(f"Unexpected error during unpickling: {e}")
+        print(f"Unexpected error during decoding: {e}")
         return None
 
 
 def receive_updates():
-    global game_state, connected, network_error, client_socket, game_state_lock, my_color
+    global game_state, connected, network_error, client_socket, game_state_lock, my_color, resync_requested, resume_seat, chat_sync_requested, state_version
     print("Receive thread started.")
     while connected and client_socket:
         message = receive_one_message(client_socket)
@@ -480,9 +498,44 @@ def receive_updates():
                  my_color = message['my_color_late']
                  print(f"Received late assignment: {my_color}")
 
+            if message.get('type') == 'time_sync':
+                 clock_sync.on_reply(message.get('data'), time.monotonic())
+                 if clock_sync.samples < TIME_SYNC_PROBES: # One probe in flight at a time
+                     send_message('time_sync', {'client': time.monotonic()})
+            elif message.get('type') == 'seat':
+                 resume_seat = (message.get('game_id'), message.get('token'))
+            elif message.get('type') == 'chat_append':
+                 with game_state_lock:
+                     in_order = chat_log.extend(message.get('messages', []))
+                     state_version += 1
+                 if not in_order and not chat_sync_requested: # Missed some lines; the reply brings them too
+                     chat_sync_requested = True
+                     send_message('chat_sync', chat_log.last_id)
+            elif message.get('type') == 'chat_sync':
+                 with game_state_lock:
+                     chat_log.extend(message.get('messages', []), allow_gap=True)
+                     state_version += 1
+                 chat_sync_requested = False
             # Game state check (basic)
-            if 'turn_step' in message and 'white_pieces' in message:
-                 with game_state_lock: game_state = message
+            elif is_full_state(message):
+                 with game_state_lock:
+                     game_state = message
+                     state_version += 1
+                 resync_requested = False
+                 if message.get('game_over'): resume_seat = None
+                 if message.get('chat_id', 0) > chat_log.last_id: # Joined or resynced mid-game: fetch the chat
+                     chat_sync_requested = True
+                     send_message('chat_sync', chat_log.last_id)
+            elif is_delta(message):
+                 with game_state_lock:
+                     local_seq = game_state.get('seq')
+                     stale = local_seq is not None and message.get('seq', 0) <= local_seq # Already in our snapshot
+                     new_state = None if stale else apply_delta(game_state, message)
+                     if new_state is not None: game_state = new_state; state_version += 1
+                     if message.get('game_over'): resume_seat = None
+                 if new_state is None and not stale and not resync_requested:
+                     resync_requested = True
+                     send_message('resync', None) # Server answers with a full snapshot
             # elif message.get('status') == 'waiting': # Example status msg
             #      print("Server update: Still waiting for opponent.")
             # else: Handle other dict messages
@@ -500,6 +553,7 @@ def receive_updates():
             # Handle other errors
 
         # else: Ignore unexpected message types silently? or log warning.
+        wakeup.set() # Whatever it was (state, chat, clock offset, assignment) may show on screen
 
     # Cleanup after loop
     print("Receive thread stopped.")
@@ -508,18 +562,18 @@ def receive_updates():
         try: client_socket.close()
         except: pass
         client_socket = None
+    wakeup.set() # Show the error screen
 
-# Server expects unframed messages from client for now
-def send_message(message_type, data):
+# Messages to the server are framed and encoded with the negotiated codec
+def send_message(message_type, data, **fields):
     global network_error, connected, client_socket
     if connected and client_socket and client_socket.fileno() != -1: # Check socket validity
         try:
             if message_type == 'chat' and isinstance(data, dict):
                 data['timestamp'] = datetime.now().strftime("%I:%M %p")
-            message = {'type': message_type, 'data': data}
-            serialized_message = pickle.dumps(message)
-            client_socket.sendall(serialized_message)
-        except (socket.error, pickle.PicklingError, BrokenPipeError) as e:
+            message = {'type': message_type, 'data': data, **fields}
+            client_socket.sendall(wire.frame_message(message, wire_codec))
+        except (socket.error, wire.WireError, pickle.PicklingError, BrokenPipeError) as e:
             print(f"Send Error: {e}"); network_error = "Send failed"; connected = False
         except Exception as e:
             print(f"Unexpected Send Error: {e}"); network_error = "Send failed"; connected = False
@@ -527,7 +581,7 @@ def send_message(message_type, data):
 
 
 def connect_to_server():
-    global connected, my_color, network_error, client_socket, game_state_lock, game_state
+    global connected, my_color, network_error, client_socket, game_state_lock, game_state, wire_codec, clock_sync, resume_seat, chat_log, chat_sync_requested
     if client_socket:
         try: client_socket.close()
         except: pass
@@ -536,21 +590,30 @@ def connect_to_server():
         client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         client_socket.settimeout(10.0) # Increased timeout
         client_socket.connect((SERVER_IP, PORT))
+        client_socket.sendall(wire.client_handshake(spectate_game_id=SPECTATE_GAME_ID, rating=RATING, resume=resume_seat))
+        if not resume_seat and not SPECTATE_GAME_ID: chat_log = ChatLog() # A new game; rejoining keeps ours and catches up
+        chat_sync_requested = False
+        negotiated_codec = wire.parse_handshake_ack(receive_bytes(client_socket, wire.HANDSHAKE_ACK_SIZE) or b"")
+        if negotiated_codec is None: raise socket.error("Wire handshake failed.")
+        wire_codec = negotiated_codec
         client_socket.settimeout(None)
-        print("Connected. Waiting for assignment...")
+        print(f"Connected ({wire_codec.name} protocol). Waiting for assignment...")
 
         assignment_data = receive_one_message(client_socket)
 
         if assignment_data is None: raise socket.error("No assignment received.")
 
-        if isinstance(assignment_data, str) and assignment_data in ['white', 'black']:
+        if isinstance(assignment_data, str) and assignment_data in ['white', 'black', 'spectator']:
             my_color = assignment_data
             print(f"Assigned color: {my_color}")
             connected = True; network_error = None
+            clock_sync = ClockSync()
             threading.Thread(target=receive_updates, daemon=True).start()
+            send_message('time_sync', {'client': time.monotonic()}) # Replies chain the remaining probes
         # Handle potential waiting status from server more explicitly if needed
         # elif isinstance(assignment_data, dict) and assignment_data.get("status") == "waiting": ...
         elif isinstance(assignment_data, str) and "error:" in assignment_data:
+            if resume_seat: resume_seat = None # Our game is gone; the next retry joins the queue
             network_error = f"Server Error: {assignment_data.split(':', 1)[1]}"
             print(network_error); connected = False; client_socket.close(); client_socket = None
         else: # Includes potential "waiting" status if not handled explicitly
@@ -563,37 +626,94 @@ def connect_to_server():
 
 
 # --- Main Game Loop ---
+def draw_connecting_screen():
+    screen.fill('dark gray')
+    try:
+        conn_surf = medium_font.render("Connecting...", True, 'white')
+        screen.blit(conn_surf, (WIDTH // 2 - conn_surf.get_width() // 2, HEIGHT // 2 - 20))
+    except Exception as e: print(f"Error drawing connecting screen: {e}")
+
+def seconds_to_next_frame(state, now):
+    """How long the main loop may sleep before something on screen changes by itself, or None
+    if nothing will until the next event."""
+    if POLL_LOOP: return 0.0
+    if not connected: return None
+    deadlines = []
+    if chat_active: deadlines.append(CURSOR_BLINK_SECONDS - cursor_timer)
+    if position_view.check: deadlines.append(CHECK_BLINK_SECONDS / 2 - now % (CHECK_BLINK_SECONDS / 2))
+    clock_tick = seconds_to_clock_tick(state, now, clock_sync.offset)
+    if clock_tick is not None: deadlines.append(clock_tick + CLOCK_TICK_SLACK)
+    return max(0.0, min(deadlines)) if deadlines else None
+
+draw_connecting_screen() # Something to look at while the artwork loads and the server answers
+pygame.display.flip()
+background = build_background()
+regions = DirtyRegions((0, 0, WIDTH, HEIGHT))
+frame_stats = {'frames': 0, 'draw': 0.0, 'present': 0.0, 'pixels': 0, 'since': time.monotonic(), 'cpu': time.process_time()}
+pygame.event.set_blocked(pygame.MOUSEMOTION) # Nothing follows the mouse; don't wake up for it
+try: piece_sprites.load()
+except pygame.error as e:
+    print(f"Pygame Error loading assets: {e}")
+    pygame.quit(); sys.exit()
+except FileNotFoundError as e:
+    print(f"Asset file not found: {e}. Make sure assets/images directory exists and contains the png files.")
+    pygame.quit(); sys.exit()
 connect_to_server() # Attempt initial connection
 
 run = True
+drawn_version = None # state_version current_frame_state was copied at; None: not since connecting
+position_view = PositionView(game_state) # Of current_frame_state; rebuilt when a new state is copied
+sleep_for = 0.0 # From seconds_to_next_frame(); 0 draws the next frame straight away
+last_frame = time.monotonic()
 while run:
-    timer.tick(fps)
-    elapsed_time = timer.get_time() / 1000.0
-
-    # Cursor blinking
-    cursor_timer += elapsed_time
-    if cursor_timer >= 0.5:
-        cursor_visible = not cursor_visible
-        cursor_timer %= 0.5
+    # Sleep until there is input, the receive thread wakes us, or an animation step is due.
+    # Not pygame.event.wait(): pygame 2 implements it by polling every millisecond
+    wake_at = None if sleep_for is None else time.monotonic() + sleep_for
+    events = pygame.event.get()
+    while not events and not wakeup.is_set():
+        nap = INPUT_POLL_SECONDS if wake_at is None else min(INPUT_POLL_SECONDS, wake_at - time.monotonic())
+        if nap <= 0: break
+        wakeup.wait(nap)
+        events = pygame.event.get()
+    wakeup.clear() # Before copying the state, so a message arriving from here on wakes us again
+    now = time.monotonic()
+    elapsed_time = now - last_frame
+    last_frame = now
+
+    # Cursor blinking (only drawn while typing)
+    if chat_active:
+        cursor_timer += elapsed_time
+        if cursor_timer >= CURSOR_BLINK_SECONDS:
+            cursor_visible = not cursor_visible
+            cursor_timer %= CURSOR_BLINK_SECONDS
 
     # Blinking for check indicator
-    counter = (counter + 1) % 30
+    check_blink_on = now % CHECK_BLINK_SECONDS < CHECK_BLINK_SECONDS / 2
 
-    # Get current state safely
+    # Get current state safely (copied only when the receive thread changed it)
     if connected:
-        with game_state_lock: current_frame_state = game_state.copy()
+        if drawn_version != state_version:
+            with game_state_lock:
+                current_frame_state = game_state.copy()
+                chat_messages = list(chat_log)
+                drawn_version = state_version
+            position_view = PositionView(current_frame_state)
     else:
+        drawn_version = None
+        chat_messages = []
         # Use default state if not connected
         current_frame_state = {
              'white_pieces': [], 'white_locations': [], 'black_pieces': [], 'black_locations': [],
              'captured_white': [], 'captured_black': [], 'turn_step': 0, 'game_over': False,
-             'winner': '', 'white_options': [], 'black_options': [], 'chat_history': [],
+             'winner': '', 'white_options': [], 'black_options': [],
              'white_time': 0, 'black_time': 0, 'game_started': False, 'game_id': None
         }
 
-    # Drawing
-    screen.fill((40, 40, 40))
-    if not connected and network_error:
+    # Drawing (only what changed; see render_frame)
+    frame_started = time.perf_counter()
+    if FULL_REDRAW: regions.invalidate()
+    regions.changed_everywhere('screen', 'game' if connected else ('error', network_error) if network_error else 'connecting')
+    if not connected and network_error and regions.full:
         # Draw Error Screen
         screen.fill('dark gray')
         try:
@@ -604,38 +724,25 @@ while run:
             screen.blit(reason_surf, (WIDTH // 2 - reason_surf.get_width() // 2, HEIGHT // 2 - 20))
             screen.blit(retry_surf, (WIDTH // 2 - retry_surf.get_width() // 2, HEIGHT // 2 + 20))
         except Exception as e: print(f"Error drawing error screen: {e}")
-    elif not connected and not network_error:
-        # Draw Connecting Screen
-        screen.fill('dark gray')
-        try:
-            conn_surf = medium_font.render("Connecting...", True, 'white')
-            screen.blit(conn_surf, (WIDTH // 2 - conn_surf.get_width() // 2, HEIGHT // 2 - 20))
-        except Exception as e: print(f"Error drawing connecting screen: {e}")
+    elif not connected and not network_error and regions.full:
+        draw_connecting_screen()
     # elif connected and my_color is None and not current_frame_state.get('game_started', False):
-        # Draw Waiting Screen (handled by draw_board status text now)
+        # Draw Waiting Screen (handled by draw_status text now)
         # pass
     elif connected: # Includes waiting, assigning, and playing states
         try:
-            draw_board(current_frame_state)
-            draw_pieces(current_frame_state)
-            draw_check(current_frame_state)
-            draw_chat(current_frame_state)
-            draw_timers(current_frame_state)
-
-            if selection != 100:
-                if isinstance(valid_moves_display, list):
-                    draw_valid(valid_moves_display)
-                else: valid_moves_display = [] # Reset if invalid
-
-            if current_frame_state.get('game_over', False):
-                draw_game_over(current_frame_state)
+            render_frame(current_frame_state, position_view, chat_messages)
         except Exception as draw_err:
              print(f"!!! Error during main drawing phase: {draw_err} !!!")
+             regions.invalidate() # Start over from a clean window next frame
+    dirty_rects = regions.take()
+    frame_drawn = time.perf_counter()
 
 
     # Event Handling
-    for event in pygame.event.get():
+    for event in events:
         if event.type == pygame.QUIT: run = False
+        if event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED): regions.invalidate() # Uncovered; repaint it all
 
         if event.type == pygame.KEYDOWN:
             if not connected and network_error and event.key == pygame.K_q: run = False
@@ -662,7 +769,7 @@ while run:
                 send_button_cx = CHAT_X + CHAT_WIDTH - 20; send_button_cy = input_area_y + 15; send_button_radius_sq = 12**2
                 clicked_chat_area = False
                 if input_box_rect.collidepoint(x_coord, y_coord):
-                     chat_active = True; cursor_visible = True; cursor_timer = 0; selection = 100; valid_moves_display = []; clicked_chat_area = True
+                     chat_active = True; cursor_visible = True; cursor_timer = 0; selection = 100; valid_moves_display = frozenset(); clicked_chat_area = True
                 elif (x_coord - send_button_cx)**2 + (y_coord - send_button_cy)**2 <= send_button_radius_sq:
                     if chat_input.strip(): send_message('chat', {'text': chat_input.strip()})
                     chat_input = ""; text_offset = 0; cursor_visible = True; cursor_timer = 0; clicked_chat_area = True
@@ -684,41 +791,36 @@ while run:
                     is_my_turn = (my_color == 'white' and current_frame_state.get('turn_step', 0) < 2) or \
                                  (my_color == 'black' and current_frame_state.get('turn_step', 0) >= 2)
 
-                    if is_my_turn:
-                        my_pieces = current_frame_state.get(f'{my_color}_pieces', [])
-                        my_locs = current_frame_state.get(f'{my_color}_locations', [])
-                        my_opts = current_frame_state.get(f'{my_color}_options', [])
+                    if is_my_turn and promotion_choice: # Picking a promotion piece; any other click cancels
+                        promotion_squares_list = promotion_squares(promotion_choice[1])
+                        if click_coords in promotion_squares_list:
+                            piece = PROMOTION_PIECES[promotion_squares_list.index(click_coords)]
+                            send_message('move', promotion_choice, promotion=piece)
+                        promotion_choice = None; selection = 100; valid_moves_display = frozenset()
+                    elif is_my_turn:
+                        clicked_piece_index = position_view.piece_at(click_coords, my_color)
 
-                        clicked_my_piece = False
-                        clicked_piece_index = -1
-                        if click_coords in my_locs:
-                            try:
-                                clicked_piece_index = my_locs.index(click_coords)
-                                clicked_my_piece = True
-                            except ValueError: pass # Should not happen if in my_locs
-
-                        if clicked_my_piece:
+                        if clicked_piece_index is not None:
                             if clicked_piece_index == selection: # Deselect
-                                selection = 100; valid_moves_display = []
+                                selection = 100; valid_moves_display = frozenset()
                             else: # Select new piece
                                 selection = clicked_piece_index
-                                # Validate options format before assigning
-                                if 0 <= selection < len(my_opts) and isinstance(my_opts[selection], list):
-                                     valid_moves_display = my_opts[selection]
-                                else:
-                                     valid_moves_display = []
-                                     # print(f"Warn: No/invalid options for {my_color} piece {selection}") # Reduce noise
+                                valid_moves_display = position_view.targets(my_color, selection) # Empty if its options are missing
                         elif selection != 100: # Piece already selected, clicked elsewhere
                             if click_coords in valid_moves_display: # Clicked valid move
-                                send_message('move', (selection, click_coords))
-                                selection = 100; valid_moves_display = []
+                                my_pieces = current_frame_state.get(f'{my_color}_pieces', [])
+                                if 0 <= selection < len(my_pieces) and my_pieces[selection] == 'pawn' and click_coords[1] in (0, 7):
+                                    promotion_choice = (selection, click_coords) # Ask what it becomes first
+                                else:
+                                    send_message('move', (selection, click_coords))
+                                    selection = 100; valid_moves_display = frozenset()
                             else: # Clicked invalid square, deselect
-                                selection = 100; valid_moves_display = []
+                                selection = 100; valid_moves_display = frozenset()
                         else: # Clicked empty/opponent square with nothing selected
-                             selection = 100; valid_moves_display = []
+                             selection = 100; valid_moves_display = frozenset()
                     else:
                         # print("Not your turn!") # Clicked out of turn
-                        selection = 100; valid_moves_display = []
+                        selection = 100; valid_moves_display = frozenset(); promotion_choice = None
 
             # Chat Scroll Wheel
             elif event.button == 4: # Scroll Up
@@ -730,7 +832,29 @@ while run:
                       chat_scroll_offset -= 30
 
 
-    pygame.display.flip()
+    if FULL_REDRAW: pygame.display.flip()
+    elif dirty_rects: pygame.display.update(dirty_rects)
+
+    if FRAME_STATS:
+        frame_stats['frames'] += 1
+        frame_stats['draw'] += frame_drawn - frame_started
+        frame_stats['present'] += time.perf_counter() - frame_drawn
+        frame_stats['pixels'] += WIDTH * HEIGHT if FULL_REDRAW else sum(rect[2] * rect[3] for rect in dirty_rects)
+        interval = time.monotonic() - frame_stats['since']
+        if interval >= FRAME_STATS_INTERVAL:
+            frames = frame_stats['frames']
+            print(f"Frame stats ({'full redraw' if FULL_REDRAW else 'dirty regions'}, {'polling' if POLL_LOOP else 'event driven'}): "
+                  f"{frames} frames ({frames / interval:.1f}/s), "
+                  f"draw {frame_stats['draw'] / frames * 1000:.2f} ms, present {frame_stats['present'] / frames * 1000:.2f} ms, "
+                  f"{frame_stats['pixels'] / frames / (WIDTH * HEIGHT):.1%} of the window updated per frame, "
+                  f"{(time.process_time() - frame_stats['cpu']) / interval:.1%} CPU")
+            frame_stats = {'frames': 0, 'draw': 0.0, 'present': 0.0, 'pixels': 0, 'since': time.monotonic(), 'cpu': time.process_time()}
+
+    timer.tick(fps) # Caps the frame rate while events or messages keep coming
+
+    # Input was handled after this frame was drawn, so show its effect now; otherwise sleep
+    if events: sleep_for = 0.0
+    else: sleep_for = seconds_to_next_frame(current_frame_state, time.monotonic())
 
 # Cleanup
 print("Exiting.")
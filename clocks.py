@@ -0,0 +1,91 @@
+# ######## clocks.py (Deadline-Driven Flag-Fall Scheduler) ########
+# Instead of polling every game's timers once a second, each running game registers the
+# monotonic time at which its side to move runs out of time. One thread sleeps until the
+# earliest such deadline, so an idle game costs nothing and a flag-fall is seen as it happens.
+import heapq
+import itertools
+import threading
+import time
+
+
+class ClockScheduler:
+    """Min-heap of flag-fall deadlines, one live deadline per key (game id).
+
+    arm() replaces a key's deadline; the old heap entry is left in place and skipped when it
+    surfaces (lazy deletion), so re-arming after every move is O(log n).
+    """
+    def __init__(self, on_expire, clock=time.monotonic):
+        self.on_expire = on_expire # Called as on_expire(key) from the scheduler thread, no locks held
+        self.clock = clock
+        self._heap = [] # (deadline, tiebreak, key)
+        self._deadlines = {} # {key: current deadline}
+        self._tiebreak = itertools.count()
+        self._condition = threading.Condition()
+        self._stopped = False
+
+    def arm(self, key, deadline):
+        """Sets (or with deadline=None, cancels) the deadline for key."""
+        with self._condition:
+            if deadline is None:
+                self._deadlines.pop(key, None)
+                return
+            if self._deadlines.get(key) == deadline: return
+            self._deadlines[key] = deadline
+            heapq.heappush(self._heap, (deadline, next(self._tiebreak), key))
+            if len(self._heap) > 2 * len(self._deadlines) + 64: self._compact()
+            if self._heap[0][2] == key: self._condition.notify() # New earliest deadline; wake the runner
+
+    def cancel(self, key):
+        self.arm(key, None)
+
+    def __len__(self):
+        with self._condition:
+            return len(self._deadlines)
+
+    def _compact(self):
+        # Called within lock. Drops superseded entries once they outnumber the live ones.
+        self._heap = [entry for entry in self._heap if self._deadlines.get(entry[2]) == entry[0]]
+        heapq.heapify(self._heap)
+
+    def _next_deadline(self):
+        # Called within lock. Earliest live deadline, discarding stale entries on the way.
+        while self._heap:
+            deadline, _, key = self._heap[0]
+            if self._deadlines.get(key) == deadline: return deadline
+            heapq.heappop(self._heap)
+        return None
+
+    def pop_expired(self, now=None):
+        """Removes and returns the keys whose deadline is at or before now, earliest first."""
+        now = self.clock() if now is None else now
+        expired = []
+        with self._condition:
+            while True:
+                deadline = self._next_deadline()
+                if deadline is None or deadline > now: break
+                _, _, key = heapq.heappop(self._heap)
+                del self._deadlines[key]
+                expired.append(key)
+        return expired
+
+    def run(self):
+        """Scheduler thread body: sleeps until the earliest deadline, then fires on_expire."""
+        while True:
+            with self._condition:
+                while not self._stopped:
+                    deadline = self._next_deadline()
+                    if deadline is not None and deadline <= self.clock(): break
+                    self._condition.wait(None if deadline is None else deadline - self.clock())
+                if self._stopped: return
+            for key in self.pop_expired():
+                try:
+                    self.on_expire(key)
+                except Exception as e:
+                    print(f"!!! ERROR IN CLOCK SCHEDULER CALLBACK for {key}: {e} !!!")
+                    import traceback
+                    traceback.print_exc()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
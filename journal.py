@@ -0,0 +1,299 @@
+# ######## journal.py (Append-Only Move Journal and Crash Recovery) ########
+# A crash used to lose every game in progress. With a journal, each Game appends its moves,
+# chat lines and results to a log on disk, and a restarted server replays the log to rebuild
+# the games that were still running. Records are small and binary:
+#   u32 payload length | u32 crc32(payload) | payload
+#   payload: u8 kind | u32 game number | kind-specific body
+# Game numbers are assigned by the journal so that per-move records need not repeat the
+# 36-character game id. A torn or corrupt record (the server died mid-write) ends replay of
+# its segment.
+#
+# Appends only copy bytes into a buffer. One flusher thread writes and fsyncs whatever has
+# accumulated since its last fsync (group commit), so many games' moves share one fsync and
+# nobody waits for more than about two of them. Servers hold a state update back from the
+# players until wait_durable() says its record is on disk, so a client never sees a move
+# that a crash could take back.
+#
+# The log is split into segments. When the active one grows past JOURNAL_SEGMENT_BYTES a
+# checkpoint starts a new segment, writes a snapshot of every live game into it, and then
+# deletes the older segments, which bounds both disk use and replay time.
+import os
+import struct
+import threading
+import zlib
+
+from wire import BINARY_CODEC, KINDS, COLOR_CODES, COLOR_TO_CODE, SQUARE_TO_BYTE, PIECE_CODES, PIECE_TO_CODE
+from movegen import SQUARE_COORDS
+
+# --- Constants ---
+JOURNAL_SEGMENT_BYTES = 64 * 1024 * 1024 # Checkpoint once the active segment is this large
+SEGMENT_PREFIX = 'journal-'
+SEGMENT_SUFFIX = '.log'
+
+KIND_GAME = 1 # Whole game: created, or snapshotted by a checkpoint. Body: id, seat tokens, state
+KIND_MOVE = 2 # Body: color, piece index, target square, white_time, black_time (after the move)[, under-promotion piece]
+KIND_CHAT = 3 # Body: color, text, timestamp
+KIND_RESULT = 4 # Game ended other than by mate or stalemate (flag fall, disconnection, repetition). Body: winner, clocks
+KIND_CLOSE = 5 # Game left the server; nothing to recover. No body
+KIND_CHECKPOINT = 6 # Every live game has been snapshotted above this point. Game number 0
+
+_FRAME = struct.Struct('>II')
+_RECORD = struct.Struct('>BI')
+_MOVE = struct.Struct('>BBBdd')
+_RESULT = struct.Struct('>Bdd')
+_enc_str, _dec_str = KINDS['str']
+
+
+class JournalError(Exception):
+    """Raised when the journal directory cannot be used."""
+
+
+def segment_path(directory, number):
+    return os.path.join(directory, f"{SEGMENT_PREFIX}{number:08d}{SEGMENT_SUFFIX}")
+
+
+def list_segments(directory):
+    """[(number, path)] of the journal segments in directory, oldest first."""
+    segments = []
+    for name in os.listdir(directory):
+        if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+            try: segments.append((int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]), os.path.join(directory, name)))
+            except ValueError: pass
+    return sorted(segments)
+
+
+def read_segment(path):
+    """Yields (kind, game_number, body_bytes) for each intact record of one segment file."""
+    with open(path, 'rb') as segment:
+        data = segment.read()
+    view = memoryview(data)
+    o = 0
+    while o + _FRAME.size <= len(data):
+        length, crc = _FRAME.unpack_from(view, o)
+        payload = view[o + _FRAME.size:o + _FRAME.size + length]
+        if length < _RECORD.size or len(payload) < length or zlib.crc32(payload) != crc:
+            print(f"Journal: {len(data) - o} bytes of torn or corrupt records at the end of {path}, ignored.")
+            return
+        kind, number = _RECORD.unpack_from(payload)
+        yield kind, number, payload[_RECORD.size:]
+        o += _FRAME.size + length
+
+
+def decode_body(kind, body):
+    """Turns a record body into the tuple the matching Game.replay_* method takes."""
+    if kind == KIND_GAME:
+        game_id, o = _dec_str(body, 0)
+        white_token, o = _dec_str(body, o)
+        black_token, o = _dec_str(body, o)
+        seats = {color: token for color, token in (('white', white_token), ('black', black_token)) if token}
+        return game_id, seats, BINARY_CODEC.decode(bytes(body[o:]))
+    if kind == KIND_MOVE:
+        color, index, square, white_time, black_time = _MOVE.unpack_from(body)
+        promotion = PIECE_CODES[body[_MOVE.size]] if len(body) > _MOVE.size else None
+        return COLOR_CODES[color], index, SQUARE_COORDS[square], white_time, black_time, promotion
+    if kind == KIND_CHAT:
+        color = COLOR_CODES[body[0]]
+        text, o = _dec_str(body, 1)
+        timestamp, o = _dec_str(body, o)
+        return color, text, timestamp
+    if kind == KIND_RESULT:
+        winner, white_time, black_time = _RESULT.unpack_from(body)
+        return (COLOR_CODES[winner] if winner < 2 else ''), white_time, black_time
+    return ()
+
+
+class Journal:
+    """Append-only, group-committed log of game changes in one directory.
+
+    Usage: construct, replay() what an earlier run left (server.recover_games), then start().
+    The log_* methods are called by a Game with its own lock held, so each game's records are
+    in the order its changes happened; they return the record's sequence number (LSN).
+    """
+    def __init__(self, directory, segment_bytes=JOURNAL_SEGMENT_BYTES, fsync=True):
+        try: os.makedirs(directory, exist_ok=True)
+        except OSError as e: raise JournalError(f"cannot use journal directory {directory}: {e}")
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.games_provider = None # () -> iterable of live Games; checkpoints snapshot each
+        self._lock = threading.Lock() # Guards the fields below
+        self._data_ready = threading.Condition(self._lock) # Wakes the flusher
+        self._durable = threading.Condition(self._lock) # Wakes wait_durable() callers
+        self._buffer = bytearray()
+        self._appended_lsn = 0
+        self._durable_lsn = 0
+        self._segment = None # Open file of the active segment
+        self._segment_no = 0
+        self._segment_size = 0
+        self._next_game_no = 1
+        self._checkpointing = False
+        self._closed = False
+        self._io_lock = threading.Lock() # Held while a batch is written; a rotation waits for it
+        self._checkpoint_lock = threading.Lock()
+        self.records = 0
+        self.syncs = 0
+        self.bytes_written = 0
+
+    # --- Recovery ---
+    def replay(self):
+        """Yields (kind, game_number, body_tuple) for every record on disk, oldest first."""
+        for number, path in list_segments(self.directory):
+            self._segment_no = max(self._segment_no, number)
+            for kind, game_number, body in read_segment(path):
+                self._next_game_no = max(self._next_game_no, game_number + 1)
+                try:
+                    yield kind, game_number, decode_body(kind, body)
+                except (ValueError, IndexError, struct.error, UnicodeDecodeError) as e:
+                    print(f"Journal: skipping undecodable record (kind {kind}) in {path}: {e}")
+
+    def start(self, games_provider):
+        """Opens a fresh segment, starts the flusher thread and checkpoints the recovered games."""
+        self.games_provider = games_provider
+        with self._lock: self._open_segment()
+        threading.Thread(target=self.run, daemon=True).start()
+        self.checkpoint()
+
+    # --- Appending (called with the game's lock held) ---
+    def _append(self, kind, number, body=b""):
+        payload = _RECORD.pack(kind, number) + body
+        with self._lock:
+            if self._closed: return 0 # Nothing will be written; wait_durable(0) never blocks
+            self._buffer += _FRAME.pack(len(payload), zlib.crc32(payload))
+            self._buffer += payload
+            self._appended_lsn += 1
+            self.records += 1
+            self._data_ready.notify()
+            return self._appended_lsn
+
+    def log_game(self, game, state):
+        if not game.journal_no:
+            with self._lock:
+                game.journal_no = self._next_game_no
+                self._next_game_no += 1
+        body = bytearray()
+        _enc_str(body, game.game_id)
+        _enc_str(body, game.seat_tokens.get('white', ''))
+        _enc_str(body, game.seat_tokens.get('black', ''))
+        body += BINARY_CODEC.encode(dict(state, white_options=None, black_options=None)) # Rebuilt on recovery
+        return self._append(KIND_GAME, game.journal_no, bytes(body))
+
+    def log_move(self, game, color, index, target, promotion=None):
+        body = _MOVE.pack(COLOR_TO_CODE[color], index, SQUARE_TO_BYTE[tuple(target)], game.white_time, game.black_time)
+        if promotion and promotion != 'queen': body += bytes((PIECE_TO_CODE[promotion],)) # Queen needs no byte
+        return self._append(KIND_MOVE, game.journal_no, body)
+
+    def log_chat(self, game, message):
+        body = bytearray((COLOR_TO_CODE[message['sender']],))
+        _enc_str(body, message['text'][:0x3FFF])
+        _enc_str(body, message['timestamp'])
+        return self._append(KIND_CHAT, game.journal_no, bytes(body))
+
+    def log_result(self, game):
+        return self._append(KIND_RESULT, game.journal_no, _RESULT.pack(
+            COLOR_TO_CODE.get(game.winner, 0xFF), game.white_time, game.black_time))
+
+    def log_close(self, game):
+        return self._append(KIND_CLOSE, game.journal_no)
+
+    # --- Durability ---
+    def wait_durable(self, lsn):
+        """Blocks until record lsn (and everything before it) is on disk."""
+        with self._lock:
+            while self._durable_lsn < lsn and not self._closed:
+                self._durable.wait()
+
+    @property
+    def durable_lsn(self):
+        return self._durable_lsn
+
+    def run(self):
+        """Flusher thread body: one write + fsync per batch of whatever accumulated meanwhile."""
+        while True:
+            with self._lock:
+                while not self._buffer and not self._closed: self._data_ready.wait()
+                if self._closed: return
+            with self._io_lock:
+                with self._lock:
+                    data, self._buffer = self._buffer, bytearray()
+                    lsn = self._appended_lsn
+                    segment = self._segment
+                try:
+                    self._write(segment, data)
+                except OSError as e:
+                    print(f"!!! JOURNAL WRITE FAILED: {e}; journaling stopped !!!")
+                    with self._lock:
+                        self._closed = True # Waiters give up rather than hang; games go on unjournaled
+                        self._durable.notify_all()
+                    return
+                with self._lock:
+                    self._durable_lsn = lsn
+                    self._segment_size += len(data)
+                    self._durable.notify_all()
+                    start_checkpoint = self._segment_size >= self.segment_bytes and not self._checkpointing
+                    if start_checkpoint: self._checkpointing = True
+            if start_checkpoint: threading.Thread(target=self.checkpoint, daemon=True).start()
+
+    def _write(self, segment, data):
+        segment.write(data)
+        segment.flush()
+        if self.fsync: os.fsync(segment.fileno())
+        self.syncs += 1
+        self.bytes_written += len(data)
+
+    def close(self):
+        """Writes out what is buffered and stops; later appends are never written."""
+        with self._io_lock:
+            with self._lock:
+                data, self._buffer = self._buffer, bytearray()
+                lsn = self._appended_lsn
+                segment, self._segment = self._segment, None
+                self._closed = True
+                self._data_ready.notify()
+                self._durable.notify_all()
+            if segment:
+                try:
+                    self._write(segment, data)
+                    segment.close()
+                except OSError: pass
+            with self._lock: self._durable_lsn = lsn
+
+    # --- Segments and Checkpoints ---
+    def _open_segment(self):
+        # Called with _lock held
+        self._segment_no += 1
+        self._segment = open(segment_path(self.directory, self._segment_no), 'ab')
+        self._segment_size = 0
+
+    def _rotate(self):
+        """Finishes the active segment and opens the next. Returns the finished segment paths."""
+        with self._io_lock:
+            with self._lock:
+                data, self._buffer = self._buffer, bytearray()
+                lsn = self._appended_lsn
+                old = self._segment
+                self._open_segment()
+            if old:
+                self._write(old, data)
+                old.close()
+            with self._lock:
+                self._durable_lsn = max(self._durable_lsn, lsn)
+                self._durable.notify_all()
+                current = self._segment_no
+        return [path for number, path in list_segments(self.directory) if number < current]
+
+    def checkpoint(self):
+        """Snapshots every live game into a new segment, then drops the segments before it."""
+        with self._checkpoint_lock:
+            try:
+                finished = self._rotate()
+                games = 0
+                for game in (self.games_provider() if self.games_provider else ()):
+                    if game.journal_snapshot(): games += 1
+                self.wait_durable(self._append(KIND_CHECKPOINT, 0))
+                if self._closed: return
+                for path in finished: os.remove(path)
+                print(f"Journal checkpoint: {games} live games in segment {self._segment_no}, {len(finished)} old segments removed.")
+            except OSError as e:
+                print(f"!!! JOURNAL CHECKPOINT FAILED: {e} !!!")
+            finally:
+                with self._lock: self._checkpointing = False
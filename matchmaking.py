@@ -0,0 +1,158 @@
+# ######## matchmaking.py (Rating-Banded FIFO Matchmaking) ########
+# Replaces pairing with waiting_players.popitem(), which took the most recent arrival (a dict
+# pops LIFO) and ignored skill. Waiting players sit in per-rating-band FIFO queues. A player
+# may be matched with anyone whose band is within its search window, and the window widens
+# the longer it waits, so nobody waits forever for a perfect match. Among compatible
+# opponents the one that has waited longest is always taken.
+import bisect
+import time
+from collections import deque
+
+# --- Constants ---
+DEFAULT_RATING = 1200 # Players that did not send a rating (legacy clients, unrated)
+BAND_WIDTH = 100 # Rating points per band
+WIDEN_INTERVAL = 5.0 # Seconds of waiting per extra band of search window
+MAX_BAND_SPREAD = 10 # Window never grows past this many bands either side
+MATCH_SWEEP_INTERVAL = 1.0 # How often servers re-check waiting players whose windows have widened
+WAIT_SAMPLES = 10000 # Recent waits kept for percentiles
+
+
+class Ticket:
+    """One waiting player. key identifies it for cancel(); payload is whatever the server needs."""
+    def __init__(self, key, rating, payload, enqueued_at):
+        self.key = key
+        self.rating = rating
+        self.band = rating // BAND_WIDTH
+        self.payload = payload
+        self.enqueued_at = enqueued_at
+
+    def spread(self, now):
+        """Band distance this ticket accepts at time now."""
+        return min(MAX_BAND_SPREAD, int((now - self.enqueued_at) / WIDEN_INTERVAL))
+
+
+class Matchmaker:
+    """Waiting-room for players. Not thread-safe: the server's pairing lock (or event loop) guards it.
+
+    Bands hold FIFO queues; a sorted list of the non-empty band numbers lets a search jump
+    straight to the occupied bands near a rating (bisect, O(log bands)) and look at no more
+    than 2 * MAX_BAND_SPREAD + 1 of them.
+    """
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._bands = {} # {band: deque of Tickets, oldest first}
+        self._occupied = [] # Sorted band numbers with a non-empty queue
+        self._tickets = {} # {key: Ticket}
+        self._waits = deque(maxlen=WAIT_SAMPLES) # Seconds waited by recently paired tickets
+        self.pairings = 0
+
+    def __len__(self):
+        return len(self._tickets)
+
+    def __contains__(self, key):
+        return key in self._tickets
+
+    # --- Queue Maintenance ---
+    def _push(self, ticket):
+        queue = self._bands.get(ticket.band)
+        if queue is None:
+            queue = self._bands[ticket.band] = deque()
+            bisect.insort(self._occupied, ticket.band)
+        queue.append(ticket)
+        self._tickets[ticket.key] = ticket
+
+    def _remove(self, ticket):
+        queue = self._bands[ticket.band]
+        if queue[0] is ticket: queue.popleft()
+        else: queue.remove(ticket)
+        if not queue:
+            del self._bands[ticket.band]
+            del self._occupied[bisect.bisect_left(self._occupied, ticket.band)]
+        del self._tickets[ticket.key]
+
+    def _oldest_compatible(self, ticket, now):
+        """Longest-waiting queued ticket that ticket may be paired with, or None.
+
+        Two tickets are compatible when their band distance is within the wider of their two
+        windows. Only band heads need checking: the head is the oldest in its band and so
+        has the widest window there.
+        """
+        low = bisect.bisect_left(self._occupied, ticket.band - MAX_BAND_SPREAD)
+        high = bisect.bisect_right(self._occupied, ticket.band + MAX_BAND_SPREAD)
+        own_spread = ticket.spread(now)
+        best = None
+        for band in self._occupied[low:high]:
+            head = self._bands[band][0]
+            if head is ticket:
+                if len(self._bands[band]) < 2: continue
+                head = self._bands[band][1]
+            if abs(band - ticket.band) <= max(own_spread, head.spread(now)):
+                if best is None or head.enqueued_at < best.enqueued_at: best = head
+        return best
+
+    def _record(self, first, second, now):
+        self._waits.append(now - first.enqueued_at)
+        self._waits.append(now - second.enqueued_at)
+        self.pairings += 1
+
+    # --- API ---
+    def join(self, key, rating=None, payload=None, accept=None):
+        """A player arrives. Returns the waiting Ticket it was paired with (the waiting player
+        moves first), or None if it was queued to wait.
+
+        accept(ticket), if given, vets a candidate before it is used (e.g. that its socket is
+        still open); rejected candidates are dropped from the queue and the search goes on.
+        """
+        now = self.clock()
+        ticket = Ticket(key, DEFAULT_RATING if rating is None else rating, payload, now)
+        while True:
+            opponent = self._oldest_compatible(ticket, now)
+            if opponent is None:
+                self._push(ticket)
+                return None
+            self._remove(opponent)
+            if accept is None or accept(opponent): break
+        self._record(opponent, ticket, now)
+        return opponent
+
+    def cancel(self, key):
+        """Removes a waiting player (it disconnected). Returns its Ticket, or None if not waiting."""
+        ticket = self._tickets.get(key)
+        if ticket: self._remove(ticket)
+        return ticket
+
+    def sweep(self, accept=None):
+        """Pairs waiting players whose windows have widened enough since they arrived.
+
+        Returns [(older_ticket, newer_ticket), ...]; the older one moves first. accept works
+        as in join(): a rejected ticket is dropped and its would-be opponent stays queued.
+        """
+        now = self.clock()
+        pairs = []
+        for band in list(self._occupied): # Oldest tickets of each band get first pick
+            queue = self._bands.get(band)
+            if not queue: continue
+            ticket = queue[0]
+            opponent = self._oldest_compatible(ticket, now)
+            if opponent is None: continue
+            if accept is not None:
+                rejected = [t for t in (ticket, opponent) if not accept(t)]
+                for t in rejected: self._remove(t)
+                if rejected: continue
+            self._remove(ticket)
+            self._remove(opponent)
+            first, second = (ticket, opponent) if ticket.enqueued_at <= opponent.enqueued_at else (opponent, ticket)
+            self._record(first, second, now)
+            pairs.append((first, second))
+        return pairs
+
+    def wait_percentiles(self, fractions=(0.5, 0.9, 0.99)):
+        """{fraction: seconds} over the most recent paired waits (empty if nobody was paired yet)."""
+        if not self._waits: return {}
+        ordered = sorted(self._waits)
+        return {f: ordered[min(len(ordered) - 1, int(f * len(ordered)))] for f in fractions}
+
+    def stats(self):
+        percentiles = self.wait_percentiles()
+        return {'waiting': len(self._tickets), 'pairings': self.pairings,
+                'wait_p50': percentiles.get(0.5), 'wait_p90': percentiles.get(0.9), 'wait_p99': percentiles.get(0.99)}
@@ -0,0 +1,260 @@
+# ######## metrics.py (Counters, Histograms and a Prometheus Text Endpoint) ########
+# The servers' hot paths (moves, option generation, broadcasts, socket sends, lock waits)
+# record into Counters and Histograms declared once at module level. Recording takes no lock:
+# every thread writes to its own cell (a plain list reached through a threading.local), and
+# only a scrape adds the cells up. Cells of threads that have exited are folded into one
+# retired cell, so a thread per connection does not grow the metrics without bound. Gauges
+# are read through a callback at scrape time. serve() exports everything in the Prometheus
+# text format (version 0.0.4) over HTTP from a daemon thread.
+import functools
+import math
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+# --- Constants ---
+METRICS_HOST = '127.0.0.1' # Scrapes come from the local machine (or a local agent)
+METRICS_PATH = '/metrics'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5) # Seconds
+LOCK_WAIT_BUCKETS = (0.000001, 0.00001, 0.0001, 0.001, 0.01, 0.1, 1.0) # Seconds; an uncontended acquire counts as 0
+BYTE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144)
+FOLD_MIN_CELLS = 16 # Dead threads' cells are folded once this many (or twice as many as last time) exist
+
+
+def format_value(value):
+    if value == math.inf: return '+Inf'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15: return str(int(value))
+    return repr(value)
+
+def format_labels(labels):
+    if not labels: return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+class Registry:
+    """Every metric of the process, rendered in declaration order. Metrics sharing a name (the
+    same family with different labels) are written under one HELP/TYPE header."""
+    def __init__(self):
+        self._families = {} # {name: (type, help, [metric])}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            kind, help_text, members = self._families.setdefault(metric.name, (metric.kind, metric.help, []))
+            if kind != metric.kind: raise ValueError(f"{metric.name} is already registered as a {kind}")
+            members.append(metric)
+
+    def render(self):
+        with self._lock: families = [(name, kind, help_text, members[:]) for name, (kind, help_text, members) in self._families.items()]
+        lines = []
+        for name, kind, help_text, members in families:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for metric in members: lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+
+# --- Per-Thread Cells ---
+class _ThreadCells:
+    """One list per writing thread, created by new_cell() on the thread's first write.
+
+    Writers only ever touch their own list, so `cell[i] += n` needs no lock. totals() adds the
+    cells up element by element; a concurrent write may or may not be in the result.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.local = threading.local()
+        self._cells = [] # [(thread, cell)]
+        self._retired = [0] * size # Sum of the cells of threads that have exited
+        self._fold_at = FOLD_MIN_CELLS
+        self._lock = threading.Lock() # Taken on a thread's first write and by totals(), never per write
+
+    def new_cell(self):
+        cell = [0] * self.size
+        with self._lock:
+            if len(self._cells) >= self._fold_at:
+                self._fold()
+                self._fold_at = max(FOLD_MIN_CELLS, 2 * len(self._cells))
+            self._cells.append((threading.current_thread(), cell))
+        self.local.cell = cell
+        return cell
+
+    def _fold(self):
+        # Called with _lock held. A thread that is no longer alive can never write its cell again.
+        live = []
+        for thread, cell in self._cells:
+            if thread.is_alive(): live.append((thread, cell))
+            else: self._retired = [a + b for a, b in zip(self._retired, cell)]
+        self._cells = live
+
+    def totals(self):
+        with self._lock:
+            self._fold()
+            totals = self._retired[:]
+            for _, cell in self._cells:
+                for i, value in enumerate(cell[:]): totals[i] += value
+        return totals
+
+
+# --- Metric Types ---
+class Counter:
+    """A value that only goes up. Prometheus convention: the name ends in _total."""
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=None, registry=REGISTRY):
+        self.name, self.help, self.labels = name, help_text, dict(labels or {})
+        self._cells = _ThreadCells(1)
+        registry.register(self)
+
+    def inc(self, amount=1):
+        try: cell = self._cells.local.cell
+        except AttributeError: cell = self._cells.new_cell()
+        cell[0] += amount
+
+    @property
+    def value(self):
+        return self._cells.totals()[0]
+
+    def samples(self):
+        return [f'{self.name}{format_labels(self.labels)} {format_value(self.value)}']
+
+
+class Histogram:
+    """Observations counted into fixed buckets (upper bounds, inclusive), plus their sum."""
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS, labels=None, registry=REGISTRY):
+        self.name, self.help, self.labels = name, help_text, dict(labels or {})
+        self.bounds = tuple(sorted(buckets))
+        self._cells = _ThreadCells(len(self.bounds) + 2) # A count per bucket, the +Inf bucket, then the sum
+        registry.register(self)
+
+    def observe(self, value):
+        try: cell = self._cells.local.cell
+        except AttributeError: cell = self._cells.new_cell()
+        cell[bisect_left(self.bounds, value)] += 1
+        cell[-1] += value
+
+    def timed(self, function):
+        """Decorator: observes how long each call of function takes, in seconds."""
+        observe = self.observe
+        @functools.wraps(function)
+        def timed_call(*args, **kwargs):
+            started = time.perf_counter()
+            try: return function(*args, **kwargs)
+            finally: observe(time.perf_counter() - started)
+        return timed_call
+
+    def snapshot(self):
+        """(cumulative bucket counts ending with +Inf, count, sum)."""
+        totals = self._cells.totals()
+        cumulative, running = [], 0
+        for count in totals[:-1]:
+            running += count
+            cumulative.append(running)
+        return cumulative, running, totals[-1]
+
+    def samples(self):
+        cumulative, count, total = self.snapshot()
+        lines = []
+        for bound, bucket_count in zip(self.bounds + (math.inf,), cumulative):
+            lines.append(f'{self.name}_bucket{format_labels({**self.labels, "le": format_value(float(bound))})} {bucket_count}')
+        lines.append(f'{self.name}_sum{format_labels(self.labels)} {format_value(total)}')
+        lines.append(f'{self.name}_count{format_labels(self.labels)} {count}')
+        return lines
+
+
+class Gauge:
+    """A value read when scraped: from set_function's callback if one is set, else the last set()."""
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, function=None, labels=None, registry=REGISTRY):
+        self.name, self.help, self.labels = name, help_text, dict(labels or {})
+        self._value = 0
+        self._function = function
+        registry.register(self)
+
+    def set(self, value):
+        self._value = value
+
+    def set_function(self, function):
+        self._function = function
+
+    @property
+    def value(self):
+        if self._function is None: return self._value
+        try: return self._function()
+        except Exception as e:
+            print(f"Gauge {self.name} failed: {e}")
+            return math.nan
+
+    def samples(self):
+        return [f'{self.name}{format_labels(self.labels)} {format_value(self.value)}']
+
+
+class TimedLock:
+    """A threading.Lock that records how long every acquire waited in a Histogram.
+
+    A free lock is taken with a non-blocking acquire and counted straight into the 0 bucket
+    of this thread's cell, without reading the clock; only a contended acquire is timed.
+    """
+    def __init__(self, histogram, lock=None):
+        self._lock = lock if lock is not None else threading.Lock()
+        self._histogram = histogram
+        self._local = histogram._cells.local
+
+    def acquire(self, blocking=True, timeout=-1):
+        if self._lock.acquire(False):
+            try: self._local.cell[0] += 1
+            except AttributeError: self._histogram.observe(0)
+            return True
+        if not blocking: return False
+        started = time.perf_counter()
+        acquired = self._lock.acquire(True, timeout)
+        self._histogram.observe(time.perf_counter() - started)
+        return acquired
+
+    def release(self):
+        self._lock.release()
+
+    def locked(self):
+        return self._lock.locked()
+
+    __enter__ = acquire
+
+    def __exit__(self, *exc_info):
+        self._lock.release()
+
+
+# --- HTTP Endpoint ---
+class MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in (METRICS_PATH, '/'):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # One line per scrape would drown the server's own log
+
+
+def serve(port, host=METRICS_HOST, registry=REGISTRY):
+    """Serves registry at http://host:port/metrics from a daemon thread. Returns the HTTPServer
+    (shutdown() stops it). Raises OSError if the port cannot be bound."""
+    handler = type('BoundMetricsHandler', (MetricsHandler,), {'registry': registry})
+    http_server = HTTPServer((host, port), handler)
+    threading.Thread(target=http_server.serve_forever, name='metrics-http', daemon=True).start()
+    print(f"Metrics at http://{host}:{http_server.server_address[1]}{METRICS_PATH}")
+    return http_server
@@ -0,0 +1,607 @@
+# ######## movegen.py (Bitboard Move Generation) ########
+# Squares are numbered sq = y * 8 + x, so board coordinate (x, y) maps to bit (1 << sq).
+# All tables are built once at import time; generation only does integer mask work.
+# The board is standard chess mirrored left to right: White's king starts on (3, 0), its
+# king-side rook on (0, 0), so file a is x == 7 and rank 1 is y == 0.
+from collections import namedtuple
+
+# --- Constants ---
+PIECE_NAMES = ('pawn', 'rook', 'knight', 'bishop', 'queen', 'king')
+OTHER_COLOR = {'white': 'black', 'black': 'white'}
+
+# Direction order matches the original per-piece helpers so option lists come out identical
+ROOK_DIRECTIONS = ((0, 1), (0, -1), (1, 0), (-1, 0))
+BISHOP_DIRECTIONS = ((1, 1), (1, -1), (-1, 1), (-1, -1))
+KNIGHT_OFFSETS = ((1, 2), (1, -2), (2, 1), (2, -1), (-1, 2), (-1, -2), (-2, 1), (-2, -1))
+KING_OFFSETS = ((1, 0), (1, 1), (1, -1), (-1, 0), (-1, 1), (-1, -1), (0, 1), (0, -1))
+
+
+# --- Precomputed Tables ---
+def _on_board(x, y):
+    return 0 <= x <= 7 and 0 <= y <= 7
+
+SQUARE_COORDS = tuple((sq % 8, sq // 8) for sq in range(64))
+SQUARE_BITS = tuple(1 << sq for sq in range(64))
+
+def square_index(coords):
+    return coords[1] * 8 + coords[0]
+
+def _build_step_table(offsets):
+    """Per square: ordered tuple of (bit, coords) targets and the combined attack mask."""
+    targets, masks = [], []
+    for x, y in SQUARE_COORDS:
+        entries = tuple((SQUARE_BITS[square_index((x + dx, y + dy))], (x + dx, y + dy))
+                        for dx, dy in offsets if _on_board(x + dx, y + dy))
+        targets.append(entries)
+        mask = 0
+        for bit, _ in entries: mask |= bit
+        masks.append(mask)
+    return tuple(targets), tuple(masks)
+
+KNIGHT_TARGETS, KNIGHT_ATTACKS = _build_step_table(KNIGHT_OFFSETS)
+KING_TARGETS, KING_ATTACKS = _build_step_table(KING_OFFSETS)
+
+def _build_ray_table(directions):
+    """Per direction and square: empty-board ray mask, ordered ray coords, and scan order."""
+    table = {}
+    for dx, dy in directions:
+        masks, coords_list = [], []
+        for x, y in SQUARE_COORDS:
+            mask = 0; coords = []
+            for i in range(1, 8):
+                tx, ty = x + i * dx, y + i * dy
+                if not _on_board(tx, ty): break
+                mask |= SQUARE_BITS[square_index((tx, ty))]
+                coords.append((tx, ty))
+            masks.append(mask); coords_list.append(tuple(coords))
+        # Rays heading towards higher square numbers hit their nearest blocker at the lowest set bit
+        ascending = (dy * 8 + dx) > 0
+        table[(dx, dy)] = (tuple(masks), tuple(coords_list), ascending)
+    return table
+
+RAYS = _build_ray_table(ROOK_DIRECTIONS + BISHOP_DIRECTIONS)
+ROOK_RAYS = tuple(RAYS[d] for d in ROOK_DIRECTIONS)
+BISHOP_RAYS = tuple(RAYS[d] for d in BISHOP_DIRECTIONS)
+
+# Chebyshev distance between squares, i.e. the step count along a shared ray
+SQUARE_DISTANCE = tuple(tuple(max(abs(ax - bx), abs(ay - by)) for bx, by in SQUARE_COORDS)
+                        for ax, ay in SQUARE_COORDS)
+
+
+# --- Bitboard Helpers ---
+def locations_to_bitboard(locations):
+    board = 0
+    for x, y in locations:
+        board |= 1 << (y * 8 + x)
+    return board
+
+def lsb_index(board):
+    return (board & -board).bit_length() - 1
+
+def msb_index(board):
+    return board.bit_length() - 1
+
+
+# --- Per-Piece Generators (bitboard based) ---
+def _slide(moves_list, sq, rays, own, enemy):
+    occupied = own | enemy
+    for masks, coords_list, ascending in rays:
+        ray_coords = coords_list[sq]
+        blockers = masks[sq] & occupied
+        if not blockers:
+            moves_list.extend(ray_coords)
+            continue
+        blocker = lsb_index(blockers) if ascending else msb_index(blockers)
+        steps = SQUARE_DISTANCE[sq][blocker]
+        if (1 << blocker) & enemy: moves_list.extend(ray_coords[:steps])
+        else: moves_list.extend(ray_coords[:steps - 1])
+    return moves_list
+
+def _step(table, sq, own):
+    return [coords for bit, coords in table[sq] if not bit & own]
+
+def pawn_moves(position, color, white_bb, black_bb):
+    x, y = position
+    occupied = white_bb | black_bb
+    moves_list = []
+    if color == 'white':
+        if y < 7 and not occupied & (1 << (square_index(position) + 8)):
+            moves_list.append((x, y + 1))
+            if y == 1 and not occupied & (1 << (square_index(position) + 16)):
+                moves_list.append((x, y + 2))
+        if x < 7 and y < 7 and black_bb & (1 << (square_index(position) + 9)):
+            moves_list.append((x + 1, y + 1))
+        if x > 0 and y < 7 and black_bb & (1 << (square_index(position) + 7)):
+            moves_list.append((x - 1, y + 1))
+    else: # Black moves towards y == 0
+        if y > 0 and not occupied & (1 << (square_index(position) - 8)):
+            moves_list.append((x, y - 1))
+            if y == 6 and not occupied & (1 << (square_index(position) - 16)):
+                moves_list.append((x, y - 2))
+        if x < 7 and y > 0 and white_bb & (1 << (square_index(position) - 7)):
+            moves_list.append((x + 1, y - 1))
+        if x > 0 and y > 0 and white_bb & (1 << (square_index(position) - 9)):
+            moves_list.append((x - 1, y - 1))
+    return moves_list
+
+def rook_moves(position, color, white_bb, black_bb):
+    own, enemy = (white_bb, black_bb) if color == 'white' else (black_bb, white_bb)
+    return _slide([], square_index(position), ROOK_RAYS, own, enemy)
+
+def bishop_moves(position, color, white_bb, black_bb):
+    own, enemy = (white_bb, black_bb) if color == 'white' else (black_bb, white_bb)
+    return _slide([], square_index(position), BISHOP_RAYS, own, enemy)
+
+def queen_moves(position, color, white_bb, black_bb):
+    own, enemy = (white_bb, black_bb) if color == 'white' else (black_bb, white_bb)
+    sq = square_index(position)
+    return _slide(_slide([], sq, BISHOP_RAYS, own, enemy), sq, ROOK_RAYS, own, enemy)
+
+def knight_moves(position, color, white_bb, black_bb):
+    return _step(KNIGHT_TARGETS, square_index(position), white_bb if color == 'white' else black_bb)
+
+def king_moves(position, color, white_bb, black_bb):
+    return _step(KING_TARGETS, square_index(position), white_bb if color == 'white' else black_bb)
+
+PIECE_GENERATORS = {
+    'pawn': pawn_moves, 'rook': rook_moves, 'knight': knight_moves,
+    'bishop': bishop_moves, 'queen': queen_moves, 'king': king_moves,
+}
+
+def generate_options(pieces, locations, color, white_bb, black_bb):
+    """Option lists for every piece of one side, given precomputed occupancy bitboards."""
+    all_moves_list = []
+    generators = PIECE_GENERATORS
+    for i in range(min(len(pieces), len(locations))):
+        generator = generators.get(pieces[i])
+        if generator is None: continue
+        all_moves_list.append(generator(locations[i], color, white_bb, black_bb))
+    return all_moves_list
+
+
+# --- Drop-in Replacements for the List-Based Helpers ---
+def check_options(pieces, locations, turn_color, white_locations_global, black_locations_global):
+    white_bb = locations_to_bitboard(white_locations_global)
+    black_bb = locations_to_bitboard(black_locations_global)
+    return generate_options(pieces, locations, turn_color, white_bb, black_bb)
+
+def check_pawn(position, color, w_locs, b_locs):
+    return pawn_moves(position, color, locations_to_bitboard(w_locs), locations_to_bitboard(b_locs))
+
+def check_rook(position, color, w_locs, b_locs):
+    return rook_moves(position, color, locations_to_bitboard(w_locs), locations_to_bitboard(b_locs))
+
+def check_knight(position, color, w_locs, b_locs):
+    return knight_moves(position, color, locations_to_bitboard(w_locs), locations_to_bitboard(b_locs))
+
+def check_bishop(position, color, w_locs, b_locs):
+    return bishop_moves(position, color, locations_to_bitboard(w_locs), locations_to_bitboard(b_locs))
+
+def check_queen(position, color, w_locs, b_locs):
+    return queen_moves(position, color, locations_to_bitboard(w_locs), locations_to_bitboard(b_locs))
+
+def check_king(position, color, w_locs, b_locs):
+    return king_moves(position, color, locations_to_bitboard(w_locs), locations_to_bitboard(b_locs))
+
+
+# --- Incremental Recomputation ---
+# A piece's option list can only change when the occupancy of a square it "reaches" changes.
+# Reach = squares it attacks or is blocked by (sliders), its fixed attack pattern (knight/king),
+# or the push/capture squares in front of it (pawns).
+def _build_pawn_reach():
+    reach = {'white': [], 'black': []}
+    for x, y in SQUARE_COORDS:
+        for color, dy, start_row in (('white', 1, 1), ('black', -1, 6)):
+            mask = 0
+            for tx, ty in ((x, y + dy), (x + 1, y + dy), (x - 1, y + dy)):
+                if _on_board(tx, ty): mask |= SQUARE_BITS[square_index((tx, ty))]
+            if y == start_row: mask |= SQUARE_BITS[square_index((x, y + 2 * dy))]
+            reach[color].append(mask)
+    return {color: tuple(masks) for color, masks in reach.items()}
+
+PAWN_REACH = _build_pawn_reach()
+
+def _build_line_masks(rays):
+    masks = []
+    for sq in range(64):
+        mask = 0
+        for ray_masks, _, _ in rays: mask |= ray_masks[sq]
+        masks.append(mask)
+    return tuple(masks)
+
+ROOK_LINES = _build_line_masks(ROOK_RAYS)
+BISHOP_LINES = _build_line_masks(BISHOP_RAYS)
+QUEEN_LINES = tuple(r | b for r, b in zip(ROOK_LINES, BISHOP_LINES))
+
+def _build_between():
+    between = []
+    for sq in range(64):
+        row = [0] * 64
+        for _, coords_list, _ in ROOK_RAYS + BISHOP_RAYS:
+            passed = 0
+            for coords in coords_list[sq]:
+                row[square_index(coords)] = passed
+                passed |= SQUARE_BITS[square_index(coords)]
+        between.append(tuple(row))
+    return tuple(between)
+
+BETWEEN = _build_between() # BETWEEN[a][b]: squares strictly between a and b on a shared line (else 0)
+# Squares whose occupancy can change each piece's options: its lines for sliders
+REACH_TABLES = {color: {'pawn': PAWN_REACH[color], 'knight': KNIGHT_ATTACKS, 'king': KING_ATTACKS,
+                        'rook': ROOK_LINES, 'bishop': BISHOP_LINES, 'queen': QUEEN_LINES}
+                for color in ('white', 'black')}
+
+def slider_reach(sq, rays, occupied):
+    """Squares along each ray up to and including the first blocker."""
+    reach = 0
+    for masks, _, ascending in rays:
+        ray = masks[sq]
+        blockers = ray & occupied
+        if blockers:
+            blocker = lsb_index(blockers) if ascending else msb_index(blockers)
+            ray ^= masks[blocker] # Drop everything beyond the blocker
+        reach |= ray
+    return reach
+
+def update_options(options, pieces, locations, color, white_bb, black_bb, changed_mask, force_index=None):
+    """Refresh, in place, only the option lists whose reach touches a square in changed_mask.
+
+    Expects options to be index-aligned with pieces/locations. Returns the indices whose
+    list actually changed, or None if the lists were misaligned (caller should fall back
+    to check_options).
+    """
+    if len(options) != len(pieces) or len(pieces) != len(locations): return None
+    occupied = white_bb | black_bb
+    generators = PIECE_GENERATORS
+    reach_tables = REACH_TABLES[color]
+    changed_indices = []
+    i = -1
+    try:
+        # Runs for every piece of both sides after every move, so it is kept to plain lookups
+        for piece, location in zip(pieces, locations):
+            i += 1
+            if i != force_index:
+                sq = location[1] * 8 + location[0]
+                hits = reach_tables[piece][sq] & changed_mask
+                if not hits: continue
+                # A slider only reaches a changed square on its lines if nothing stands in between
+                # (BETWEEN is empty for the adjacent and off-line squares the other pieces reach)
+                between = BETWEEN[sq]
+                while hits:
+                    bit = hits & -hits
+                    if not between[bit.bit_length() - 1] & occupied: break
+                    hits ^= bit
+                if not hits: continue
+            new_options = generators[piece](location, color, white_bb, black_bb)
+            if new_options != options[i]:
+                options[i] = new_options
+                changed_indices.append(i)
+    except KeyError: return None # A piece name with no generator
+    return changed_indices
+
+
+# --- Legal Moves ---
+# The lists above are pseudo-legal: they ignore the mover's own king. Legal lists are derived
+# from them once per position, without trying each move and testing for check:
+# - check: the squares that capture or block a single checker (none in double check);
+# - pins: a piece that is all that stands between its king and an enemy slider may only
+#   move along that line;
+# - king moves, castling and en passant are tested against the enemy's attacks directly.
+# Only the king, pinned pieces, pawns that can take en passant, and every piece while in
+# check need a filtered list. Every other pseudo-legal list is already legal and is reused.
+FULL_BOARD = (1 << 64) - 1
+NOT_FILE_0 = FULL_BOARD ^ sum(SQUARE_BITS[y * 8] for y in range(8)) # Every square but x == 0
+NOT_FILE_7 = FULL_BOARD ^ sum(SQUARE_BITS[y * 8 + 7] for y in range(8))
+PROMOTION_PIECES = ('queen', 'rook', 'bishop', 'knight')
+COORD_BITS = {coords: SQUARE_BITS[sq] for sq, coords in enumerate(SQUARE_COORDS)}
+
+def _build_pawn_attacks():
+    attacks = {}
+    for color, dy in (('white', 1), ('black', -1)):
+        masks = []
+        for x, y in SQUARE_COORDS:
+            mask = 0
+            for tx in (x - 1, x + 1):
+                if _on_board(tx, y + dy): mask |= SQUARE_BITS[square_index((tx, y + dy))]
+            masks.append(mask)
+        attacks[color] = tuple(masks)
+    return attacks
+
+PAWN_ATTACKS = _build_pawn_attacks() # Squares a pawn of that colour on sq attacks
+
+# right: (colour, king from, king to, rook from, rook to, squares that must be empty, squares
+# the king crosses or lands on, which must not be attacked). Letters as in FEN: K/k king side.
+CASTLING_MOVES = {
+    'K': ('white', (3, 0), (1, 0), (0, 0), (2, 0), ((2, 0), (1, 0)), ((2, 0), (1, 0))),
+    'Q': ('white', (3, 0), (5, 0), (7, 0), (4, 0), ((4, 0), (5, 0), (6, 0)), ((4, 0), (5, 0))),
+    'k': ('black', (3, 7), (1, 7), (0, 7), (2, 7), ((2, 7), (1, 7)), ((2, 7), (1, 7))),
+    'q': ('black', (3, 7), (5, 7), (7, 7), (4, 7), ((4, 7), (5, 7), (6, 7)), ((4, 7), (5, 7))),
+}
+# A move from or to one of these squares (a king or rook leaving, a rook being taken) loses these rights
+CASTLING_SQUARES = {(3, 0): 'KQ', (0, 0): 'K', (7, 0): 'Q', (3, 7): 'kq', (0, 7): 'k', (7, 7): 'q'}
+
+def piece_boards(pieces, locations):
+    """{piece name: bitboard of that side's pieces of that type}."""
+    boards = dict.fromkeys(PIECE_NAMES, 0)
+    bits = SQUARE_BITS
+    for piece, (x, y) in zip(pieces, locations): boards[piece] |= bits[y * 8 + x]
+    return boards
+
+def _nearest(masks, ascending, sq, occupied):
+    # Square of the first occupied square along one ray from sq, or -1
+    blockers = masks[sq] & occupied
+    if not blockers: return -1
+    return lsb_index(blockers) if ascending else msb_index(blockers)
+
+def _attacked(sq, occupied, knights, kings, pawn_sources, pawns, straight, diagonal):
+    # pawn_sources: PAWN_ATTACKS table of the defending colour (where attacking pawns would stand);
+    # straight/diagonal: the attacker's rooks and queens / bishops and queens
+    if KNIGHT_ATTACKS[sq] & knights or KING_ATTACKS[sq] & kings or pawn_sources[sq] & pawns: return True
+    return _slider_attacked(sq, occupied, straight, diagonal)
+
+def _slider_attacked(sq, occupied, straight, diagonal):
+    if ROOK_LINES[sq] & straight:
+        for masks, _, ascending in ROOK_RAYS:
+            if masks[sq] & straight and SQUARE_BITS[_nearest(masks, ascending, sq, occupied)] & straight: return True
+    if BISHOP_LINES[sq] & diagonal:
+        for masks, _, ascending in BISHOP_RAYS:
+            if masks[sq] & diagonal and SQUARE_BITS[_nearest(masks, ascending, sq, occupied)] & diagonal: return True
+    return False
+
+def leaper_attacks(by_color, knights, kings, pawns):
+    """Every square attacked by by_color's knights, king and pawns (bitboards), blockers aside."""
+    attacks = 0
+    while knights:
+        bit = knights & -knights
+        knights ^= bit
+        attacks |= KNIGHT_ATTACKS[bit.bit_length() - 1]
+    if kings: attacks |= KING_ATTACKS[kings.bit_length() - 1]
+    if by_color == 'white':
+        attacks |= ((pawns & NOT_FILE_0) << 7 | (pawns & NOT_FILE_7) << 9) & FULL_BOARD
+    else:
+        attacks |= (pawns & NOT_FILE_7) >> 7 | (pawns & NOT_FILE_0) >> 9
+    return attacks
+
+def square_attacked(sq, by_color, boards, occupied):
+    """True if a piece of by_color (boards: its piece_boards) attacks square sq."""
+    return _attacked(sq, occupied, boards['knight'], boards['king'], PAWN_ATTACKS[OTHER_COLOR[by_color]], boards['pawn'],
+                     boards['rook'] | boards['queen'], boards['bishop'] | boards['queen'])
+
+def check_and_pins(king_sq, color, own_bb, enemy_boards, occupied):
+    """(checkers, check_mask, pins) for color's king on king_sq.
+
+    check_mask holds the squares a non-king move must land on: the whole board when not in
+    check, the checker and the squares between it and the king for a single check, nothing
+    in double check. pins maps the square of each pinned piece to the line it may still move
+    along (up to and including the pinning piece).
+    """
+    checkers = (KNIGHT_ATTACKS[king_sq] & enemy_boards['knight']) | (PAWN_ATTACKS[color][king_sq] & enemy_boards['pawn'])
+    check_mask = checkers
+    pins = {}
+    for rays, lines, sliders in ((ROOK_RAYS, ROOK_LINES, enemy_boards['rook'] | enemy_boards['queen']),
+                                 (BISHOP_RAYS, BISHOP_LINES, enemy_boards['bishop'] | enemy_boards['queen'])):
+        if not lines[king_sq] & sliders: continue
+        for masks, _, ascending in rays:
+            ray = masks[king_sq]
+            if not ray & sliders: continue
+            first = _nearest(masks, ascending, king_sq, occupied)
+            bit = SQUARE_BITS[first]
+            if bit & sliders:
+                checkers |= bit
+                check_mask |= ray ^ masks[first]
+            elif bit & own_bb:
+                second = _nearest(masks, ascending, first, occupied)
+                if second >= 0 and SQUARE_BITS[second] & sliders: pins[first] = ray ^ masks[second]
+    if not checkers: check_mask = FULL_BOARD
+    elif checkers & (checkers - 1): check_mask = 0 # Double check: only the king may move
+    return checkers, check_mask, pins
+
+def king_attacked(pieces, locations, color, enemy_pieces, enemy_locations):
+    """True if color's king is in check (False if it has no king)."""
+    try: x, y = locations[pieces.index('king')]
+    except ValueError: return False
+    occupied = locations_to_bitboard(locations) | locations_to_bitboard(enemy_locations)
+    return square_attacked(y * 8 + x, OTHER_COLOR[color], piece_boards(enemy_pieces, enemy_locations), occupied)
+
+def legal_options(options, pieces, locations, color, white_bb, black_bb, enemy_pieces, enemy_locations,
+                  castling='', en_passant=None):
+    """Legal option lists for color, the side to move, from its pseudo-legal options.
+
+    Lists that need no filtering are the very objects in options. castling holds the rights
+    left (FEN letters); en_passant is the square a pawn just skipped, or None.
+    """
+    legal = options[:]
+    for i, moves in legal_overrides(options, pieces, locations, color, white_bb, black_bb,
+                                    enemy_pieces, enemy_locations, castling, en_passant).items():
+        legal[i] = moves
+    return legal
+
+def legal_overrides(options, pieces, locations, color, white_bb, black_bb, enemy_pieces, enemy_locations,
+                    castling='', en_passant=None, enemy_boards=None):
+    """{index: legal list} for the pieces of color whose pseudo-legal list is not already legal.
+
+    Always has the king's list (when there is a king); other pieces only appear when check,
+    a pin or en passant changes what they may do. enemy_boards: piece_boards() of the enemy,
+    if the caller keeps them.
+    """
+    own_bb, enemy_bb = (white_bb, black_bb) if color == 'white' else (black_bb, white_bb)
+    try: king_index = pieces.index('king')
+    except ValueError: return {} # No king to protect (custom positions)
+    enemy_color = OTHER_COLOR[color]
+    if enemy_boards is None: enemy_boards = piece_boards(enemy_pieces, enemy_locations)
+    occupied = own_bb | enemy_bb
+    kx, ky = locations[king_index]
+    king_sq = ky * 8 + kx
+    checkers, check_mask, pins = check_and_pins(king_sq, color, own_bb, enemy_boards, occupied)
+
+    overrides = {}
+    if check_mask != FULL_BOARD or pins:
+        for i, moves in enumerate(options):
+            if i == king_index: continue
+            x, y = locations[i]
+            mask = check_mask & pins.get(y * 8 + x, FULL_BOARD)
+            if mask != FULL_BOARD: overrides[i] = [target for target in moves if COORD_BITS[target] & mask]
+
+    # The king may not stay on a line it is in check along, so test without it on the board
+    knights, kings, pawns = enemy_boards['knight'], enemy_boards['king'], enemy_boards['pawn']
+    straight = enemy_boards['rook'] | enemy_boards['queen']
+    diagonal = enemy_boards['bishop'] | enemy_boards['queen']
+    danger = leaper_attacks(enemy_color, knights, kings, pawns)
+    without_king = occupied ^ SQUARE_BITS[king_sq]
+    king_moves = []
+    for target in options[king_index]:
+        sq = target[1] * 8 + target[0]
+        if SQUARE_BITS[sq] & danger: continue
+        # Most targets are on no line of an enemy slider, which rules them out without walking rays
+        if (ROOK_LINES[sq] & straight or BISHOP_LINES[sq] & diagonal) and _slider_attacked(sq, without_king, straight, diagonal): continue
+        king_moves.append(target)
+    if castling and not checkers:
+        for right in castling:
+            side_color, king_from, king_to, rook_from, _, empty, safe = CASTLING_MOVES[right]
+            if side_color != color or locations[king_index] != king_from: continue
+            if any(COORD_BITS[square] & occupied for square in empty): continue
+            if rook_from not in locations or pieces[locations.index(rook_from)] != 'rook': continue
+            if any(COORD_BITS[square] & danger or _slider_attacked(square_index(square), occupied, straight, diagonal)
+                   for square in safe): continue
+            king_moves.append(king_to)
+    overrides[king_index] = king_moves
+
+    if en_passant is not None:
+        ep_sq = square_index(en_passant)
+        captured_bit = SQUARE_BITS[ep_sq - 8 if color == 'white' else ep_sq + 8]
+        takers = PAWN_ATTACKS[enemy_color][ep_sq] # Where our pawns must stand to take on ep_sq
+        if captured_bit & enemy_boards['pawn'] and not SQUARE_BITS[ep_sq] & occupied:
+            for i, piece in enumerate(pieces):
+                if piece != 'pawn' or not COORD_BITS[locations[i]] & takers: continue
+                # Two pawns leave the capturing rank at once, so test the resulting position as a whole
+                after = (occupied ^ COORD_BITS[locations[i]] ^ captured_bit) | SQUARE_BITS[ep_sq]
+                boards_after = dict(enemy_boards, pawn=enemy_boards['pawn'] ^ captured_bit)
+                if not square_attacked(king_sq, enemy_color, boards_after, after):
+                    overrides[i] = overrides.get(i, options[i]) + [tuple(en_passant)]
+    return overrides
+
+def castling_from_board(white_pieces, white_locations, black_pieces, black_locations):
+    """Rights a position can still have: every king and rook still on its starting square."""
+    rights = ''
+    for right, (color, king_from, _, rook_from, _, _, _) in CASTLING_MOVES.items():
+        pieces, locations = (white_pieces, white_locations) if color == 'white' else (black_pieces, black_locations)
+        home = dict(zip(map(tuple, locations), pieces))
+        if home.get(king_from) == 'king' and home.get(rook_from) == 'rook': rights += right
+    return rights
+
+
+# --- Move Effects ---
+MoveEffects = namedtuple('MoveEffects', 'captured_index captured_at rook_index rook_to promoted castling en_passant')
+
+def plan_move(pieces, locations, enemy_locations, color, index, target, castling='', en_passant=None, promotion=None):
+    """Everything moving piece index of color to target does besides moving it.
+
+    target must be one of its legal options. Returns MoveEffects: the enemy index taken and
+    where it stood (en passant takes beside the target), the rook a castling king brings
+    along, the piece a pawn promotes to (promotion, default queen), and the castling rights
+    and en passant square of the resulting position.
+    """
+    piece = pieces[index]
+    source = tuple(locations[index])
+    target = tuple(target)
+    captured_at = target
+    if piece == 'pawn' and en_passant is not None and target == tuple(en_passant) and target[0] != source[0]:
+        captured_at = (target[0], source[1])
+    captured_index = enemy_locations.index(captured_at) if captured_at in enemy_locations else None
+
+    rook_index = rook_to = None
+    if piece == 'king' and abs(target[0] - source[0]) == 2:
+        for side_color, king_from, king_to, rook_from, castle_rook_to, _, _ in CASTLING_MOVES.values():
+            if side_color == color and king_from == source and king_to == target and rook_from in locations:
+                rook_index, rook_to = locations.index(rook_from), castle_rook_to
+
+    promoted = None
+    if piece == 'pawn' and target[1] == (7 if color == 'white' else 0):
+        promoted = promotion if promotion in PROMOTION_PIECES else 'queen'
+
+    new_en_passant = None
+    if piece == 'pawn' and abs(target[1] - source[1]) == 2:
+        new_en_passant = (source[0], (source[1] + target[1]) // 2)
+
+    if castling:
+        lost = CASTLING_SQUARES.get(source, '') + CASTLING_SQUARES.get(target, '')
+        if lost: castling = ''.join(right for right in castling if right not in lost)
+    return MoveEffects(captured_index, captured_at, rook_index, rook_to, promoted, castling, new_en_passant)
+
+
+# --- Perft ---
+# Counts the leaves of the legal move tree; the totals for well-known positions are published,
+# so any generator bug shows up as a wrong number. Uses the same generate_options,
+# legal_options and plan_move as Game. A position is a dict of the Game fields that matter:
+# {colour}_pieces, {colour}_locations, 'turn' ('white'/'black'), 'castling', 'en_passant'.
+FEN_PIECES = {'p': 'pawn', 'r': 'rook', 'n': 'knight', 'b': 'bishop', 'q': 'queen', 'k': 'king'}
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+def position_from_fen(fen):
+    """Position dict for a FEN string (files mirrored onto this board's x axis)."""
+    fields = fen.split()
+    position = {'white_pieces': [], 'white_locations': [], 'black_pieces': [], 'black_locations': []}
+    for row, rank in enumerate(fields[0].split('/')):
+        y = 7 - row
+        file = 0
+        for char in rank:
+            if char.isdigit():
+                file += int(char)
+                continue
+            color = 'white' if char.isupper() else 'black'
+            position[f'{color}_pieces'].append(FEN_PIECES[char.lower()])
+            position[f'{color}_locations'].append((7 - file, y))
+            file += 1
+    position['turn'] = 'white' if len(fields) < 2 or fields[1] == 'w' else 'black'
+    position['castling'] = '' if len(fields) < 3 or fields[2] == '-' else fields[2]
+    ep = fields[3] if len(fields) > 3 else '-'
+    position['en_passant'] = None if ep == '-' else (7 - (ord(ep[0]) - ord('a')), int(ep[1]) - 1)
+    return position
+
+def position_legal_options(position):
+    """Legal option lists of the side to move in position."""
+    color = position['turn']
+    enemy = OTHER_COLOR[color]
+    white_bb = locations_to_bitboard(position['white_locations'])
+    black_bb = locations_to_bitboard(position['black_locations'])
+    pieces, locations = position[f'{color}_pieces'], position[f'{color}_locations']
+    pseudo = generate_options(pieces, locations, color, white_bb, black_bb)
+    return legal_options(pseudo, pieces, locations, color, white_bb, black_bb,
+                         position[f'{enemy}_pieces'], position[f'{enemy}_locations'],
+                         position['castling'], position['en_passant'])
+
+def play_move(position, index, target, promotion=None):
+    """The position after the side to move plays piece index to target (copies; position is unchanged)."""
+    color = position['turn']
+    enemy = OTHER_COLOR[color]
+    pieces, locations = position[f'{color}_pieces'][:], position[f'{color}_locations'][:]
+    enemy_pieces, enemy_locations = position[f'{enemy}_pieces'][:], position[f'{enemy}_locations'][:]
+    effects = plan_move(pieces, locations, enemy_locations, color, index, target,
+                        position['castling'], position['en_passant'], promotion)
+    if effects.captured_index is not None:
+        enemy_pieces.pop(effects.captured_index)
+        enemy_locations.pop(effects.captured_index)
+    locations[index] = tuple(target)
+    if effects.rook_index is not None: locations[effects.rook_index] = effects.rook_to
+    if effects.promoted: pieces[index] = effects.promoted
+    return {f'{color}_pieces': pieces, f'{color}_locations': locations,
+            f'{enemy}_pieces': enemy_pieces, f'{enemy}_locations': enemy_locations,
+            'turn': enemy, 'castling': effects.castling, 'en_passant': effects.en_passant}
+
+def perft(position, depth):
+    """Number of legal move sequences of length depth from position (promotions count once per piece)."""
+    if depth <= 0: return 1
+    options = position_legal_options(position)
+    pieces = position[f"{position['turn']}_pieces"]
+    promote_row = 7 if position['turn'] == 'white' else 0
+    nodes = 0
+    for index, targets in enumerate(options):
+        promotes = pieces[index] == 'pawn'
+        for target in targets:
+            promotions = PROMOTION_PIECES if promotes and target[1] == promote_row else (None,)
+            if depth == 1:
+                nodes += len(promotions)
+                continue
+            for promotion in promotions:
+                nodes += perft(play_move(position, index, target, promotion), depth - 1)
+    return nodes
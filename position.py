@@ -0,0 +1,81 @@
+# ######## position.py (Indexed View of a Received Position, for the Client) ########
+# A state dict holds the position as parallel lists: pieces, locations and option lists per
+# side. Asking it "what is on this square?" or "is a king attacked?" means scanning those
+# lists, and the client used to do that every frame and on every click. A PositionView is
+# built once when a state arrives and answers those questions with dict and set lookups.
+# No pygame in here, so benchmarks can build and query views too.
+from itertools import chain
+
+COLORS = ('white', 'black')
+BOARD_SQUARES = frozenset((x, y) for x in range(8) for y in range(8))
+
+
+def _square(value):
+    """value as an (x, y) tuple if it is a square on the board, else None."""
+    if isinstance(value, (tuple, list)) and len(value) == 2 and \
+       all(isinstance(c, int) and 0 <= c <= 7 for c in value):
+        return tuple(value)
+    return None
+
+def _squares(values):
+    """frozenset of the board squares in the list values, skipping anything else."""
+    try:
+        squares = frozenset(values)
+        if squares <= BOARD_SQUARES: return squares # The usual case: tuples, as the codecs decode them
+    except TypeError: pass # Lists or other unhashable entries
+    return frozenset(square for square in map(_square, values) if square is not None)
+
+
+class PositionView:
+    """Lookups over one state dict; read-only once built.
+
+    pieces:   {square: (color, piece name, index in the color's lists)}
+    attacked: {color: squares that color's options reach}
+    kings:    {color: square of its king, or None}
+    check:    (king square, highlight color) of a king the other side attacks, or None;
+              white's king is looked at first, as the client always has.
+    """
+    def __init__(self, state):
+        self.pieces = {}
+        self.attacked = {}
+        self.kings = {}
+        self._options = {}
+        self._targets = {} # (color, index) -> frozenset, filled in by targets()
+        for color in COLORS:
+            pieces = state.get(f'{color}_pieces', [])
+            locations = state.get(f'{color}_locations', [])
+            self.kings[color] = None
+            if len(pieces) == len(locations):
+                for index, (piece, location) in enumerate(zip(pieces, locations)):
+                    square = location if type(location) is tuple and location in BOARD_SQUARES else _square(location)
+                    if square is None: continue
+                    self.pieces[square] = (color, piece, index)
+                    if piece == 'king' and self.kings[color] is None: self.kings[color] = square
+            options = state.get(f'{color}_options', [])
+            self._options[color] = options
+            try:
+                attacked = frozenset(chain.from_iterable(options))
+                if not attacked <= BOARD_SQUARES: raise TypeError
+            except TypeError: # Lists for squares, or something that is not a square or an option list
+                attacked = frozenset(square for targets in options if isinstance(targets, list)
+                                     for square in map(_square, targets) if square is not None)
+            self.attacked[color] = attacked
+
+        self.check = None
+        if self.kings['white'] in self.attacked['black']: self.check = (self.kings['white'], 'dark red')
+        elif self.kings['black'] in self.attacked['white']: self.check = (self.kings['black'], 'dark blue')
+
+    def piece_at(self, square, color=None):
+        """Index of the piece on square (of color, if given), or None."""
+        entry = self.pieces.get(square)
+        if entry is None or (color is not None and entry[0] != color): return None
+        return entry[2]
+
+    def targets(self, color, index):
+        """Squares the piece at index of color may move to (empty if unknown)."""
+        targets = self._targets.get((color, index))
+        if targets is None:
+            options = self._options.get(color, [])
+            moves = options[index] if 0 <= index < len(options) else None
+            targets = self._targets[(color, index)] = _squares(moves) if isinstance(moves, list) else frozenset()
+        return targets
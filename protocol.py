@@ -0,0 +1,115 @@
+# ######## protocol.py (Shared Message Helpers for Server and Client) ########
+# Kept free of pygame and socket state so the client, the servers and the benchmark
+# bots can all apply server messages the same way.
+import math
+import time
+
+
+# --- Delta State Updates ---
+def is_full_state(message):
+    return isinstance(message, dict) and 'turn_step' in message and 'white_pieces' in message
+
+def is_delta(message):
+    return isinstance(message, dict) and message.get('type') == 'delta'
+
+def apply_delta(state, delta):
+    """Applies a server delta to a local state dict.
+
+    Returns a new state dict (lists that change are copied, so a reader holding the old
+    dict never sees a half-applied update), or None if the delta does not follow on from
+    the state's seq and a full snapshot is needed.
+    """
+    if state.get('seq') is None or delta.get('base_seq') != state.get('seq'): return None
+
+    new_state = dict(state)
+    copied = set()
+    def writable(key):
+        if key not in copied:
+            new_state[key] = list(new_state.get(key, []))
+            copied.add(key)
+        return new_state[key]
+
+    for move in delta.get('moves', ()):
+        color = move['color']
+        opponent = 'black' if color == 'white' else 'white'
+        index = move['index']
+        writable(f'{color}_locations')[index] = tuple(move['to'])
+        if move.get('promoted'): writable(f'{color}_pieces')[index] = move['promoted']
+        captured_index = move.get('captured_index')
+        if captured_index is not None:
+            captured_piece = writable(f'{opponent}_pieces').pop(captured_index)
+            writable(f'{opponent}_locations').pop(captured_index)
+            opponent_options = writable(f'{opponent}_options')
+            if captured_index < len(opponent_options): opponent_options.pop(captured_index)
+            writable(f'captured_{color}').append(captured_piece)
+
+    for color, changed in delta.get('options', {}).items():
+        options_list = writable(f'{color}_options')
+        for index, moves in changed.items():
+            if index < len(options_list): options_list[index] = moves
+
+    # game_over/winner/game_started are only sent when they differ from a running game
+    new_state['game_over'] = delta.get('game_over', False)
+    new_state['winner'] = delta.get('winner', '')
+    new_state['game_started'] = delta.get('game_started', True)
+    for key in ('turn_step', 'white_time', 'black_time', 'clock_ts'):
+        if key in delta: new_state[key] = delta[key]
+    new_state['seq'] = delta['seq']
+    return new_state
+
+
+# --- Clock Extrapolation ---
+# The server only sends clocks when something changes, as an anchor: remaining times plus
+# the server's time.monotonic() (clock_ts) they were measured at. Clients estimate the offset
+# between their monotonic clock and the server's once at connect, then count down locally.
+class ClockSync:
+    """Server-minus-local monotonic clock offset from time_sync round trips.
+
+    Keeps the sample with the smallest round trip, since its midpoint is the tightest bound
+    on when the server read its clock.
+    """
+    def __init__(self):
+        self.offset = None
+        self.best_rtt = None
+        self.samples = 0
+
+    def on_reply(self, data, now):
+        """Feeds one server reply ({'client': sent_at, 'server': server_now}) received at now."""
+        if not isinstance(data, dict) or 'server' not in data or 'client' not in data: return False
+        self.samples += 1
+        rtt = now - data['client']
+        if rtt < 0 or (self.best_rtt is not None and rtt >= self.best_rtt): return False
+        self.best_rtt = rtt
+        self.offset = data['server'] - (data['client'] + rtt / 2)
+        return True
+
+def time_sync_reply(message):
+    """Server answer to a client's {'type': 'time_sync', 'data': {'client': t}} probe, or None."""
+    if not isinstance(message, dict) or message.get('type') != 'time_sync': return None
+    data = message.get('data')
+    if not isinstance(data, dict) or not isinstance(data.get('client'), (int, float)): return None
+    return {'type': 'time_sync', 'data': {'client': data['client'], 'server': time.monotonic()}}
+
+def seconds_to_clock_tick(state, now, offset):
+    """Seconds until the running clock, shown in whole seconds, next changes; None if no clock
+    is counting down (see displayed_clocks). Lets a client sleep until then."""
+    if state.get('clock_ts') is None or offset is None: return None
+    if not state.get('game_started') or state.get('game_over'): return None
+    running = displayed_clocks(state, now, offset)[0 if state.get('turn_step', 0) < 2 else 1]
+    if running <= 0: return None
+    return running - math.ceil(running) + 1.0
+
+def displayed_clocks(state, now, offset):
+    """(white_time, black_time) to show at local monotonic time now.
+
+    Without an anchor or an offset estimate (old server, sync not answered yet) the last
+    received values are shown unchanged.
+    """
+    white_time, black_time = state.get('white_time', 0), state.get('black_time', 0)
+    clock_ts = state.get('clock_ts')
+    if clock_ts is None or offset is None: return white_time, black_time
+    if not state.get('game_started') or state.get('game_over'): return white_time, black_time
+    elapsed = max(0.0, now + offset - clock_ts)
+    if state.get('turn_step', 0) < 2: white_time = max(0.0, white_time - elapsed)
+    else: black_time = max(0.0, black_time - elapsed)
+    return white_time, black_time
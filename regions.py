@@ -0,0 +1,66 @@
+# ######## regions.py (Dirty Regions for the Client's Retained-Mode Renderer) ########
+# The client does not repaint its whole window every frame. The window is split into named
+# regions (each board square, the status text, the clocks, the chat messages, the chat input
+# box...), and every frame the client describes what each region should show with a small
+# hashable key: the piece and highlights on a square, the two clock strings, and so on. A
+# region is repainted, and its rect handed to pygame.display.update, only when its key
+# differs from the one it was last painted with. Static artwork (board squares, grid, panel
+# borders, chat gradient) is pre-rendered once into a background surface that repaints
+# start from.
+# No pygame in here: rects are (x, y, width, height) tuples, which pygame accepts anywhere.
+
+_UNSET = object()
+
+
+def rects_overlap(a, b):
+    return a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and a[1] < b[1] + b[3] and b[1] < a[1] + a[3]
+
+
+class DirtyRegions:
+    """What each region of the window last showed, and the rects repainted since take()."""
+    def __init__(self, window_rect):
+        self.window_rect = window_rect
+        self._keys = {} # {region name: key it was last painted with}
+        self._window_keys = {} # The same for changed_everywhere(); they outlive invalidate()
+        self._rects = [] # Repainted this frame
+        self.full = True # The whole window is being repainted (first frame, or after invalidate())
+
+    def changed(self, name, key, rect):
+        """True if region name must be repainted to show key; rect is then queued for update."""
+        if not self.full and self._keys.get(name, _UNSET) == key: return False
+        self._keys[name] = key
+        if not self.full: self._rects.append(rect)
+        return True
+
+    def changed_everywhere(self, name, key):
+        """Like changed(), for things drawn across many regions (the screen being shown, a
+        banner over the board): a change invalidates the whole window."""
+        if self._window_keys.get(name, _UNSET) == key: return False
+        self.invalidate()
+        self._window_keys[name] = key
+        return True
+
+    def mark(self, rect):
+        """Queues rect for update without tracking what it shows (something drawn on top)."""
+        if not self.full: self._rects.append(rect)
+
+    def remember(self, name, key):
+        """Records that region name now shows key (its painter settled on something else)."""
+        self._keys[name] = key
+
+    def invalidate(self):
+        """Forgets everything; the next frame repaints the whole window."""
+        self._keys.clear()
+        self._rects = []
+        self.full = True
+
+    def touched(self, rect):
+        """True if anything repainted this frame overlaps rect."""
+        return self.full or any(rects_overlap(rect, other) for other in self._rects)
+
+    def take(self):
+        """The rects to hand to pygame.display.update for this frame; starts the next one."""
+        rects = [self.window_rect] if self.full else self._rects
+        self._rects = []
+        self.full = False
+        return rects
@@ -0,0 +1,54 @@
+# ######## registry.py (Lock-Striped Game Registry) ########
+# The threaded server used to guard every game lookup with one games_lock, so a move in one
+# game waited for lookups, broadcasts and socket closes in every other game. Games are now
+# spread over a fixed number of stripes by id, each with its own lock, and the lock is only
+# ever held for the dict operation itself (never for sending or closing sockets).
+import threading
+
+# --- Constants ---
+REGISTRY_STRIPES = 64
+
+
+class GameRegistry:
+    """{game_id: Game} split into independently locked stripes."""
+    def __init__(self, stripes=REGISTRY_STRIPES):
+        self._stripes = [({}, threading.Lock()) for _ in range(stripes)]
+        self.removal_listener = None # Called as (game_id) after a game is popped, no lock held
+
+    def _stripe(self, game_id):
+        return self._stripes[hash(game_id) % len(self._stripes)]
+
+    def add(self, game):
+        games, lock = self._stripe(game.game_id)
+        with lock:
+            games[game.game_id] = game
+
+    def get(self, game_id):
+        games, lock = self._stripe(game_id)
+        with lock:
+            return games.get(game_id)
+
+    def pop(self, game_id, game=None):
+        """Removes and returns game_id's game. With game given, only if that exact game is registered."""
+        games, lock = self._stripe(game_id)
+        with lock:
+            if game is not None and games.get(game_id) is not game: return None
+            removed = games.pop(game_id, None)
+        if removed is not None and self.removal_listener: self.removal_listener(game_id)
+        return removed
+
+    def __contains__(self, game_id):
+        return self.get(game_id) is not None
+
+    def __len__(self):
+        total = 0
+        for games, lock in self._stripes:
+            with lock: total += len(games)
+        return total
+
+    def values(self):
+        """Snapshot list of every registered game, taking one stripe lock at a time."""
+        result = []
+        for games, lock in self._stripes:
+            with lock: result.extend(games.values())
+        return result
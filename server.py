@@ -5,148 +5,77 @@ import pickle
 import time
 from datetime import datetime
 import uuid # Using UUID for more robust game IDs
+import secrets
+import hmac
 import struct # For message framing
 
 # --- Constants ---
 INITIAL_TIME_SECONDS = 1200.0 # 20 minutes
-BROADCAST_INTERVAL = 1.0 # Seconds between state broadcasts for timer updates
+CLOCK_EPSILON = 1e-6 # Remaining time at or below this counts as a fallen flag (float rounding)
 SERVER_IP = '0.0.0.0'
 PORT = 5555
 MAX_PLAYERS_OVERALL = 10 # Max connections server will handle
+LISTEN_BACKLOG = 512 # Pending connects the kernel queues; many clients may connect at once
 MAX_PLAYERS_PER_GAME = 2
 HEADER_SIZE = struct.calcsize('>I') # Size of the length prefix (4 bytes)
+NEGOTIATION_TIMEOUT = 1.0 # Seconds to wait for a wire handshake before assuming a legacy pickle client
+INCREMENTAL_OPTIONS = True # Only recompute option lists a move can affect
+DEBUG_VERIFY_OPTIONS = False # Cross-check incremental options against a full rebuild (slow)
+OPTIONS_CACHE_ENABLED = True # Reuse option lists another game already generated for the same position
+REPETITION_DRAW_COUNT = 3 # The same position this many times (same side to move) draws the game
+RESUME_GRACE_SECONDS = 60.0 # After a restart, the side to move's clock stays stopped this long for players to reconnect
+MAX_CHAT_TEXT_LENGTH = 500 # Characters; the client stops at 100, longer lines are refused
+MAX_CHAT_TIMESTAMP_LENGTH = 32 # A longer (or non-string) timestamp is replaced by the server's own
+LEGACY_TICK_INTERVAL = 1.0 # Seconds between full states to clients that skipped the handshake; they draw clocks as received
+LEGACY_FRAME = 'legacy' # Game._frame_cache key of the full-state frame unframed (pre-handshake) clients get
 
 # --- Game Logic Helper Functions ---
-def check_options(pieces, locations, turn_color, white_locations_global, black_locations_global):
-    moves_list = []
-    all_moves_list = []
-    current_white_locations = white_locations_global
-    current_black_locations = black_locations_global
-
-    for i in range(len(pieces)):
-        if not (0 <= i < len(locations)): continue # Safety check
-        location = locations[i]
-        piece = pieces[i]
-        if piece not in ['pawn', 'rook', 'knight', 'bishop', 'queen', 'king']: continue
-
-        w_locs_context = current_white_locations
-        b_locs_context = current_black_locations
-
-        if piece == 'pawn':
-            moves_list = check_pawn(location, turn_color, w_locs_context, b_locs_context)
-        elif piece == 'rook':
-            moves_list = check_rook(location, turn_color, w_locs_context, b_locs_context)
-        elif piece == 'knight':
-            moves_list = check_knight(location, turn_color, w_locs_context, b_locs_context)
-        elif piece == 'bishop':
-            moves_list = check_bishop(location, turn_color, w_locs_context, b_locs_context)
-        elif piece == 'queen':
-            moves_list = check_queen(location, turn_color, w_locs_context, b_locs_context)
-        elif piece == 'king':
-            moves_list = check_king(location, turn_color, w_locs_context, b_locs_context)
-        all_moves_list.append(moves_list)
-    return all_moves_list
-
-def check_pawn(position, color, w_locs, b_locs):
-    moves_list = []
-    if color == 'white':
-        if (position[0], position[1] + 1) not in w_locs and \
-           (position[0], position[1] + 1) not in b_locs and position[1] < 7:
-            moves_list.append((position[0], position[1] + 1))
-        if position[1] == 1 and \
-           (position[0], position[1] + 1) not in w_locs and \
-           (position[0], position[1] + 1) not in b_locs and \
-           (position[0], position[1] + 2) not in w_locs and \
-           (position[0], position[1] + 2) not in b_locs and position[1] < 6:
-            moves_list.append((position[0], position[1] + 2))
-        if position[0] < 7 and position[1] < 7 and (position[0] + 1, position[1] + 1) in b_locs:
-            moves_list.append((position[0] + 1, position[1] + 1))
-        if position[0] > 0 and position[1] < 7 and (position[0] - 1, position[1] + 1) in b_locs:
-            moves_list.append((position[0] - 1, position[1] + 1))
-    else: # Black's turn
-        if (position[0], position[1] - 1) not in w_locs and \
-           (position[0], position[1] - 1) not in b_locs and position[1] > 0:
-            moves_list.append((position[0], position[1] - 1))
-        if position[1] == 6 and \
-           (position[0], position[1] - 1) not in w_locs and \
-           (position[0], position[1] - 1) not in b_locs and \
-           (position[0], position[1] - 2) not in w_locs and \
-           (position[0], position[1] - 2) not in b_locs and position[1] > 1:
-            moves_list.append((position[0], position[1] - 2))
-        if position[0] < 7 and position[1] > 0 and (position[0] + 1, position[1] - 1) in w_locs:
-            moves_list.append((position[0] + 1, position[1] - 1))
-        if position[0] > 0 and position[1] > 0 and (position[0] - 1, position[1] - 1) in w_locs:
-            moves_list.append((position[0] - 1, position[1] - 1))
-    return moves_list
-
-def check_rook(position, color, w_locs, b_locs):
-    moves_list = []
-    friends_list = w_locs if color == 'white' else b_locs
-    enemies_list = b_locs if color == 'white' else w_locs
-    directions = [(0, 1), (0, -1), (1, 0), (-1, 0)]
-    for dx, dy in directions:
-        for i in range(1, 8):
-            target_x, target_y = position[0] + i * dx, position[1] + i * dy
-            target_coords = (target_x, target_y)
-            if 0 <= target_x <= 7 and 0 <= target_y <= 7:
-                if target_coords not in friends_list:
-                    moves_list.append(target_coords)
-                    if target_coords in enemies_list: break
-                else: break
-            else: break
-    return moves_list
-
-def check_knight(position, color, w_locs, b_locs):
-    moves_list = []
-    friends_list = w_locs if color == 'white' else b_locs
-    targets = [(1, 2), (1, -2), (2, 1), (2, -1), (-1, 2), (-1, -2), (-2, 1), (-2, -1)]
-    for dx, dy in targets:
-        target_x, target_y = position[0] + dx, position[1] + dy
-        target_coords = (target_x, target_y)
-        if 0 <= target_x <= 7 and 0 <= target_y <= 7:
-            if target_coords not in friends_list:
-                moves_list.append(target_coords)
-    return moves_list
-
-def check_bishop(position, color, w_locs, b_locs):
-    moves_list = []
-    friends_list = w_locs if color == 'white' else b_locs
-    enemies_list = b_locs if color == 'white' else w_locs
-    directions = [(1, 1), (1, -1), (-1, 1), (-1, -1)]
-    for dx, dy in directions:
-        for i in range(1, 8):
-            target_x, target_y = position[0] + i * dx, position[1] + i * dy
-            target_coords = (target_x, target_y)
-            if 0 <= target_x <= 7 and 0 <= target_y <= 7:
-                if target_coords not in friends_list:
-                    moves_list.append(target_coords)
-                    if target_coords in enemies_list: break
-                else: break
-            else: break
-    return moves_list
-
-def check_queen(position, color, w_locs, b_locs):
-    moves_list = check_bishop(position, color, w_locs, b_locs)
-    moves_list.extend(check_rook(position, color, w_locs, b_locs))
-    return moves_list
-
-def check_king(position, color, w_locs, b_locs):
-    moves_list = []
-    friends_list = w_locs if color == 'white' else b_locs
-    targets = [(1, 0), (1, 1), (1, -1), (-1, 0), (-1, 1), (-1, -1), (0, 1), (0, -1)]
-    for dx, dy in targets:
-        target_x, target_y = position[0] + dx, position[1] + dy
-        target_coords = (target_x, target_y)
-        if 0 <= target_x <= 7 and 0 <= target_y <= 7:
-            if target_coords not in friends_list:
-                moves_list.append(target_coords)
-    # Add check validation and castling later
-    return moves_list
+# Move generation lives in movegen.py (bitboard engine); re-exported here for existing callers
+from movegen import check_options, check_pawn, check_rook, check_knight, check_bishop, check_queen, check_king
+from movegen import locations_to_bitboard, update_options, square_index, piece_boards, SQUARE_BITS
+from movegen import legal_overrides, plan_move, king_attacked, castling_from_board, PROMOTION_PIECES
+import wire
+from wire import PICKLE_CODEC, WireError, FrameBatch
+from clocks import ClockScheduler
+from protocol import time_sync_reply
+from spectators import SpectatorHub
+from registry import GameRegistry
+from matchmaking import Matchmaker, DEFAULT_RATING, MATCH_SWEEP_INTERVAL
+from chat import ChatLog, chat_append_message, chat_sync_message
+from journal import Journal, JournalError, KIND_GAME, KIND_MOVE, KIND_CHAT, KIND_RESULT, KIND_CLOSE
+from zobrist import position_hash, piece_key, castling_key, en_passant_key, options_cache, BLACK_TO_MOVE_KEY
+import metrics
+from metrics import Counter, Histogram, Gauge, TimedLock, BYTE_BUCKETS, LOCK_WAIT_BUCKETS
+
+# --- Metrics ---
+# Exported with --metrics-port (see metrics.py). server_async.py and supervisor.py workers
+# share these; each sets the gauge callbacks for its own bookkeeping.
+APPLY_MOVE_SECONDS = Histogram('chess_apply_move_seconds', "Game.apply_move calls (legal or not), including the game lock wait")
+MOVES_APPLIED = Counter('chess_moves_applied_total', "Moves played")
+OPTIONS_UPDATE_SECONDS = Histogram('chess_options_update_seconds', "Option list updates after a move (incremental or cached)")
+CHECK_OPTIONS_SECONDS = Histogram('chess_check_options_seconds', "Full check_options rebuilds of one side's option lists")
+BROADCAST_SECONDS = Histogram('chess_broadcast_seconds', "broadcast_game_state calls, from taking the deltas to the last send")
+SEND_SECONDS = Histogram('chess_send_seconds', "Socket writes of one framed message")
+SENT_FRAME_BYTES = Histogram('chess_sent_frame_bytes', "Size of each framed message sent to a client", BYTE_BUCKETS)
+SEND_FAILURES = Counter('chess_send_failures_total', "Framed messages that could not be written")
+GAME_LOCK_WAIT, BROADCAST_LOCK_WAIT, PAIRING_LOCK_WAIT = (
+    Histogram('chess_lock_wait_seconds', "Time spent waiting to acquire a lock", LOCK_WAIT_BUCKETS, {'lock': lock})
+    for lock in ('game_state', 'broadcast', 'pairing'))
+GAMES_STARTED = Counter('chess_games_started_total', "Games paired and started")
+GAMES_RETIRED = Counter('chess_games_retired_total', "Games removed after ending or being abandoned")
+CONNECTIONS_ACCEPTED = Counter('chess_connections_accepted_total', "Client connections taken on (players and spectators)")
+PLAYER_DISCONNECTS = Counter('chess_player_disconnects_total', "Player connections closed")
+GAMES_ACTIVE = Gauge('chess_games_active', "Games in progress")
+PLAYERS_WAITING = Gauge('chess_players_waiting', "Players queued for an opponent")
+PLAYER_CONNECTIONS = Gauge('chess_player_connections', "Open player connections")
+SPECTATORS = Gauge('chess_spectators', "Open spectator connections")
+
+check_options = CHECK_OPTIONS_SECONDS.timed(check_options)
 
 
 # --- Game Class ---
 class Game:
-    def __init__(self, game_id):
+    def __init__(self, game_id, initialize_board=True):
         self.game_id = game_id
         self.players = {} # {conn: 'white'/'black', conn2: 'black'/'white'}
         self.player_conns = {'white': None, 'black': None}
@@ -156,19 +85,43 @@ class Game:
         self.black_locations = []
         self.captured_pieces_white = []
         self.captured_pieces_black = []
-        self.chat_history = []
+        self.chat = ChatLog() # Numbered ring buffer; new lines go out as chat_append events, not in snapshots
         self.turn_step = 0 # 0,1: White; 2,3: Black
         self.winner = ''
         self.game_over = False
         self.game_started = False
         self.white_time = INITIAL_TIME_SECONDS
         self.black_time = INITIAL_TIME_SECONDS
-        self.last_timer_update = None
-        self.white_options = []
+        self.last_timer_update = None # time.monotonic() when the running clock was last charged
+        self.deadline_listener = None # Called as (game_id, flag_deadline or None) whenever the deadline moves
+        self.white_options = [] # Strictly legal for the side to move; pseudo-legal (its reach) for the other
         self.black_options = []
-        self.game_state_lock = threading.Lock()
-        self._initialize_board()
-        print(f"Game {self.game_id}: Initialized.")
+        self._pseudo_options = {'white': [], 'black': []} # Kept up to date incrementally; legal lists derive from them
+        self._legal_overrides = {'white': set(), 'black': set()} # Indices whose sent list is not the pseudo-legal one
+        self._piece_boards = {'white': {}, 'black': {}} # Each side's piece_boards(), kept in step with every move
+        self.castling = 'KQkq' # Castling rights left, as in FEN
+        self.en_passant = None # Square a pawn skipped over on the last move, if any
+        self.position_hash = 0 # Zobrist hash of the position, updated by every move
+        self.replayed_moves = 0 # Journal moves replayed since the last restored snapshot (recovery only)
+        self._repetitions = {} # {position_hash: times seen} since the last capture, pawn move or lost castling right
+        self.game_state_lock = TimedLock(GAME_LOCK_WAIT)
+        self.broadcast_lock = TimedLock(BROADCAST_LOCK_WAIT) # Keeps deltas in sequence order on the wire
+        # Delta protocol state (see take_deltas)
+        self.state_seq = 0
+        self._pending_moves = []
+        self._dirty_options = {'white': set(), 'black': set()}
+        self._pending_change = False
+        self._outbox = [] # Sealed deltas and chat_append events, in the order they go out
+        self._frame_cache = {} # {codec_id or LEGACY_FRAME: (state_seq, framed get_state() bytes)}
+        # Crash recovery (journal.py); all None/empty unless the server runs with --journal
+        self.journal = None
+        self.journal_no = 0 # The journal's compact number for this game
+        self.journal_lsn = 0 # Sequence number of this game's latest journal record
+        self.journal_closed = False
+        self.seat_tokens = {} # {color: token} a player presents to reclaim its seat after a restart
+        if initialize_board: # Recovery restores a journaled board instead, and logs each game once it is back
+            self._initialize_board()
+            print(f"Game {self.game_id}: Initialized.")
 
     def _initialize_board(self):
         # Called within lock during __init__
@@ -182,19 +135,22 @@ class Game:
                            (0, 6), (1, 6), (2, 6), (3, 6), (4, 6), (5, 6), (6, 6), (7, 6)]
         self.captured_pieces_white = []
         self.captured_pieces_black = []
-        self.chat_history = []
+        self.chat = ChatLog()
         self.turn_step = 0
+        self.castling = 'KQkq'
+        self.en_passant = None
         self.winner = ''
         self.game_over = False
         self.game_started = False
         self.white_time = INITIAL_TIME_SECONDS
         self.black_time = INITIAL_TIME_SECONDS
         self.last_timer_update = None
-        self.white_options = check_options(self.white_pieces, self.white_locations, 'white', self.white_locations, self.black_locations)
-        self.black_options = check_options(self.black_pieces, self.black_locations, 'black', self.white_locations, self.black_locations)
+        self._reset_position_hash()
+        self._rebuild_options()
+        self._dirty_options = {'white': set(), 'black': set()} # Initial options go out in the first snapshot
 
     def add_player(self, conn, color):
-        # Called within pairing_lock or game's lock context usually
+        # Called within the game's lock while pairing
         if color not in self.player_conns or self.player_conns[color] is None:
             self.players[conn] = color
             self.player_conns[color] = conn
@@ -208,7 +164,7 @@ class Game:
             return False
 
     def remove_player(self, conn):
-        # Called within games_lock context usually
+        # Called by the leaving player's own thread, with no server-wide lock held
         needs_broadcast = False
         disconnected_color = None
         with self.game_state_lock: # Need internal lock to modify player dicts/state
@@ -219,11 +175,15 @@ class Game:
                 if self.game_started and not self.game_over:
                     self.game_over = True
                     self.winner = 'black' if disconnected_color == 'white' else 'white'
+                    self._mark_changed()
+                    self._notify_deadline()
+                    if self.journal: self.journal_lsn = self.journal.log_result(self)
                     print(f"Game {self.game_id}: Over! {self.winner.capitalize()} wins by opponent disconnection.")
                     needs_broadcast = True
                 elif not self.game_started:
                     print(f"Game {self.game_id}: Player left before start.")
                     self.game_over = True # Mark as over to facilitate cleanup
+                    self._mark_changed()
             else:
                 # print(f"Game {self.game_id}: Conn not found in players list during removal.") # Reduce noise
                 pass
@@ -238,7 +198,10 @@ class Game:
         with self.game_state_lock:
             if self.is_ready() and not self.game_started:
                 self.game_started = True
-                self.last_timer_update = time.time()
+                self.last_timer_update = time.monotonic()
+                self._mark_changed()
+                self._notify_deadline()
+                self._journal_game()
                 print(f"Game {self.game_id}: Started.")
                 return True
             elif self.game_started:
@@ -248,42 +211,61 @@ class Game:
                 print(f"Game {self.game_id}: Cannot start, not ready.")
                 return False
 
+    # --- Clocks ---
+    # Only the side to move has a running clock. Its time is charged when it moves (or when
+    # the scheduler wakes at its deadline), so nothing needs to tick while a player thinks.
+    def flag_deadline(self):
+        # Called within lock. time.monotonic() at which the side to move runs out, or None.
+        if not self.game_started or self.game_over or self.last_timer_update is None: return None
+        return self.last_timer_update + (self.white_time if self.turn_step < 2 else self.black_time)
+
+    def _notify_deadline(self):
+        # Called within lock whenever the running side, its remaining time, or game_over changes
+        if self.deadline_listener: self.deadline_listener(self.game_id, self.flag_deadline())
+
+    def _clock_anchor(self):
+        # Called within lock. (white_time, black_time, clock_ts): remaining times as of server
+        # time.monotonic() == clock_ts. Clients count the side to move down from there themselves.
+        now = time.monotonic()
+        white_time, black_time = self.white_time, self.black_time
+        if self.game_started and not self.game_over and self.last_timer_update is not None:
+            elapsed = max(0.0, now - self.last_timer_update)
+            if self.turn_step < 2: white_time = max(0.0, white_time - elapsed)
+            else: black_time = max(0.0, black_time - elapsed)
+        return white_time, black_time, now
+
+    def _charge_clock(self, now):
+        # Called within lock. Bills the side to move for time since the last charge; True if it flagged.
+        if not self.game_started or self.game_over or self.last_timer_update is None: return False
+        elapsed = max(0.0, now - self.last_timer_update)
+        self.last_timer_update = max(now, self.last_timer_update) # Later during a restart's grace period
+        if self.turn_step < 2: # White's turn
+            self.white_time -= elapsed
+            if self.white_time > CLOCK_EPSILON: return False
+            self.white_time = 0
+            self.winner = 'black'
+        else: # Black's turn
+            self.black_time -= elapsed
+            if self.black_time > CLOCK_EPSILON: return False
+            self.black_time = 0
+            self.winner = 'white'
+        self.game_over = True
+        self._mark_changed()
+        if self.journal: self.journal_lsn = self.journal.log_result(self)
+        print(f"Game {self.game_id}: Over! {self.winner.capitalize()} wins on time!")
+        return True
+
     def update_timers(self):
-        game_ended_by_time = False
+        """Charges the running clock now. Returns True if that ended the game on time."""
         with self.game_state_lock:
-            if not self.game_started or self.game_over or self.last_timer_update is None:
-                return False
-
-            now = time.time()
-            elapsed = now - self.last_timer_update
-            timer_changed = False
-
-            if elapsed > 0:
-                if self.turn_step < 2: # White's turn
-                    self.white_time -= elapsed
-                    timer_changed = True
-                    if self.white_time <= 0:
-                        self.white_time = 0
-                        if not self.game_over:
-                            self.winner = 'black'
-                            self.game_over = True
-                            game_ended_by_time = True
-                            print(f"Game {self.game_id}: Over! Black wins on time!")
-                else: # Black's turn
-                    self.black_time -= elapsed
-                    timer_changed = True
-                    if self.black_time <= 0:
-                        self.black_time = 0
-                        if not self.game_over:
-                            self.winner = 'white'
-                            self.game_over = True
-                            game_ended_by_time = True
-                            print(f"Game {self.game_id}: Over! White wins on time!")
-
-            self.last_timer_update = now # Update timestamp regardless
+            game_ended_by_time = self._charge_clock(time.monotonic())
+            self._notify_deadline() # Re-arms at the same deadline, or cancels if the game ended
         return game_ended_by_time
 
-    def apply_move(self, player_color, selection_index, target_coords):
+    @APPLY_MOVE_SECONDS.timed
+    def apply_move(self, player_color, selection_index, target_coords, promotion=None):
+        """Plays a move if it is legal. promotion picks what a pawn reaching the last rank
+        becomes (queen, rook, bishop or knight; queen if omitted)."""
         with self.game_state_lock:
             if self.game_over: return False
 
@@ -316,286 +298,851 @@ class Game:
 
             if not valid_move_found: return False
 
-            # Execute Move
-            print(f"Game {self.game_id}: Applying valid move for {active_player_color} from {locations_list[selection_index]} to {target_coords}")
-            self.last_timer_update = time.time()
-
-            # Capture Logic
-            opponent_color = 'black' if active_player_color == 'white' else 'white'
-            opponent_locations = self.black_locations if opponent_color == 'black' else self.white_locations
-            opponent_pieces = self.black_pieces if opponent_color == 'black' else self.white_pieces
-            captured_list = self.captured_pieces_white if active_player_color == 'white' else self.captured_pieces_black
-
-            if target_coords in opponent_locations:
-                try:
-                    opponent_piece_index = opponent_locations.index(target_coords)
-                    # Ensure indices align before popping
-                    if 0 <= opponent_piece_index < len(opponent_pieces):
-                         captured_piece = opponent_pieces.pop(opponent_piece_index)
-                         captured_list.append(captured_piece)
-                         opponent_locations.pop(opponent_piece_index) # Pop location *after* piece
-                         print(f"Game {self.game_id}: {active_player_color.capitalize()} captured {captured_piece}")
-                         if captured_piece == 'king':
-                             self.winner = active_player_color
-                             self.game_over = True
-                             print(f"Game {self.game_id}: Over! {self.winner.capitalize()} wins by capturing king!")
-                    else:
-                         print(f"Game {self.game_id}: Error - Opponent index mismatch during capture. Idx: {opponent_piece_index}, Len: {len(opponent_pieces)}")
-                except ValueError:
-                     print(f"Game {self.game_id}: Error - Target coords {target_coords} not found in opponent locations during capture.")
-
-
-            # Move Piece (ensure index is valid)
-            if 0 <= selection_index < len(locations_list):
-                 locations_list[selection_index] = target_coords
-            else:
-                 print(f"Game {self.game_id}: Error - selection_index {selection_index} out of bounds for locations_list (len {len(locations_list)}) during move.")
-                 return False # Abort move if index is bad
-
-            # Promotion
-            if 0 <= selection_index < len(pieces_list): # Check index again before accessing piece
-                 piece_moved = pieces_list[selection_index]
-                 promote_row = 7 if active_player_color == 'white' else 0
-                 if piece_moved == 'pawn' and target_coords[1] == promote_row:
-                     pieces_list[selection_index] = 'queen'
-                     print(f"Game {self.game_id}: {active_player_color.capitalize()} pawn promoted!")
-            else:
-                  print(f"Game {self.game_id}: Error - selection_index {selection_index} out of bounds for pieces_list (len {len(pieces_list)}) during promotion check.")
+            # Bill the mover first; a move that arrives after the flag fell does not count
+            if self._charge_clock(time.monotonic()):
+                self._notify_deadline()
+                return True # State changed (game over on time), so it still needs a broadcast
+
+            if promotion not in PROMOTION_PIECES: promotion = None
+            if not self._execute_move(active_player_color, selection_index, target_coords, promotion): return False
+            MOVES_APPLIED.inc()
+            if self.journal:
+                self.journal_lsn = self.journal.log_move(self, active_player_color, selection_index, target_coords, promotion)
+                # Replay only sees positions since the last checkpoint, so a repetition draw is recorded outright
+                if self.game_over and self._repetitions.get(self.position_hash, 0) >= REPETITION_DRAW_COUNT:
+                    self.journal_lsn = self.journal.log_result(self)
+            return True
 
+    def _execute_move(self, active_player_color, selection_index, target_coords, promotion=None, replay=False):
+        # Called within lock with a legal move (apply_move), or by journal replay with replay=True:
+        # then options are left for finish_replay() and nothing is logged per move
+        pieces_list = self.white_pieces if active_player_color == 'white' else self.black_pieces
+        locations_list = self.white_locations if active_player_color == 'white' else self.black_locations
+        if not 0 <= selection_index < min(len(pieces_list), len(locations_list)):
+             print(f"Game {self.game_id}: Error - selection_index {selection_index} out of bounds (len {len(locations_list)}) during move.")
+             return False # Abort move if index is bad
+        if not replay: print(f"Game {self.game_id}: Applying valid move for {active_player_color} from {locations_list[selection_index]} to {target_coords}")
+
+        opponent_color = 'black' if active_player_color == 'white' else 'white'
+        opponent_locations = self.black_locations if opponent_color == 'black' else self.white_locations
+        opponent_pieces = self.black_pieces if opponent_color == 'black' else self.white_pieces
+        captured_list = self.captured_pieces_white if active_player_color == 'white' else self.captured_pieces_black
+        effects = plan_move(pieces_list, locations_list, opponent_locations, active_player_color, selection_index,
+                            target_coords, self.castling, self.en_passant, promotion)
+        moved_piece = pieces_list[selection_index]
+        # Hash: out go the old castling rights, en passant square and side to move
+        position_key = self.position_hash ^ BLACK_TO_MOVE_KEY ^ castling_key(self.castling) ^ \
+            en_passant_key(self.en_passant, self._piece_boards[active_player_color]['pawn'])
+
+        # Capture Logic (en passant takes the pawn beside the target square)
+        captured_index = effects.captured_index
+        if captured_index is not None:
+             captured_piece = opponent_pieces.pop(captured_index)
+             captured_list.append(captured_piece)
+             opponent_locations.pop(captured_index)
+             self._piece_boards[opponent_color][captured_piece] ^= SQUARE_BITS[square_index(effects.captured_at)]
+             position_key ^= piece_key(opponent_color, captured_piece, effects.captured_at)
+             for opponent_options in (self.black_options if opponent_color == 'black' else self.white_options,
+                                      self._pseudo_options[opponent_color]):
+                 if 0 <= captured_index < len(opponent_options):
+                     opponent_options.pop(captured_index) # Keep options aligned with pieces
+             # Later indices shift down by one, same as on the client
+             self._dirty_options[opponent_color] = {i - 1 if i > captured_index else i
+                                                    for i in self._dirty_options[opponent_color] if i != captured_index}
+             self._legal_overrides[opponent_color] = {i - 1 if i > captured_index else i
+                                                      for i in self._legal_overrides[opponent_color] if i != captured_index}
+             if not replay: print(f"Game {self.game_id}: {active_player_color.capitalize()} captured {captured_piece}")
+
+        # Move Piece (and the rook, when castling)
+        from_coords = locations_list[selection_index]
+        locations_list[selection_index] = target_coords
+        boards = self._piece_boards[active_player_color]
+        boards[pieces_list[selection_index]] ^= SQUARE_BITS[square_index(from_coords)]
+        boards[effects.promoted or pieces_list[selection_index]] |= SQUARE_BITS[square_index(target_coords)]
+        position_key ^= piece_key(active_player_color, moved_piece, from_coords) ^ \
+            piece_key(active_player_color, effects.promoted or moved_piece, target_coords)
+        self._pending_moves.append({'color': active_player_color, 'index': selection_index, 'to': target_coords,
+                                    'promoted': effects.promoted, 'captured_index': captured_index})
+        changed_squares = [from_coords, target_coords, effects.captured_at]
+        if effects.rook_index is not None:
+             changed_squares += [locations_list[effects.rook_index], effects.rook_to]
+             boards['rook'] ^= SQUARE_BITS[square_index(locations_list[effects.rook_index])] | SQUARE_BITS[square_index(effects.rook_to)]
+             position_key ^= piece_key(active_player_color, 'rook', locations_list[effects.rook_index]) ^ \
+                 piece_key(active_player_color, 'rook', effects.rook_to)
+             locations_list[effects.rook_index] = effects.rook_to
+             self._pending_moves.append({'color': active_player_color, 'index': effects.rook_index, 'to': effects.rook_to,
+                                         'promoted': None, 'captured_index': None})
+             if not replay: print(f"Game {self.game_id}: {active_player_color.capitalize()} castled.")
+
+        # Promotion
+        if effects.promoted:
+             pieces_list[selection_index] = effects.promoted
+             if not replay: print(f"Game {self.game_id}: {active_player_color.capitalize()} pawn promoted to {effects.promoted}!")
+
+        # Only a capture, a pawn move or a lost castling right makes earlier positions unreachable
+        if captured_index is not None or moved_piece == 'pawn' or effects.castling != self.castling:
+             self._repetitions = {}
+        self.castling, self.en_passant = effects.castling, effects.en_passant
+        self.position_hash = position_key ^ castling_key(self.castling) ^ \
+            en_passant_key(self.en_passant, self._piece_boards[opponent_color]['pawn'])
+        self._repetitions[self.position_hash] = self._repetitions.get(self.position_hash, 0) + 1
+
+        # Switch Turn
+        self.turn_step = (self.turn_step + 2) % 4
+
+        # Recalculate options, then see whether the side to move has any left
+        if not replay:
+            self._recalculate_options(active_player_color, selection_index, changed_squares)
+            self._check_game_end()
+
+        self._mark_changed()
+        self._notify_deadline() # Re-arm for the opponent's clock (or cancel at checkmate/stalemate)
+        return True
 
-            # Switch Turn
-            self.turn_step = (self.turn_step + 2) % 4
+    def _check_game_end(self):
+        # Called within lock once options are current. No legal move: checkmate if in check, else
+        # stalemate. Otherwise a position seen REPETITION_DRAW_COUNT times draws.
+        mover = 'white' if self.turn_step < 2 else 'black'
+        if self.game_over: return False
+        if any(self.white_options if mover == 'white' else self.black_options):
+            if self._repetitions.get(self.position_hash, 0) < REPETITION_DRAW_COUNT: return False
+            self.game_over = True
+            self.winner = ''
+            print(f"Game {self.game_id}: Over! Draw by threefold repetition.")
+            return True
+        opponent = 'black' if mover == 'white' else 'white'
+        pieces, locations = (self.white_pieces, self.white_locations) if mover == 'white' else (self.black_pieces, self.black_locations)
+        enemy_pieces, enemy_locations = (self.black_pieces, self.black_locations) if mover == 'white' else (self.white_pieces, self.white_locations)
+        self.game_over = True
+        if king_attacked(pieces, locations, mover, enemy_pieces, enemy_locations):
+            self.winner = opponent
+            print(f"Game {self.game_id}: Over! {opponent.capitalize()} wins by checkmate!")
+        else:
+            self.winner = ''
+            print(f"Game {self.game_id}: Over! Draw by stalemate.")
+        return True
 
-            # Recalculate options
-            self.white_options = check_options(self.white_pieces, self.white_locations, 'white', self.white_locations, self.black_locations)
-            self.black_options = check_options(self.black_pieces, self.black_locations, 'black', self.white_locations, self.black_locations)
+    @OPTIONS_UPDATE_SECONDS.timed
+    def _recalculate_options(self, mover_color, selection_index, changed_squares):
+        # Called within lock after a move has been applied to the piece/location lists.
+        # changed_squares: every square whose occupancy the move changed.
+        if not INCREMENTAL_OPTIONS:
+            self._rebuild_options()
+            return
+        if self._options_from_cache(): return
+
+        white_bb = sum(self._piece_boards['white'].values()) # The boards never overlap, so sum is their union
+        black_bb = sum(self._piece_boards['black'].values())
+        changed_mask = 0
+        for x, y in changed_squares: changed_mask |= SQUARE_BITS[y * 8 + x]
+        # A castling rook always ends up next to a square the king left or entered, so it is refreshed too
+        white_force = selection_index if mover_color == 'white' else None
+        black_force = selection_index if mover_color == 'black' else None
+        white_changed = update_options(self._pseudo_options['white'], self.white_pieces, self.white_locations, 'white',
+                                       white_bb, black_bb, changed_mask, white_force)
+        black_changed = update_options(self._pseudo_options['black'], self.black_pieces, self.black_locations, 'black',
+                                       white_bb, black_bb, changed_mask, black_force)
+        if white_changed is None or black_changed is None:
+            print(f"Game {self.game_id}: Options misaligned with pieces, rebuilding.")
+            self._rebuild_options()
+            return
+
+        if DEBUG_VERIFY_OPTIONS:
+            full_white = check_options(self.white_pieces, self.white_locations, 'white', self.white_locations, self.black_locations)
+            full_black = check_options(self.black_pieces, self.black_locations, 'black', self.white_locations, self.black_locations)
+            if full_white != self._pseudo_options['white'] or full_black != self._pseudo_options['black']:
+                print(f"Game {self.game_id}: Incremental options mismatch after move to {changed_squares[1]}, using full rebuild.")
+                self._pseudo_options = {'white': full_white, 'black': full_black}
+                self._refresh_legal_options(white_bb, black_bb)
+                self._cache_options()
+                return
+        self._refresh_legal_options(white_bb, black_bb, {'white': white_changed, 'black': black_changed})
+        self._cache_options()
+
+    def _rebuild_options(self):
+        # Called within lock
+        self._piece_boards = {'white': piece_boards(self.white_pieces, self.white_locations),
+                              'black': piece_boards(self.black_pieces, self.black_locations)}
+        if self._options_from_cache(): return
+        self._pseudo_options = {
+            'white': check_options(self.white_pieces, self.white_locations, 'white', self.white_locations, self.black_locations),
+            'black': check_options(self.black_pieces, self.black_locations, 'black', self.white_locations, self.black_locations),
+        }
+        self._refresh_legal_options(locations_to_bitboard(self.white_locations), locations_to_bitboard(self.black_locations))
+        self._cache_options()
+
+    def _reset_position_hash(self):
+        # Called within lock (or before the game is shared) after the whole board was replaced
+        self.position_hash = position_hash(self.white_pieces, self.white_locations, self.black_pieces, self.black_locations,
+                                           'white' if self.turn_step < 2 else 'black', self.castling, self.en_passant)
+        self._repetitions = {self.position_hash: 1}
+
+    # --- Shared Options Cache ---
+    # Entries are keyed by position_hash: ((white locations, pseudo-legal lists, sent lists),
+    # (the same for black), indices of the side to move's legal overrides), all copies. Two
+    # games can reach one position with their pieces in different orders, so a hit in another
+    # order is mapped square by square. The lists inside are shared between games and are
+    # only ever replaced, never changed in place.
+    def _options_from_cache(self):
+        # Called within lock. Loads the options of the current position from the cache; False on a miss.
+        if not OPTIONS_CACHE_ENABLED: return False
+        entry = options_cache.get(self.position_hash)
+        if entry is None: return False
+        mover = 'white' if self.turn_step < 2 else 'black'
+        loaded = {}
+        for color, (cached_locations, cached_pseudo, cached_options) in zip(('white', 'black'), entry[:2]):
+            locations = self.white_locations if color == 'white' else self.black_locations
+            overrides = entry[2] if color == mover else ()
+            if locations == cached_locations:
+                loaded[color] = (cached_pseudo[:], cached_options[:], set(overrides))
+                continue
+            cached_index = {location: i for i, location in enumerate(cached_locations)}
+            try: order = [cached_index[location] for location in locations]
+            except KeyError: return False # Hash collision: not the position the entry was made for
+            if len(order) != len(cached_locations): return False
+            loaded[color] = ([cached_pseudo[j] for j in order], [cached_options[j] for j in order],
+                             {i for i, j in enumerate(order) if j in overrides})
+        for color, (pseudo, new_options, override_indices) in loaded.items():
+            self._pseudo_options[color] = pseudo
+            self._legal_overrides[color] = override_indices
+            old_options = self.white_options if color == 'white' else self.black_options
+            self._dirty_options[color].update([i for i, (moves, old) in enumerate(zip(new_options, old_options)) if moves != old])
+            self._dirty_options[color].update(range(len(old_options), len(new_options)))
+            if color == 'white': self.white_options = new_options
+            else: self.black_options = new_options
+        return True
 
-            return True
+    def _cache_options(self):
+        # Called within lock once the options of the current position are current
+        if not OPTIONS_CACHE_ENABLED or not options_cache.admit(self.position_hash): return
+        mover = 'white' if self.turn_step < 2 else 'black'
+        options_cache.put(self.position_hash, (
+            (self.white_locations[:], self._pseudo_options['white'][:], self.white_options[:]),
+            (self.black_locations[:], self._pseudo_options['black'][:], self.black_options[:]),
+            frozenset(self._legal_overrides[mover])))
+
+    def _refresh_legal_options(self, white_bb, black_bb, pseudo_changed=None):
+        # Called within lock once the pseudo-legal lists are current. The side to move gets
+        # strictly legal lists; the other side keeps its pseudo-legal ones, which is what the
+        # client's check indicator reads ("squares this side attacks"). Only lists that differ
+        # from what was last sent are marked dirty. pseudo_changed ({color: indices} from
+        # update_options) limits that comparison to lists that can have changed; None compares all.
+        mover = 'white' if self.turn_step < 2 else 'black'
+        for color in ('white', 'black'):
+            pseudo = self._pseudo_options[color]
+            new_options = pseudo[:]
+            old_options = self.white_options if color == 'white' else self.black_options
+            previous = self._legal_overrides[color]
+            overrides = {}
+            if color == mover:
+                enemy = 'black' if color == 'white' else 'white'
+                pieces, locations = (self.white_pieces, self.white_locations) if color == 'white' else (self.black_pieces, self.black_locations)
+                enemy_pieces, enemy_locations = (self.black_pieces, self.black_locations) if color == 'white' else (self.white_pieces, self.white_locations)
+                overrides = legal_overrides(pseudo, pieces, locations, color, white_bb, black_bb, enemy_pieces, enemy_locations,
+                                            self.castling, self.en_passant, self._piece_boards[enemy])
+                for i, moves in overrides.items(): new_options[i] = moves
+            self._legal_overrides[color] = set(overrides)
+            dirty = self._dirty_options[color]
+            if pseudo_changed is None or len(old_options) != len(new_options):
+                dirty.update([i for i, (moves, old) in enumerate(zip(new_options, old_options)) if moves != old])
+                dirty.update(range(len(old_options), len(new_options)))
+            else:
+                # update_options only reports lists that changed; just the overridden ones need comparing
+                for i in pseudo_changed[color]:
+                    if i not in previous and i not in overrides: dirty.add(i)
+                for i in previous:
+                    if new_options[i] != old_options[i]: dirty.add(i)
+                for i in overrides:
+                    if i not in previous and new_options[i] != old_options[i]: dirty.add(i)
+            if color == 'white': self.white_options = new_options
+            else: self.black_options = new_options
 
     def add_chat_message(self, sender_color, text, timestamp):
         with self.game_state_lock:
             if self.game_over: return False
-            chat_message = {'sender': sender_color, 'text': text, 'timestamp': timestamp}
-            self.chat_history.append(chat_message)
-            if len(self.chat_history) > 100:
-                self.chat_history.pop(0)
+            if self._pending_change: self._seal_pending() # Keeps the outbox in the order things happened
+            chat_message = self.chat.append(sender_color, text, timestamp)
+            self._outbox.append(chat_append_message([chat_message])) # Sent on its own; the board state is unchanged
+            self._frame_cache.clear() # Snapshots carry the newest chat id
+            if self.journal: self.journal_lsn = self.journal.log_chat(self, chat_message)
             print(f"Game {self.game_id} Chat from {sender_color}: {text}")
             return True
 
+    def _mark_changed(self):
+        # Called within lock after any state change: queue a delta and drop cached snapshot frames
+        self._pending_change = True
+        self._frame_cache.clear()
+
+    def _seal_pending(self):
+        # Called within lock. Turns everything changed since the last seal into one numbered delta.
+        self.state_seq += 1
+        white_time, black_time, clock_ts = self._clock_anchor()
+        delta = {
+            'type': 'delta', 'seq': self.state_seq, 'base_seq': self.state_seq - 1,
+            'turn_step': self.turn_step, 'white_time': white_time, 'black_time': black_time, 'clock_ts': clock_ts,
+        }
+        if self.game_over: delta.update(game_over=True, winner=self.winner) # Omitted while the game runs
+        if not self.game_started: delta['game_started'] = False
+        if self._pending_moves: delta['moves'] = self._pending_moves
+        options = {}
+        for color, options_list in (('white', self.white_options), ('black', self.black_options)):
+            dirty = self._dirty_options[color]
+            if dirty: options[color] = {i: options_list[i][:] for i in sorted(dirty) if i < len(options_list)}
+        if options: delta['options'] = options
+        self._pending_moves = []
+        self._dirty_options = {'white': set(), 'black': set()}
+        self._pending_change = False
+        self._outbox.append(delta)
+
+    def take_deltas(self, include_clocks=False):
+        """Returns the deltas (and chat_append events) not yet broadcast, oldest first.
+
+        With include_clocks, a clock-only delta is produced even if nothing else changed
+        (clients extrapolate clocks themselves, so the servers never need one).
+        """
+        with self.game_state_lock:
+            if self._pending_change or include_clocks:
+                self._seal_pending()
+            deltas, self._outbox = self._outbox, []
+            return deltas
+
     def get_state(self):
         with self.game_state_lock:
-            return {
-                'game_id': self.game_id,
-                'white_pieces': self.white_pieces[:],
-                'white_locations': self.white_locations[:],
-                'black_pieces': self.black_pieces[:],
-                'black_locations': self.black_locations[:],
-                'captured_white': self.captured_pieces_white[:],
-                'captured_black': self.captured_pieces_black[:],
-                'turn_step': self.turn_step,
-                'game_over': self.game_over,
-                'winner': self.winner,
-                'white_options': self.white_options[:], # Shallow copy options lists
-                'black_options': self.black_options[:],
-                'chat_history': self.chat_history[:],
-                'white_time': self.white_time,
-                'black_time': self.black_time,
-                'game_started': self.game_started
-            }
+            # Seal pending changes first so the snapshot's seq covers exactly what it contains
+            if self._pending_change: self._seal_pending()
+            return self._state_dict()
+
+    def snapshot_frame(self, codec=PICKLE_CODEC):
+        """get_state() already framed in codec; built once per state version and codec.
+
+        Every recipient of a snapshot (game start, resync) gets the same bytes. A cached frame
+        stays valid while nothing changes because its clocks are an anchor the client counts
+        down from, not a reading that goes stale.
+        """
+        with self.game_state_lock:
+            if self._pending_change: self._seal_pending()
+            cached = self._frame_cache.get(codec.codec_id)
+            if cached is None or cached[0] != self.state_seq:
+                cached = (self.state_seq, wire.frame_message(self._state_dict(), codec))
+                self._frame_cache[codec.codec_id] = cached
+            return cached[1]
+
+    def legacy_snapshot_frame(self, live_clocks=False):
+        """The frame a client that skipped the handshake gets for every update (see
+        broadcast_game_state): the whole state with its chat history, pickled, since that is
+        the only message such a client reads. Cached like snapshot_frame; live_clocks builds
+        it afresh so the clocks read as of now (the once-a-second legacy tick)."""
+        with self.game_state_lock:
+            if self._pending_change: self._seal_pending()
+            cached = self._frame_cache.get(LEGACY_FRAME)
+            if live_clocks or cached is None or cached[0] != self.state_seq:
+                state = self._state_dict()
+                state['chat_history'] = list(self.chat)
+                cached = (self.state_seq, wire.frame_message(state, PICKLE_CODEC))
+                self._frame_cache[LEGACY_FRAME] = cached
+            return cached[1]
+
+    def _state_dict(self):
+        # Called within lock, with nothing pending
+        white_time, black_time, clock_ts = self._clock_anchor()
+        return {
+            'game_id': self.game_id,
+            'seq': self.state_seq,
+            'white_pieces': self.white_pieces[:],
+            'white_locations': self.white_locations[:],
+            'black_pieces': self.black_pieces[:],
+            'black_locations': self.black_locations[:],
+            'captured_white': self.captured_pieces_white[:],
+            'captured_black': self.captured_pieces_black[:],
+            'turn_step': self.turn_step,
+            'game_over': self.game_over,
+            'winner': self.winner,
+            'white_options': self.white_options[:], # Shallow copy options lists
+            'black_options': self.black_options[:],
+            'chat_id': self.chat.last_id, # Lets a client tell whether it has missed chat lines
+            'white_time': white_time,
+            'black_time': black_time,
+            'clock_ts': clock_ts,
+            'game_started': self.game_started
+        }
+
+    def chat_catch_up(self, after_id):
+        """The reply to a chat_sync: every held line newer than after_id."""
+        with self.game_state_lock:
+            return chat_sync_message(self.chat.since(after_id))
 
     def get_player_connections(self):
         with self.game_state_lock:
             # Return only non-None connections
             return [conn for conn in self.players.keys() if conn and conn.fileno() != -1]
 
+    # --- Journal and Recovery ---
+    # Every change is journaled under the game lock, so this game's records are in the order
+    # its changes happened. journal_lsn is what a broadcast must wait for (see broadcast_game_state).
+    def _journal_game(self):
+        # Called within lock. Writes the whole game: at start, and again at every checkpoint.
+        if self.journal and not self.journal_closed:
+            self.journal_lsn = self.journal.log_game(self, dict(self._state_dict(), chat_history=list(self.chat),
+                                                                castling=self.castling, en_passant=self.en_passant))
+
+    def journal_snapshot(self):
+        """Re-journals the whole game (a checkpoint is about to drop its older records). True if written."""
+        with self.game_state_lock:
+            if self.game_over or not self.game_started: return False
+            self._journal_game()
+            return not self.journal_closed
+
+    def close_journal(self):
+        """Records that this game is gone for good, so a restart will not bring it back."""
+        with self.game_state_lock:
+            if self.journal and not self.journal_closed:
+                self.journal_lsn = self.journal.log_close(self)
+                self.journal_closed = True
+
+    def restore(self, state, seat_tokens):
+        """Loads a journaled snapshot into this fresh Game. Recovery only, before the game is shared."""
+        self.white_pieces, self.white_locations = list(state['white_pieces']), list(state['white_locations'])
+        self.black_pieces, self.black_locations = list(state['black_pieces']), list(state['black_locations'])
+        self.captured_pieces_white = list(state.get('captured_white', []))
+        self.captured_pieces_black = list(state.get('captured_black', []))
+        self.chat = ChatLog.restored(state.get('chat_history') or [], state.get('chat_id', 0))
+        self.turn_step = state['turn_step']
+        self.castling = state['castling'] if 'castling' in state else \
+            castling_from_board(self.white_pieces, self.white_locations, self.black_pieces, self.black_locations)
+        self.en_passant = state.get('en_passant')
+        self._piece_boards = {'white': piece_boards(self.white_pieces, self.white_locations),
+                              'black': piece_boards(self.black_pieces, self.black_locations)}
+        self._reset_position_hash() # Repetition counts restart here: the journal keeps no position history
+        self.game_over = state.get('game_over', False)
+        self.winner = state.get('winner') or ''
+        self.game_started = state.get('game_started', False)
+        self.white_time, self.black_time = state['white_time'], state['black_time']
+        self.state_seq = state.get('seq', 0)
+        self.seat_tokens = dict(seat_tokens)
+        self.replayed_moves = 0
+
+    def replay_move(self, color, selection_index, target_coords, white_time, black_time, promotion=None):
+        """Re-applies a journaled move (already validated when it was first played). Options
+        are left stale until finish_replay(), which is far cheaper than updating them per move."""
+        self.white_time, self.black_time = white_time, black_time
+        if self._execute_move(color, selection_index, target_coords, promotion, replay=True): self.replayed_moves += 1
+
+    def replay_chat(self, color, text, timestamp):
+        self.chat.append(color, text, timestamp)
+
+    def replay_result(self, winner, white_time, black_time):
+        self.winner, self.white_time, self.black_time = winner, white_time, black_time
+        self.game_over = True
+
+    def finish_replay(self):
+        """Makes a replayed game consistent again: options rebuilt, replayed changes not re-sent.
+        A game whose last replayed move was checkmate or stalemate comes out game_over."""
+        self._rebuild_options()
+        self._check_game_end()
+        self.take_deltas() # Everything replayed is in the snapshot a returning player gets
+
+    def resume_clock(self, at):
+        """Restarts the side to move's clock at monotonic time at (a recovered game's grace period)."""
+        with self.game_state_lock:
+            self.last_timer_update = at
+            self._mark_changed()
+            self._notify_deadline()
+
+    def claim_seat(self, conn, token):
+        """Seats a reconnecting player by its resume token. Returns its color, or None."""
+        with self.game_state_lock:
+            if self.game_over: return None
+            for color, seat_token in self.seat_tokens.items():
+                if self.player_conns.get(color) is None and hmac.compare_digest(seat_token.encode(), token.encode()):
+                    self.add_player(conn, color)
+                    now = time.monotonic()
+                    if self.is_ready() and self.last_timer_update is not None and self.last_timer_update > now:
+                        self.last_timer_update = now # Both back: no need to wait out the grace period
+                        self._mark_changed()
+                        self._notify_deadline()
+                    return color
+            return None
+
 
 # --- Server Globals ---
-games = {} # {game_id: Game_instance}
-waiting_players = {} # {conn: addr}
-client_to_game = {} # {conn: game_id}
+# Each connection's thread owns a ClientSession holding direct references to its game, so
+# the per-message path takes no server-wide lock. Games are found by id (spectators, flag-fall)
+# through a lock-striped registry. pairing_lock only guards the matchmaker, and no lock
+# outside a single Game is ever held while a socket is written or closed.
+game_registry = GameRegistry() # {game_id: Game_instance}, striped by id
+matchmaker = Matchmaker() # Waiting ClientSessions by rating band; guarded by pairing_lock
+connection_codecs = {} # {conn: codec negotiated at connect}; plain dict ops, safe without a lock
+unframed_connections = set() # Players that skipped the handshake; they only understand full state snapshots
 server_socket = None
-pairing_lock = threading.Lock()
-games_lock = threading.Lock()
-last_periodic_broadcast_time = 0
+pairing_lock = TimedLock(PAIRING_LOCK_WAIT)
+spectator_hub = SpectatorHub() # Read-only viewers, written to from their own thread
+journal = None # journal.Journal when run with --journal; new games journal their changes to it
+
+
+class ClientSession:
+    """One player connection: its codec, and once paired, its game and color.
+
+    Written by the pairing thread before the player is told its color and read only by the
+    connection's own thread afterwards, so it needs no lock.
+    """
+    def __init__(self, conn, addr):
+        self.conn = conn
+        self.addr = addr
+        self.codec = PICKLE_CODEC
+        self.framed = False
+        self.rating = DEFAULT_RATING
+        self.game = None
+        self.color = None
+
+    def assign(self, game, color):
+        self.game = game
+        self.color = color
+
+    def send(self, message_obj):
+        return send_framed_message(self.conn, message_obj)
 
 # --- Server Functions ---
 
-def send_framed_message(sock, message_obj):
-    """Serializes message object, prefixes with length, and sends."""
+def track_connection(conn, codec, framed):
+    """Records what a player connection negotiated, for every later send to it."""
+    connection_codecs[conn] = codec
+    if not framed: unframed_connections.add(conn)
+
+
+def forget_connection(conn):
+    connection_codecs.pop(conn, None)
+    unframed_connections.discard(conn)
+
+
+def frame_message(message_obj, codec=PICKLE_CODEC):
+    """Serializes message object with the given codec and prefixes it with its length."""
+    return wire.frame_message(message_obj, codec)
+
+
+def send_frame(sock, frame):
+    """Sends bytes that are already framed, e.g. one broadcast buffer shared by all recipients.
+    Every framed send (send_framed_message too) ends here, so this is where sends are measured."""
+    started = time.perf_counter()
     try:
-        pickled_data = pickle.dumps(message_obj)
-        message_length = len(pickled_data)
-        length_prefix = struct.pack('>I', message_length)
-        sock.sendall(length_prefix + pickled_data)
+        sock.sendall(frame)
+        SEND_SECONDS.observe(time.perf_counter() - started)
+        SENT_FRAME_BYTES.observe(len(frame))
         return True
-    except (socket.error, BrokenPipeError, pickle.PicklingError, struct.error, AttributeError) as e:
+    except (socket.error, BrokenPipeError, AttributeError) as e:
         # AttributeError can happen if sock is already closed/invalid
         # print(f"Error sending framed message: {e}") # Reduce noise
+        SEND_FAILURES.inc()
         return False
     except Exception as e:
-        print(f"Unexpected error in send_framed_message: {e}")
+        print(f"Unexpected error in send_frame: {e}")
+        SEND_FAILURES.inc()
         return False
 
 
-def broadcast_game_state(game_id):
-    """Sends the state of a specific game to its participants using framing."""
-    global games
-    game = None
-    with games_lock:
-        game = games.get(game_id)
-        if not game: return
-
+def send_framed_message(sock, message_obj):
+    """Serializes message object in the connection's codec, prefixes with length, and sends."""
     try:
-        state_dict = game.get_state()
-        player_conns = game.get_player_connections() # Needs internal lock
+        frame = frame_message(message_obj, connection_codecs.get(sock, PICKLE_CODEC))
+    except (pickle.PicklingError, WireError, struct.error):
+        return False
     except Exception as e:
-        print(f"Error getting state/conns for game {game_id} (broadcast): {e}")
-        return
+        print(f"Unexpected error in send_framed_message: {e}")
+        return False
+    return send_frame(sock, frame)
 
-    if not player_conns: return
 
-    disconnected_during_broadcast = []
-    for conn in player_conns:
-        if not send_framed_message(conn, state_dict):
-            peer = "unknown"
-            try: peer = conn.getpeername()
-            except: pass
-            print(f"Failed to send state to client {peer} in game {game_id}. Marking for removal.")
-            disconnected_during_broadcast.append(conn)
+def recv_exactly(conn, num_bytes):
+    data = b""
+    while len(data) < num_bytes:
+        chunk = conn.recv(num_bytes - len(data))
+        if not chunk: break
+        data += chunk
+    return data
 
-    for conn_to_remove in disconnected_during_broadcast:
-        with games_lock:
-             if game_id in games: # Check game still exists
-                  remove_client_from_game(conn_to_remove, game_id) # remove_client needs games_lock
 
+def recv_short_ascii(conn):
+    """Reads a u8 length and that many ASCII bytes (handshake game ids and seat tokens)."""
+    length = recv_exactly(conn, 1)
+    return recv_exactly(conn, length[0]).decode('ascii', 'replace') if length else None
 
-def remove_client_from_game(conn, game_id):
-    """Handles removing a client, updating game state, and cleaning up mappings."""
-    global games, client_to_game
-    # Assumes games_lock is held externally when called
 
-    game_ended_by_disconnect = False
-    disconnected_color = None
-    game_exists_during_removal = False
+def negotiate_codec(conn):
+    """Reads the optional wire handshake. Returns a wire.Hello.
+
+    Clients that send nothing within NEGOTIATION_TIMEOUT (or something else entirely) are
+    legacy clients: pickle codec, unframed inbound messages. spectate_game_id is only set
+    for a version 2+ handshake from a spectator, rating for a version 3 rated player, and
+    resume for a version 4 player reclaiming its seat after a restart.
+    """
+    received = b""
+    try:
+        conn.settimeout(NEGOTIATION_TIMEOUT)
+        while len(received) < len(wire.WIRE_MAGIC) + 2:
+            chunk = conn.recv(len(wire.WIRE_MAGIC) + 2 - len(received))
+            if not chunk: break
+            received += chunk
+            if not wire.WIRE_MAGIC.startswith(received[:len(wire.WIRE_MAGIC)]): break # Not a handshake
+        if received.startswith(wire.WIRE_MAGIC) and len(received) == len(wire.WIRE_MAGIC) + 2:
+            version, codec_count = received[-2], received[-1]
+            offered = recv_exactly(conn, codec_count)
+            spectate_game_id = rating = resume = None
+            role = recv_exactly(conn, 1) if version >= 2 else b""
+            if role == bytes((wire.ROLE_SPECTATOR,)):
+                spectate_game_id = recv_short_ascii(conn)
+            elif role == bytes((wire.ROLE_PLAYER,)) and version >= 3:
+                rating_bytes = recv_exactly(conn, 2)
+                if len(rating_bytes) == 2: rating = int.from_bytes(rating_bytes, 'big')
+            elif role == bytes((wire.ROLE_RESUME,)) and version >= 4:
+                game_id = recv_short_ascii(conn)
+                token = recv_short_ascii(conn)
+                if game_id is not None and token is not None: resume = (game_id, token)
+            codec = wire.choose_codec(set(offered))
+            conn.sendall(wire.server_handshake_ack(codec))
+            return wire.Hello(codec, True, b"", spectate_game_id, rating, resume)
+    except socket.timeout:
+        pass
+    finally:
+        try: conn.settimeout(None)
+        except OSError: pass
+    return wire.Hello(PICKLE_CODEC, False, received, None, None, None)
+
+
+@BROADCAST_SECONDS.timed
+def broadcast_game_state(game, full_snapshot=False):
+    """Sends state changes of a specific game to its participants using framing.
+
+    Normally only the queued deltas go out; full_snapshot sends the whole get_state() instead
+    (used when a game starts). Either way each codec's bytes are built once and the same
+    buffer is written to every recipient. Only this game's locks are held while sending.
+    A client that skipped the handshake reads nothing but full states, so it gets
+    Game.legacy_snapshot_frame() for every update, chat lines included.
+    """
+    with game.broadcast_lock: # Per-game; keeps delta order identical for every recipient
+        try:
+            if full_snapshot:
+                game.take_deltas() # The snapshot already contains everything queued
+                batch = None # Snapshot frames come from the game's per-version cache
+            else:
+                batch = FrameBatch(game.take_deltas())
+            player_conns = game.get_player_connections() # Needs internal lock
+        except Exception as e:
+            print(f"Error getting state/conns for game {game.game_id} (broadcast): {e}")
+            return
+
+        if batch is not None and not batch: return
+        if game.journal: game.journal.wait_durable(game.journal_lsn) # Never show a move a crash could undo
+
+        legacy_sent = False
+        for conn in player_conns:
+            codec = connection_codecs.get(conn, PICKLE_CODEC)
+            try:
+                if conn in unframed_connections:
+                    frame = game.legacy_snapshot_frame()
+                    legacy_sent = True
+                else: frame = game.snapshot_frame(codec) if batch is None else batch.frame_for(codec)
+            except (pickle.PicklingError, WireError, struct.error) as e:
+                print(f"Cannot encode state for game {game.game_id} as {codec.name}: {e}")
+                frame = None
+            if frame is None or not send_frame(conn, frame):
+                peer = "unknown"
+                try: peer = conn.getpeername()
+                except: pass
+                print(f"Failed to send state to client {peer} in game {game.game_id}. Disconnecting it.")
+                shutdown_connection(conn) # Its own thread sees the disconnect and cleans up
+        if legacy_sent: schedule_legacy_tick(game)
+
+        spectator_hub.publish(game.game_id, batch) # Only queues; the hub thread does the writing
+
+
+def send_game_snapshot(conn, game):
+    """Sends a full state snapshot to one client, e.g. after it reports a delta sequence gap."""
+    with game.broadcast_lock:
+        try:
+            if conn in unframed_connections:
+                frame = game.legacy_snapshot_frame()
+                schedule_legacy_tick(game)
+            else: frame = game.snapshot_frame(connection_codecs.get(conn, PICKLE_CODEC))
+        except (pickle.PicklingError, WireError, struct.error):
+            return False
+        if game.journal: game.journal.wait_durable(game.journal_lsn)
+        return send_frame(conn, frame)
+
+
+# --- Legacy Clock Ticks ---
+# Framed clients count the running clock down themselves (Game._clock_anchor). A client that
+# skipped the handshake draws the times exactly as received, so while its game runs it gets
+# the whole state again LEGACY_TICK_INTERVAL after the last one it was sent.
+def schedule_legacy_tick(game):
+    if game.game_started and not game.game_over:
+        legacy_ticks.arm(game.game_id, time.monotonic() + LEGACY_TICK_INTERVAL)
+
+
+def send_legacy_tick(game_id):
+    """Runs on the legacy tick scheduler thread: the state with the clocks as of now, to the
+    players of game_id that skipped the handshake. Stops once none are left or the game ends."""
+    game = game_registry.get(game_id)
+    if not game: return
+    with game.broadcast_lock: # Not overtaken by (and never overtaking) a broadcast
+        conns = [conn for conn in game.get_player_connections() if conn in unframed_connections]
+        if not conns or game.game_over: return
+        try: frame = game.legacy_snapshot_frame(live_clocks=True)
+        except (pickle.PicklingError, WireError, struct.error) as e:
+            print(f"Cannot encode clock update for game {game_id}: {e}")
+            return
+        if game.journal: game.journal.wait_durable(game.journal_lsn)
+        for conn in conns:
+            if not send_frame(conn, frame): shutdown_connection(conn)
+    schedule_legacy_tick(game)
+
+
+def send_chat_catch_up(session, game, after_id):
+    """Answers a chat_sync: the chat lines the client has not seen, after the last id it holds."""
+    if not isinstance(after_id, int): return False
+    with game.broadcast_lock: # Not overtaken by a broadcast of a newer line
+        message = game.chat_catch_up(after_id)
+        if game.journal: game.journal.wait_durable(game.journal_lsn)
+        return session.send(message)
+
+
+def shutdown_connection(conn):
+    """Ends a connection owned by another thread; that thread's recv returns and it closes the socket."""
+    try: conn.shutdown(socket.SHUT_RDWR)
+    except (socket.error, OSError): pass
 
-    # 1. Remove from client_to_game mapping (needs separate lock)
-    with pairing_lock:
-        client_to_game.pop(conn, None)
 
-    # 2. Remove player from the Game object (games_lock is already held)
-    game = games.get(game_id)
+def close_connection(conn):
+    try:
+        if conn and conn.fileno() != -1: conn.close()
+    except (socket.error, OSError): pass
+
+
+def connection_alive(conn):
+    """False if the peer has already hung up. Peeks without consuming or blocking, so it is
+    safe on a socket whose own thread is sitting in recv."""
+    try:
+        return conn.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) != b""
+    except BlockingIOError:
+        return True
+    except OSError:
+        return False
+
+
+def remove_client_from_game(session):
+    """Handles removing a client, updating game state, and telling the opponent. No locks held on entry."""
+    game = session.game
+    disconnected_color = None
     if game:
-        game_exists_during_removal = True
-        needs_broadcast, disconnected_color = game.remove_player(conn) # Needs internal lock
+        needs_broadcast, disconnected_color = game.remove_player(session.conn) # Needs internal lock
         if needs_broadcast:
-            game_ended_by_disconnect = True
+            broadcast_game_state(game) # Tell the opponent they won
 
-        player_conns_after_remove = game.get_player_connections() # Needs internal lock
-        if not player_conns_after_remove or game.game_over:
-             print(f"Game {game_id} is now empty or over. Removing from active games.")
-             games.pop(game_id, None) # Remove game instance
-             game_exists_during_removal = False
-    # else: Game already removed
+        if not game.get_player_connections() or game.game_over:
+            retire_game(game)
+        session.assign(None, None)
 
-    # 3. Close the connection (outside locks if possible, but difficult here)
     peername = "unknown"
-    try: peername = conn.getpeername()
+    try: peername = session.conn.getpeername()
     except: pass
-    try:
-        conn.close()
-        print(f"Closed connection for {disconnected_color or 'unknown'} from {peername} (Game: {game_id})")
-    except (socket.error, OSError): pass
+    close_connection(session.conn)
+    PLAYER_DISCONNECTS.inc()
+    print(f"Closed connection for {disconnected_color or 'unknown'} from {peername} (Game: {game.game_id if game else None})")
+
+
+def retire_game(game):
+    """Removes a finished or abandoned game from the server (and from a restart's recovery)."""
+    if game_registry.pop(game.game_id, game):
+        GAMES_RETIRED.inc()
+        print(f"Game {game.game_id} is now empty or over. Removing from active games.")
+        spectator_hub.close_game(game.game_id)
+        legacy_ticks.cancel(game.game_id)
+        game.close_journal()
+
+
+def start_paired_game(white, black, game_id=None):
+    """Creates a game for two sessions, tells each its color and sends the first snapshot.
+
+    Runs with no global lock held, on the second player's thread or the matchmaking sweep
+    thread. Returns False if either player could not be reached; the game is then discarded
+    and both connections are shut down (the caller closes its own). game_id is chosen by the
+    caller when something outside this process (supervisor.py) needs to know it in advance.
+    """
+    print(f"Pairing {black.addr} ({black.rating}) with waiting player {white.addr} ({white.rating})")
+    game_id = game_id or str(uuid.uuid4())
+    new_game = Game(game_id)
+    new_game.deadline_listener = clock_scheduler.arm
+    if journal:
+        new_game.journal = journal
+        new_game.seat_tokens = {'white': secrets.token_hex(8), 'black': secrets.token_hex(8)}
+
+    # Assign players and add to game object (needs internal game lock)
+    with new_game.game_state_lock:
+        add_ok_1 = new_game.add_player(white.conn, 'white')
+        add_ok_2 = new_game.add_player(black.conn, 'black')
+    if not (add_ok_1 and add_ok_2):
+        print(f"Error adding players to game {game_id}.")
+        shutdown_connection(white.conn)
+        shutdown_connection(black.conn)
+        return False
 
-    # 4. Broadcast final state (outside lock if was possible, but difficult)
-    # If we broadcast here, it must be done carefully to avoid deadlock if broadcast calls remove_client again
-    # For now, rely on the next periodic update or calling function to handle broadcast if needed.
-    # if game_ended_by_disconnect and game_exists_during_removal:
-    #    print(f"Triggering final broadcast for game {game_id} due to disconnect.")
-    #    # Potential issue: broadcast_game_state might try to re-acquire games_lock
-    #    # Consider scheduling broadcast outside the lock.
+    white.assign(new_game, 'white') # Before the color goes out, so the first move finds its game
+    black.assign(new_game, 'black')
+    game_registry.add(new_game)
+    print(f"Game {game_id} created.")
+    new_game.start_game() # Needs internal game lock
+
+    # Send color assignments using framing
+    if not (white.send('white') and black.send('black')):
+        print(f"Error sending initial assignments for game {game_id}.")
+        game_registry.pop(game_id, new_game)
+        clock_scheduler.cancel(game_id)
+        new_game.close_journal()
+        white.assign(None, None)
+        black.assign(None, None)
+        shutdown_connection(white.conn) # Its thread is still in its receive loop
+        shutdown_connection(black.conn)
+        return False
+    for session in (white, black): # Only sent when journaling; lets the player back in after a restart
+        if session.color in new_game.seat_tokens:
+            session.send({'type': 'seat', 'game_id': game_id, 'token': new_game.seat_tokens[session.color]})
+
+    GAMES_STARTED.inc()
+    print(f"Broadcasting initial state for game {game_id}")
+    broadcast_game_state(new_game, full_snapshot=True)
+    return True
 
 
 def handle_client(conn, addr):
     """Handles initial setup and finds/assigns client to a game."""
-    global waiting_players, games, client_to_game
     print(f"Handling connection from {addr}")
-    assigned_game_id = None
-    player_color = None
-    initial_send_failed = False
+    CONNECTIONS_ACCEPTED.inc()
+    session = ClientSession(conn, addr)
 
     try:
-        with pairing_lock:
-            if waiting_players:
-                # Pair found!
-                wait_conn, wait_addr = waiting_players.popitem()
-                print(f"Pairing {addr} with waiting player {wait_addr}")
-
-                game_id = str(uuid.uuid4())
-                new_game = Game(game_id)
-
-                # Assign players and add to game object (needs internal game lock)
-                with new_game.game_state_lock:
-                    add_ok_1 = new_game.add_player(wait_conn, 'white')
-                    add_ok_2 = new_game.add_player(conn, 'black')
-
-                if not (add_ok_1 and add_ok_2):
-                     print(f"Error adding players to game {game_id}.")
-                     # Cleanup
-                     try: wait_conn.close()
-                     except: pass
-                     try: conn.close()
-                     except: pass
-                     return # Exit thread
-
-                # Update mappings
-                client_to_game[wait_conn] = game_id
-                client_to_game[conn] = game_id
-
-                with games_lock:
-                    games[game_id] = new_game
-                    print(f"Game {game_id} created.")
-
-                assigned_game_id = game_id
-                player_color = 'black'
-
-                # Start game (needs internal game lock)
-                game_started_ok = new_game.start_game()
-
-                # Send color assignments using framing
-                if not send_framed_message(wait_conn, 'white'): initial_send_failed = True
-                if not send_framed_message(conn, 'black'): initial_send_failed = True
-
-                if initial_send_failed:
-                    print(f"Error sending initial assignments for game {game_id}.")
-                    # Enhanced cleanup
-                    client_to_game.pop(wait_conn, None)
-                    client_to_game.pop(conn, None)
-                    with games_lock: games.pop(game_id, None)
-                    try: wait_conn.close()
-                    except: pass
-                    try: conn.close()
-                    except: pass
-                    return # Exit thread
-                else:
-                     # Initial broadcast (safe to call here)
-                     print(f"Broadcasting initial state for game {game_id}")
-                     broadcast_game_state(game_id)
-
-            else:
-                # Add to waiting queue
-                waiting_players[conn] = addr
-                print(f"Added {addr} to waiting queue.")
-                # Optionally send waiting status
-                # send_framed_message(conn, {"status": "waiting"})
-
-        # --- Continue to communication loop ---
-        if initial_send_failed: return
-
-        if assigned_game_id and player_color:
-            run_game_communication(conn, addr, assigned_game_id, player_color)
-        elif conn in waiting_players: # Check if still waiting
-            run_game_communication(conn, addr, None, None) # Loop handles waiting state
-        # else: Pairing failed, already cleaned up
+        hello = negotiate_codec(conn)
+        session.codec, session.framed, session.rating = hello.codec, hello.framed, hello.rating or DEFAULT_RATING
+        track_connection(conn, hello.codec, hello.framed)
+        leftover = hello.leftover
+        print(f"{addr} speaks {hello.codec.name} ({'framed' if hello.framed else 'legacy'}).")
+        if hello.spectate_game_id is not None:
+            join_as_spectator(conn, addr, hello.spectate_game_id, hello.codec, leftover)
+            return
+        if hello.resume is not None:
+            resume_seat(session, *hello.resume, leftover)
+            return
+
+        with pairing_lock: # Queue bookkeeping only; all sending happens after release
+            # A waiting player that hung up is skipped; its own thread is about to clean up
+            opponent = matchmaker.join(conn, session.rating, session, accept=lambda t: connection_alive(t.key))
+
+        if opponent is None:
+            print(f"Added {addr} (rating {session.rating}) to waiting queue.")
+        elif not start_paired_game(opponent.payload, session):
+            forget_connection(conn)
+            close_connection(conn)
+            return # Exit thread; pairing already cleaned up
+
+        # --- Continue to communication loop (also while waiting; the loop handles it) ---
+        run_game_communication(session, leftover)
 
     except Exception as e:
         print(f"Unexpected error during client handling/pairing for {addr}: {e}")
@@ -603,184 +1150,258 @@ def handle_client(conn, addr):
         traceback.print_exc()
         # General cleanup
         with pairing_lock:
-            waiting_players.pop(conn, None)
-        final_game_id = None
-        with pairing_lock: final_game_id = client_to_game.get(conn)
-        if final_game_id:
-             with games_lock: remove_client_from_game(conn, final_game_id)
-        else:
-             try:
-                 if conn and conn.fileno() != -1: conn.close()
-             except: pass
-
-
-def run_game_communication(conn, addr, initial_game_id, initial_player_color):
+            matchmaker.cancel(conn)
+        forget_connection(conn)
+        remove_client_from_game(session)
+
+
+def resume_seat(session, game_id, token, leftover=b""):
+    """Puts a player back in its seat of a game recovered from the journal, then serves it."""
+    game = game_registry.get(game_id)
+    color = game.claim_seat(session.conn, token) if game else None
+    if color is None:
+        print(f"{session.addr} tried to resume unknown, finished or taken seat in game {game_id}.")
+        session.send('error:no_such_game')
+        forget_connection(session.conn)
+        close_connection(session.conn)
+        return
+    session.assign(game, color)
+    print(f"{session.addr} resumed as {color} in game {game_id}.")
+    if session.send(color) and send_game_snapshot(session.conn, game):
+        broadcast_game_state(game) # The clock may have restarted now both players are back
+    run_game_communication(session, leftover)
+
+
+def join_as_spectator(conn, addr, game_id, codec, leftover):
+    """Hands a spectator connection to spectator_hub; this client's thread then exits."""
+    forget_connection(conn) # The hub tracks the viewer's codec itself
+    game = game_registry.get(game_id)
+    if not game or game.game_over:
+        print(f"{addr} asked to watch unknown or finished game {game_id}.")
+        try:
+            conn.sendall(frame_message('error:no_such_game', codec))
+            conn.close()
+        except (socket.error, OSError): pass
+        return
+    try:
+        conn.sendall(frame_message('spectator', codec))
+    except (socket.error, OSError):
+        try: conn.close()
+        except OSError: pass
+        return
+    spectator_hub.add(game_id, game, conn, codec, leftover)
+    print(f"{addr} is watching game {game_id} ({spectator_hub.count(game_id)} spectators).")
+
+
+def handle_game_message(game, player_color, message):
+    """Applies one decoded client message to its game. Returns True if state should be broadcast."""
+    if not isinstance(message, dict) or 'type' not in message: return False
+
+    message_type = message['type']
+    message_data = message.get('data')
+
+    if message_type == 'move':
+        if isinstance(message_data, (list, tuple)) and len(message_data) == 2:
+             selection_index, target_coords = message_data
+             if isinstance(selection_index, int) and \
+                isinstance(target_coords, (list, tuple)) and len(target_coords) == 2 and \
+                all(isinstance(c, int) for c in target_coords):
+                  # apply_move handles its own locking
+                  return game.apply_move(player_color, selection_index, tuple(target_coords), message.get('promotion'))
+             # else: Invalid target coords format
+        # else: Invalid move data format
+
+    elif message_type == 'chat':
+        if isinstance(message_data, dict):
+             text = message_data.get('text')
+             # Pickle clients can send any type; only text every codec and the journal can carry gets in
+             if isinstance(text, str) and 0 < len(text) <= MAX_CHAT_TEXT_LENGTH:
+                  timestamp = message_data.get('timestamp')
+                  if not isinstance(timestamp, str) or len(timestamp) > MAX_CHAT_TIMESTAMP_LENGTH:
+                       timestamp = datetime.now().strftime("%I:%M %p")
+                  # add_chat_message handles its own locking
+                  return game.add_chat_message(player_color, text, timestamp)
+        # else: Invalid chat data format
+
+    return False
+
+
+def run_game_communication(session, leftover=b""):
     """Handles receiving messages from a client and interacting with their game."""
-    global client_to_game, games
-    current_game_id = initial_game_id
-    player_color = initial_player_color
-    buffer = b""
+    conn, addr = session.conn, session.addr
+    decoder = wire.inbound_decoder(session.codec, session.framed)
+    decoder.feed(leftover)
 
     while True:
         try:
-            chunk = conn.recv(4096)
-            if not chunk:
-                print(f"Client {addr} (Color: {player_color}, Game: {current_game_id}) disconnected (empty data).")
-                break
-
-            buffer += chunk
-
-            while True: # Process buffer for simple pickle
-                try:
-                    message, buffer = pickle.loads(buffer), b''
-                except (pickle.UnpicklingError, EOFError, IndexError, TypeError, ValueError):
-                    break # Need more data
-
-                # Get current game ID for this client
-                with pairing_lock:
-                    current_game_id = client_to_game.get(conn)
-
-                if not current_game_id: continue # Still waiting
-
-                # Get game instance
-                game = None
-                with games_lock:
-                    game = games.get(current_game_id)
-
-                if not game: break # Game ended/removed while processing
-
-                # Get player color within game context
-                # No lock needed if Game.players is read-only here, but safer with game lock
-                with game.game_state_lock:
-                     player_color = game.players.get(conn)
-                if not player_color: break # Should not happen if assigned
+            for message in decoder.messages(): # Every complete buffered message, in order
+                sync_reply = time_sync_reply(message) # Answered even while still waiting for a game
+                if sync_reply:
+                    session.send(sync_reply)
+                    continue
 
+                game, player_color = session.game, session.color # Set by the pairing thread
+                if not game: continue # Still waiting
+                if game.game_over and game.game_id not in game_registry:
+                    break # Game ended/removed while processing
 
                 # Process Message
-                if not isinstance(message, dict) or 'type' not in message: continue
-
-                message_type = message['type']
-                message_data = message.get('data')
-                needs_broadcast = False
-
-                if message_type == 'move':
-                    if isinstance(message_data, (list, tuple)) and len(message_data) == 2:
-                         selection_index, target_coords = message_data
-                         if isinstance(target_coords, (list, tuple)) and len(target_coords) == 2 and \
-                            all(isinstance(c, int) for c in target_coords):
-                              # apply_move handles its own locking
-                              move_applied = game.apply_move(player_color, selection_index, target_coords)
-                              if move_applied: needs_broadcast = True
-                         # else: Invalid target coords format
-                    # else: Invalid move data format
-
-                elif message_type == 'chat':
-                    if isinstance(message_data, dict) and message_data.get('text'):
-                         timestamp = message_data.get('timestamp', datetime.now().strftime("%I:%M %p"))
-                         text = message_data['text']
-                         # add_chat_message handles its own locking
-                         chat_added = game.add_chat_message(player_color, text, timestamp)
-                         if chat_added: needs_broadcast = True
-                    # else: Invalid chat data format
+                if isinstance(message, dict) and message.get('type') == 'resync':
+                    send_game_snapshot(conn, game)
+                    continue
+                if isinstance(message, dict) and message.get('type') == 'chat_sync':
+                    send_chat_catch_up(session, game, message.get('data'))
+                    continue
 
                 # Broadcast if needed
-                if needs_broadcast:
-                    broadcast_game_state(current_game_id)
+                if handle_game_message(game, player_color, message):
+                    broadcast_game_state(game)
+
+            if not decoder.recv_into(conn):
+                print(f"Client {addr} (Color: {session.color}, Game: {session.game and session.game.game_id}) disconnected (empty data).")
+                break
 
         except (socket.error, ConnectionResetError, BrokenPipeError) as e:
-            print(f"Network error with client {addr} (Game: {current_game_id}): {e}")
+            print(f"Network error with client {addr} (Game: {session.game and session.game.game_id}): {e}")
+            break
+        except WireError as e:
+            print(f"Protocol error from client {addr} (Game: {session.game and session.game.game_id}): {e}")
             break
         except Exception as e:
-            print(f"Unexpected error processing data for client {addr} (Game: {current_game_id}): {e}")
+            print(f"Unexpected error processing data for client {addr} (Game: {session.game and session.game.game_id}): {e}")
             import traceback
             traceback.print_exc()
             break
 
     # Cleanup
     print(f"Communication loop finished for {addr}.")
-    final_game_id = None
     with pairing_lock:
-        final_game_id = client_to_game.get(conn)
-        waiting_players.pop(conn, None)
-
-    if final_game_id:
-        with games_lock: # Need lock to call remove_client
-             if final_game_id in games: # Check game exists before removal
-                  remove_client_from_game(conn, final_game_id)
-             else: # Game already gone, just close socket if needed
-                 try:
-                      if conn and conn.fileno() != -1: conn.close()
-                 except: pass
-    else:
-        # Was waiting or already removed
-        try:
-            if conn and conn.fileno() != -1: conn.close()
-        except: pass
-
-
-def periodic_updates():
-    """Periodically updates timers for all active games and broadcasts."""
-    global games, last_periodic_broadcast_time
+        matchmaker.cancel(conn)
+    forget_connection(conn)
+    remove_client_from_game(session)
+
+
+def handle_flag_fall(game_id):
+    """Runs on the clock scheduler thread when game_id's side to move should be out of time."""
+    game = game_registry.get(game_id)
+    if game and game.update_timers(): # Charges the clock; re-arms if the flag has not quite fallen
+        broadcast_game_state(game)
+        if not game.get_player_connections(): retire_game(game) # Recovered, and nobody came back
+
+
+def recover_games(game_journal):
+    """Rebuilds the games an earlier run left in progress from its journal and registers them.
+
+    Recovered games wait for their players to reconnect with their seat tokens; the side to
+    move's clock stays stopped for RESUME_GRACE_SECONDS (the outage is never charged).
+    Returns the recovered games.
+    """
+    games = {} # {journal game number: Game}
+    for kind, number, body in game_journal.replay():
+        if kind == KIND_GAME:
+            game_id, seats, state = body
+            game = games.get(number)
+            if game is None or game.game_id != game_id: game = games[number] = Game(game_id, initialize_board=False)
+            game.restore(state, seats)
+            continue
+        game = games.get(number)
+        if game is None: continue
+        if kind == KIND_MOVE: game.replay_move(*body)
+        elif kind == KIND_CHAT: game.replay_chat(*body)
+        elif kind == KIND_RESULT: game.replay_result(*body)
+        elif kind == KIND_CLOSE: del games[number]
+
+    recovered = []
+    resume_at = time.monotonic() + RESUME_GRACE_SECONDS
+    for number, game in games.items():
+        if game.game_over or not game.game_started or not game.seat_tokens: continue
+        game.finish_replay()
+        if game.game_over: continue # Ended by its last move just before the crash
+        game.journal, game.journal_no = game_journal, number
+        game.deadline_listener = clock_scheduler.arm
+        game_registry.add(game)
+        game.resume_clock(resume_at)
+        recovered.append(game)
+        print(f"Game {game.game_id}: recovered with {game.replayed_moves} moves replayed since its last snapshot, "
+              f"{'white' if game.turn_step < 2 else 'black'} to move.")
+    print(f"Recovered {len(recovered)} games in progress from the journal.")
+    return recovered
+
+
+def open_journal(directory):
+    """Attaches a journal in directory to this server: recovers what it holds, then starts it."""
+    global journal
+    journal = Journal(directory)
+    recovered = recover_games(journal)
+    journal.start(game_registry.values)
+    return recovered
+
+
+def export_metrics(port):
+    """Points the gauges at this process's games and connections, then serves the metrics on port."""
+    GAMES_ACTIVE.set_function(lambda: len(game_registry))
+    PLAYERS_WAITING.set_function(lambda: len(matchmaker))
+    PLAYER_CONNECTIONS.set_function(lambda: len(connection_codecs))
+    SPECTATORS.set_function(lambda: len(spectator_hub.viewers))
+    return metrics.serve(port)
+
+
+def run_matchmaking_sweeps():
+    """Thread body: pairs waiting players once their widening rating windows overlap."""
     while True:
+        time.sleep(MATCH_SWEEP_INTERVAL)
         try:
-            start_time = time.time()
-            games_to_update = []
-            with games_lock: games_to_update = list(games.keys())
-
-            games_needing_broadcast = set()
-
-            for game_id in games_to_update:
-                game = None # Reset game var
-                with games_lock: # Need lock to safely get game instance
-                    game = games.get(game_id)
-                    if not game: continue # Skip if game was removed
-
-                # update_timers handles its own internal lock
-                game_ended_by_time = game.update_timers()
-                if game_ended_by_time:
-                    games_needing_broadcast.add(game_id)
-
-            current_time = time.time()
-            if current_time - last_periodic_broadcast_time >= BROADCAST_INTERVAL:
-                 for game_id in games_to_update:
-                      game = None
-                      with games_lock: game = games.get(game_id) # Check again if game exists
-                      # Broadcast state if game is active
-                      if game and game.game_started and not game.game_over:
-                           games_needing_broadcast.add(game_id)
-                 last_periodic_broadcast_time = current_time
-
-            if games_needing_broadcast:
-                 # print(f"Periodic: Broadcasting for {games_needing_broadcast}") # Debug
-                 for game_id in games_needing_broadcast:
-                      broadcast_game_state(game_id) # Handles its own locks internally
-
-            elapsed = time.time() - start_time
-            sleep_time = max(0.1, BROADCAST_INTERVAL - elapsed)
-            time.sleep(sleep_time)
-
+            with pairing_lock: pairs = matchmaker.sweep(accept=lambda t: connection_alive(t.key))
+            for white, black in pairs: # Both players' threads are already in their receive loops
+                start_paired_game(white.payload, black.payload)
         except Exception as e:
-            print(f"!!! FATAL ERROR IN PERIODIC UPDATE THREAD: {e} !!!")
+            print(f"!!! ERROR IN MATCHMAKING SWEEP: {e} !!!")
             import traceback
             traceback.print_exc()
-            time.sleep(5)
+
+
+clock_scheduler = ClockScheduler(handle_flag_fall)
+legacy_ticks = ClockScheduler(send_legacy_tick) # Same deadline heap, keyed by game id, for legacy clock updates
 
 
 # --- Main Server Execution ---
 if __name__ == "__main__":
+    import argparse
+    arg_parser = argparse.ArgumentParser(description="Threaded chess server")
+    arg_parser.add_argument('--host', default=SERVER_IP)
+    arg_parser.add_argument('--port', type=int, default=PORT)
+    arg_parser.add_argument('--journal', metavar='DIR', help="journal games to DIR and recover them after a crash")
+    arg_parser.add_argument('--metrics-port', type=int, help="serve Prometheus metrics on this local port")
+    args = arg_parser.parse_args()
+
+    if args.journal:
+        try:
+            open_journal(args.journal)
+        except JournalError as e:
+            print(f"Journal error: {e}")
+            exit()
+
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     try:
-        server_socket.bind((SERVER_IP, PORT))
-        server_socket.listen(MAX_PLAYERS_OVERALL)
-        print(f"Chess Server Started on {SERVER_IP}:{PORT}. Waiting for connections...")
+        server_socket.bind((args.host, args.port))
+        server_socket.listen(LISTEN_BACKLOG)
+        print(f"Chess Server Started on {args.host}:{args.port}. Waiting for connections...")
     except socket.error as e:
         print(f"Socket bind/listen error: {e}")
         exit()
 
-    update_thread = threading.Thread(target=periodic_updates, daemon=True)
-    update_thread.start()
-    print("Periodic timer update thread started.")
+    clock_thread = threading.Thread(target=clock_scheduler.run, daemon=True)
+    clock_thread.start()
+    threading.Thread(target=legacy_ticks.run, daemon=True).start()
+    spectator_thread = threading.Thread(target=spectator_hub.run, daemon=True)
+    spectator_thread.start()
+    matchmaking_thread = threading.Thread(target=run_matchmaking_sweeps, daemon=True)
+    matchmaking_thread.start()
+    print("Flag-fall scheduler, spectator and matchmaking threads started.")
+    if args.metrics_port is not None:
+        try: export_metrics(args.metrics_port)
+        except OSError as e: print(f"Metrics endpoint not started: {e}")
 
     while True:
         try:
@@ -0,0 +1,391 @@
+# ######## server_async.py (Single-Threaded Event-Loop Server) ########
+# Alternative to the thread-per-client server in server.py. Uses the same Game class,
+# message handling and length-prefixed framing, but runs every connection as a coroutine
+# (and every flag-fall timer as a loop callback) on one asyncio event loop, so idle clients
+# cost a socket and a small coroutine instead of an OS thread.
+import asyncio
+import time
+import uuid
+
+import wire
+from wire import PICKLE_CODEC, WireError, FrameBatch
+from server import Game, frame_message, handle_game_message, time_sync_reply
+from server import SERVER_IP, PORT, NEGOTIATION_TIMEOUT, LEGACY_TICK_INTERVAL
+from server import BROADCAST_SECONDS, SEND_SECONDS, SENT_FRAME_BYTES, SEND_FAILURES, GAMES_STARTED, GAMES_RETIRED
+from server import CONNECTIONS_ACCEPTED, PLAYER_DISCONNECTS, GAMES_ACTIVE, PLAYERS_WAITING, PLAYER_CONNECTIONS, SPECTATORS
+import metrics
+from spectators import SpectatorQueue, publish_to, spectator_reply, SPECTATOR_MAX_BACKLOG
+from matchmaking import Matchmaker, DEFAULT_RATING, MATCH_SWEEP_INTERVAL
+
+# --- Constants ---
+ASYNC_BACKLOG = 4096 # Listen backlog; bursts of thousands of connects are expected here
+MAX_OUTBOUND_BUFFER = 1 << 20 # Drop clients that stop reading once this many bytes are queued
+
+
+class AsyncChessServer:
+    def __init__(self):
+        self.games = {} # {game_id: Game_instance}
+        self.matchmaker = Matchmaker() # Waiting sockets by rating band
+        self.client_to_game = {} # {sock: game_id}
+        self.writers = {} # {sock: StreamWriter}; Game.players is keyed by the raw socket
+        self.codecs = {} # {sock: codec negotiated at connect}
+        self.unframed = set() # Players that skipped the handshake; they get a full snapshot for every update
+        self.flag_timers = {} # {game_id: asyncio.TimerHandle firing at that game's flag-fall deadline}
+        self.legacy_ticks = {} # {game_id: asyncio.TimerHandle for the next clock update to its unframed players}
+        self.spectators = {} # {game_id: {sock: (SpectatorQueue, asyncio.Event waking its writer)}}
+
+    # --- Sending ---
+    def send_message(self, sock, message):
+        try:
+            return self.send_frame(sock, frame_message(message, self.codecs.get(sock, PICKLE_CODEC)))
+        except WireError as e:
+            print(f"Cannot encode message for {sock}: {e}")
+            return False
+
+    def send_frame(self, sock, frame):
+        writer = self.writers.get(sock)
+        if writer is None or writer.is_closing():
+            SEND_FAILURES.inc()
+            return False
+        started = time.perf_counter()
+        writer.write(frame) # Sends what the socket takes now and buffers the rest
+        SEND_SECONDS.observe(time.perf_counter() - started)
+        SENT_FRAME_BYTES.observe(len(frame))
+        if writer.transport.get_write_buffer_size() > MAX_OUTBOUND_BUFFER:
+            print(f"Client {writer.get_extra_info('peername')} is not reading. Dropping.")
+            writer.close()
+            SEND_FAILURES.inc()
+            return False
+        return True
+
+    @BROADCAST_SECONDS.timed
+    def broadcast_game_state(self, game_id, full_snapshot=False):
+        """Sends state changes of a specific game to its participants, serializing each once per codec.
+        Clients that skipped the handshake get the whole state (Game.legacy_snapshot_frame) instead."""
+        game = self.games.get(game_id)
+        if not game: return
+        if full_snapshot:
+            game.take_deltas() # The snapshot already contains everything queued
+            batch = None # Snapshot frames come from the game's per-version cache
+        else:
+            batch = FrameBatch(game.take_deltas())
+            if not batch: return
+        legacy_sent = False
+        for sock in game.get_player_connections():
+            codec = self.codecs.get(sock, PICKLE_CODEC)
+            try:
+                if sock in self.unframed:
+                    frame = game.legacy_snapshot_frame()
+                    legacy_sent = True
+                else: frame = game.snapshot_frame(codec) if batch is None else batch.frame_for(codec)
+            except WireError as e:
+                print(f"Cannot encode state for game {game_id} as {codec.name}: {e}")
+                continue
+            self.send_frame(sock, frame)
+        if legacy_sent: self.arm_legacy_tick(game)
+        for sock, (queue, wakeup) in self.spectators.get(game_id, {}).items():
+            writer = self.writers.get(sock)
+            if not queue and writer and writer.transport.get_write_buffer_size() < SPECTATOR_MAX_BACKLOG:
+                try: # Keeping up: hand the frame straight to the transport, no coroutine switch
+                    writer.write(game.snapshot_frame(queue.codec) if batch is None else batch.frame_for(queue.codec))
+                    continue
+                except WireError as e:
+                    print(f"Cannot encode state for a spectator of game {game_id}: {e}")
+            publish_to(queue, batch) # Lagging: the viewer's pump coroutine coalesces and drains
+            wakeup.set()
+
+    # --- Pairing & Cleanup ---
+    def pair_or_wait(self, sock, addr, rating):
+        opponent = self.matchmaker.join(sock, rating, addr)
+        if opponent is None:
+            print(f"Added {addr} (rating {rating}) to waiting queue.")
+            return
+        self.start_game(opponent.key, opponent.payload, sock, addr)
+
+    def sweep_matchmaking(self):
+        """Repeating loop callback: pairs waiting players once their rating windows overlap."""
+        try:
+            for white, black in self.matchmaker.sweep():
+                self.start_game(white.key, white.payload, black.key, black.payload)
+        finally:
+            asyncio.get_running_loop().call_later(MATCH_SWEEP_INTERVAL, self.sweep_matchmaking)
+
+    def start_game(self, wait_sock, wait_addr, sock, addr):
+        print(f"Pairing {addr} with waiting player {wait_addr}")
+        game_id = str(uuid.uuid4())
+        new_game = Game(game_id)
+        new_game.deadline_listener = self.arm_flag_timer
+        with new_game.game_state_lock:
+            new_game.add_player(wait_sock, 'white')
+            new_game.add_player(sock, 'black')
+        self.client_to_game[wait_sock] = game_id
+        self.client_to_game[sock] = game_id
+        self.games[game_id] = new_game
+        new_game.start_game()
+
+        if not (self.send_message(wait_sock, 'white') and self.send_message(sock, 'black')):
+            print(f"Error sending initial assignments for game {game_id}.")
+            self.games.pop(game_id, None)
+            self.arm_flag_timer(game_id, None)
+            self.cancel_legacy_tick(game_id)
+            for player_sock in (wait_sock, sock):
+                self.client_to_game.pop(player_sock, None)
+                writer = self.writers.get(player_sock)
+                if writer: writer.close()
+            return
+        GAMES_STARTED.inc()
+        print(f"Broadcasting initial state for game {game_id}")
+        self.broadcast_game_state(game_id, full_snapshot=True)
+
+    def remove_client(self, sock):
+        self.matchmaker.cancel(sock)
+        game_id = self.client_to_game.pop(sock, None)
+        game = self.games.get(game_id) if game_id else None
+        if game:
+            needs_broadcast, disconnected_color = game.remove_player(sock)
+            if needs_broadcast: self.broadcast_game_state(game_id) # Tell the opponent they won
+            if not game.get_player_connections() or game.game_over:
+                print(f"Game {game_id} is now empty or over. Removing from active games.")
+                if self.games.pop(game_id, None): GAMES_RETIRED.inc()
+                self.cancel_legacy_tick(game_id)
+                self.close_spectators(game_id)
+        self.codecs.pop(sock, None)
+        self.unframed.discard(sock)
+        writer = self.writers.pop(sock, None)
+        if writer and not writer.is_closing(): writer.close()
+
+    async def negotiate_codec(self, reader, writer):
+        """Async twin of server.negotiate_codec. Returns a wire.Hello; raises WireError if a
+        peer that sent the handshake magic does not finish within NEGOTIATION_TIMEOUT."""
+        magic_length = len(wire.WIRE_MAGIC)
+        try:
+            received = await asyncio.wait_for(reader.readexactly(magic_length), NEGOTIATION_TIMEOUT)
+        except asyncio.TimeoutError:
+            return wire.Hello(PICKLE_CODEC, False, b"", None, None, None)
+        except asyncio.IncompleteReadError as e:
+            return wire.Hello(PICKLE_CODEC, False, e.partial, None, None, None)
+        if received != wire.WIRE_MAGIC: return wire.Hello(PICKLE_CODEC, False, received, None, None, None)
+
+        async def short_ascii():
+            return (await reader.readexactly((await reader.readexactly(1))[0])).decode('ascii', 'replace')
+        async def read_hello():
+            version, codec_count = await reader.readexactly(2)
+            offered = await reader.readexactly(codec_count)
+            spectate_game_id = rating = resume = None
+            role = (await reader.readexactly(1))[0] if version >= 2 else None
+            if role == wire.ROLE_SPECTATOR:
+                spectate_game_id = await short_ascii()
+            elif role == wire.ROLE_PLAYER and version >= 3:
+                rating = int.from_bytes(await reader.readexactly(2), 'big')
+            elif role == wire.ROLE_RESUME and version >= 4:
+                resume = (await short_ascii(), await short_ascii())
+            return wire.choose_codec(set(offered)), spectate_game_id, rating, resume
+        # A peer that sent the magic and then stalls must not hold its socket open forever
+        try: codec, spectate_game_id, rating, resume = await asyncio.wait_for(read_hello(), NEGOTIATION_TIMEOUT)
+        except asyncio.TimeoutError: raise WireError("handshake not completed in time")
+        writer.write(wire.server_handshake_ack(codec))
+        return wire.Hello(codec, True, b"", spectate_game_id, rating, resume)
+
+    # --- Spectators ---
+    async def watch_game(self, reader, writer, sock, addr, game_id, decoder):
+        """Serves one read-only viewer until it disconnects or its game goes away."""
+        game = self.games.get(game_id)
+        if not game or game.game_over:
+            print(f"{addr} asked to watch unknown or finished game {game_id}.")
+            self.send_message(sock, 'error:no_such_game')
+            return
+        self.send_message(sock, 'spectator')
+        queue = SpectatorQueue(game, self.codecs[sock])
+        wakeup = asyncio.Event()
+        viewers = self.spectators.setdefault(game_id, {})
+        viewers[sock] = (queue, wakeup)
+        print(f"{addr} is watching game {game_id} ({len(viewers)} spectators).")
+        pump = asyncio.create_task(self.pump_spectator(writer, queue, wakeup))
+        try:
+            while True:
+                chunk = await reader.read(4096)
+                if not chunk: break
+                decoder.feed(chunk)
+                for message in decoder.messages(): spectator_reply(queue, message)
+                wakeup.set()
+        finally:
+            pump.cancel()
+            viewers.pop(sock, None)
+            if not viewers and self.spectators.get(game_id) is viewers: del self.spectators[game_id]
+
+    async def pump_spectator(self, writer, queue, wakeup):
+        """Writes one viewer's queue; while drain() waits, new updates coalesce in the queue."""
+        try:
+            while True:
+                frame = queue.pop_frame()
+                if frame is None:
+                    if queue.closing:
+                        writer.close()
+                        return
+                    wakeup.clear()
+                    await wakeup.wait()
+                    continue
+                writer.write(frame)
+                await writer.drain()
+        except (ConnectionError, OSError, WireError):
+            writer.close() # The read loop in watch_game sees the close and cleans up
+
+    def close_spectators(self, game_id):
+        for queue, wakeup in self.spectators.get(game_id, {}).values():
+            queue.closing = True # Pumps close the connection once the final frames are out
+            wakeup.set()
+
+    # --- Connection Coroutine ---
+    async def handle_client(self, reader, writer):
+        sock = writer.get_extra_info('socket')
+        addr = writer.get_extra_info('peername')
+        self.writers[sock] = writer
+        print(f"Handling connection from {addr}")
+        CONNECTIONS_ACCEPTED.inc()
+        player = False
+
+        try:
+            hello = await self.negotiate_codec(reader, writer)
+            self.codecs[sock] = hello.codec
+            if not hello.framed: self.unframed.add(sock)
+            decoder = wire.inbound_decoder(hello.codec, hello.framed)
+            decoder.feed(hello.leftover)
+            if hello.spectate_game_id is not None:
+                await self.watch_game(reader, writer, sock, addr, hello.spectate_game_id, decoder)
+                return
+            if hello.resume is not None: # This server keeps no journal, so no game outlives a restart
+                self.send_message(sock, 'error:no_such_game')
+                return
+            player = True
+            self.pair_or_wait(sock, addr, hello.rating or DEFAULT_RATING)
+            while True:
+                chunk = await reader.read(65536)
+                if not chunk:
+                    print(f"Client {addr} disconnected (empty data).")
+                    break
+                decoder.feed(chunk)
+
+                for message in decoder.messages(): # Same wire format as server.py
+                    sync_reply = time_sync_reply(message)
+                    if sync_reply:
+                        self.send_message(sock, sync_reply)
+                        continue
+                    game_id = self.client_to_game.get(sock)
+                    if not game_id: continue # Still waiting
+                    game = self.games.get(game_id)
+                    if not game: break
+                    player_color = game.players.get(sock)
+                    if not player_color: break
+
+                    if isinstance(message, dict) and message.get('type') == 'resync':
+                        if sock in self.unframed:
+                            self.send_frame(sock, game.legacy_snapshot_frame())
+                            self.arm_legacy_tick(game)
+                        else: self.send_frame(sock, game.snapshot_frame(self.codecs.get(sock, PICKLE_CODEC)))
+                        continue
+                    if isinstance(message, dict) and message.get('type') == 'chat_sync':
+                        if isinstance(message.get('data'), int): self.send_message(sock, game.chat_catch_up(message['data']))
+                        continue
+                    if handle_game_message(game, player_color, message):
+                        self.broadcast_game_state(game_id)
+        except (ConnectionError, OSError, asyncio.IncompleteReadError) as e:
+            print(f"Network error with client {addr}: {e}")
+        except WireError as e:
+            print(f"Protocol error from client {addr}: {e}")
+        except Exception as e:
+            print(f"Unexpected error processing data for client {addr}: {e}")
+            import traceback
+            traceback.print_exc()
+        finally:
+            self.remove_client(sock)
+            if player: PLAYER_DISCONNECTS.inc()
+
+    # --- Timers ---
+    def arm_flag_timer(self, game_id, deadline):
+        """Game.deadline_listener: one loop timer per game at its flag-fall deadline.
+
+        The event loop's clock is time.monotonic(), the same clock Game deadlines use.
+        """
+        handle = self.flag_timers.pop(game_id, None)
+        if handle: handle.cancel()
+        if deadline is not None:
+            self.flag_timers[game_id] = asyncio.get_running_loop().call_at(deadline, self.handle_flag_fall, game_id)
+
+    def handle_flag_fall(self, game_id):
+        self.flag_timers.pop(game_id, None)
+        game = self.games.get(game_id)
+        if game and game.update_timers(): # Charges the clock; re-arms if the flag has not quite fallen
+            self.broadcast_game_state(game_id)
+
+    def arm_legacy_tick(self, game):
+        """Unframed players draw the clocks exactly as received: while their game runs, they get
+        the whole state again LEGACY_TICK_INTERVAL after the last one (as server.send_legacy_tick)."""
+        self.cancel_legacy_tick(game.game_id)
+        if game.game_started and not game.game_over:
+            self.legacy_ticks[game.game_id] = asyncio.get_running_loop().call_later(
+                LEGACY_TICK_INTERVAL, self.send_legacy_tick, game.game_id)
+
+    def cancel_legacy_tick(self, game_id):
+        handle = self.legacy_ticks.pop(game_id, None)
+        if handle: handle.cancel()
+
+    def send_legacy_tick(self, game_id):
+        self.legacy_ticks.pop(game_id, None)
+        game = self.games.get(game_id)
+        if not game or game.game_over: return
+        socks = [sock for sock in game.get_player_connections() if sock in self.unframed]
+        if not socks: return
+        frame = game.legacy_snapshot_frame(live_clocks=True)
+        for sock in socks: self.send_frame(sock, frame)
+        self.arm_legacy_tick(game)
+
+    def export_metrics(self, port):
+        """Points the gauges at this server's games and connections, then serves the metrics on port.
+        The callbacks run on the endpoint's thread and only take len() of the loop's dicts."""
+        spectator_count = lambda: sum(map(len, list(self.spectators.values())))
+        GAMES_ACTIVE.set_function(lambda: len(self.games))
+        PLAYERS_WAITING.set_function(lambda: len(self.matchmaker))
+        PLAYER_CONNECTIONS.set_function(lambda: len(self.codecs) - spectator_count())
+        SPECTATORS.set_function(spectator_count)
+        return metrics.serve(port)
+
+    async def serve(self, host, port):
+        listener = await asyncio.start_server(self.handle_client, host, port,
+                                              backlog=ASYNC_BACKLOG, reuse_address=True)
+        print(f"Async Chess Server Started on {host}:{port}. Waiting for connections...")
+        asyncio.get_running_loop().call_later(MATCH_SWEEP_INTERVAL, self.sweep_matchmaking)
+        async with listener:
+            await listener.serve_forever()
+
+
+def raise_open_file_limit():
+    """Lifts the soft descriptor limit to the hard limit so one process can hold 10k+ sockets."""
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        return hard
+    except (ImportError, ValueError, OSError):
+        return None
+
+
+# --- Main Server Execution ---
+if __name__ == "__main__":
+    import argparse
+    arg_parser = argparse.ArgumentParser(description="Event-loop chess server")
+    arg_parser.add_argument('--host', default=SERVER_IP)
+    arg_parser.add_argument('--port', type=int, default=PORT)
+    arg_parser.add_argument('--metrics-port', type=int, help="serve Prometheus metrics on this local port")
+    args = arg_parser.parse_args()
+
+    fd_limit = raise_open_file_limit()
+    if fd_limit: print(f"Open file limit: {fd_limit}")
+    chess_server = AsyncChessServer()
+    if args.metrics_port is not None:
+        try: chess_server.export_metrics(args.metrics_port)
+        except OSError as e: print(f"Metrics endpoint not started: {e}")
+    try:
+        asyncio.run(chess_server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print("Server stopped.")
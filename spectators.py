@@ -0,0 +1,228 @@
+# ######## spectators.py (Read-Only Game Viewers) ########
+# Spectators join a running game by id and receive the same state frames as the players,
+# but never on the players' send path: broadcasts only append shared frames to each viewer's
+# queue, and the bytes are written out elsewhere (SpectatorHub's thread for server.py, one
+# coroutine per viewer for server_async.py). A viewer that falls too far behind has its
+# backlog thrown away and is sent one fresh snapshot instead.
+import selectors
+import socket
+import threading
+from collections import deque
+
+import wire
+from wire import WireError
+from protocol import time_sync_reply
+
+# --- Constants ---
+SPECTATOR_MAX_BACKLOG = 256 * 1024 # Unsent bytes a viewer may queue before it is coalesced to a snapshot
+SPECTATOR_SEND_SIZE = 64 * 1024 # Most bytes handed to one spectator socket per send() call
+
+
+class SpectatorQueue:
+    """Outbound queue for one viewer. Coalesces to the latest state when the viewer lags.
+
+    Not thread-safe on its own; SpectatorHub guards it with its lock.
+    """
+    def __init__(self, game, codec, max_backlog=SPECTATOR_MAX_BACKLOG):
+        self.game = game
+        self.codec = codec
+        self.max_backlog = max_backlog
+        self.frames = deque()
+        self.queued_bytes = 0
+        self.needs_snapshot = True # A joining viewer starts from a snapshot
+        self.coalesced = 0 # Times this viewer's backlog was replaced by a snapshot
+        self.closing = False # Game is gone; disconnect once everything queued has been written
+
+    def __bool__(self):
+        return self.needs_snapshot or bool(self.frames)
+
+    def push(self, frame, control=False):
+        """Queues one framed update. control frames (time_sync and chat_sync replies) are never coalesced away."""
+        if not control:
+            if self.needs_snapshot: return # The snapshot, built when it is sent, will already include this
+            if self.queued_bytes + len(frame) > self.max_backlog:
+                self.request_snapshot()
+                self.coalesced += 1
+                return
+        self.frames.append(frame)
+        self.queued_bytes += len(frame)
+
+    def request_snapshot(self):
+        self.frames.clear()
+        self.queued_bytes = 0
+        self.needs_snapshot = True
+
+    def pop_frame(self):
+        """Next bytes to write, or None. The snapshot comes from the game's per-version cache."""
+        if self.needs_snapshot:
+            self.needs_snapshot = False
+            return self.game.snapshot_frame(self.codec)
+        if not self.frames: return None
+        frame = self.frames.popleft()
+        self.queued_bytes -= len(frame)
+        return frame
+
+
+def publish_to(queue, batch):
+    if batch is None: queue.request_snapshot()
+    else: queue.push(batch.frame_for(queue.codec))
+
+def spectator_reply(queue, message):
+    """Handles one message from a viewer. Spectators are read-only: only clock sync, resync and chat catch-up."""
+    if not isinstance(message, dict): return
+    if message.get('type') == 'resync':
+        queue.request_snapshot()
+    elif message.get('type') == 'chat_sync':
+        if isinstance(message.get('data'), int):
+            queue.push(wire.frame_message(queue.game.chat_catch_up(message['data']), queue.codec), control=True)
+    elif message.get('type') == 'time_sync':
+        reply = time_sync_reply(message)
+        if reply: queue.push(wire.frame_message(reply, queue.codec), control=True)
+
+
+class _Viewer:
+    def __init__(self, sock, game_id, queue, decoder):
+        self.sock = sock
+        self.game_id = game_id
+        self.queue = queue
+        self.decoder = decoder
+        self.partial = None # memoryview of a frame that is only partly written
+        self.registered = False # Known to the hub thread's selector
+        self.writing = False # Registered for EVENT_WRITE
+        self.dropped = False
+
+
+class SpectatorHub:
+    """Owns every spectator socket of the threaded server and writes to them from one thread.
+
+    Lock order: the hub lock may be held while a Game lock is taken (snapshots), never the reverse.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.selector = selectors.DefaultSelector()
+        self.viewers = {} # {sock: _Viewer}
+        self.by_game = {} # {game_id: {sock: _Viewer}}
+        self._dirty = set() # Viewers with newly queued data or state changes, for the hub thread
+        self._wake_reader, self._wake_writer = socket.socketpair()
+        self._wake_reader.setblocking(False)
+        self._wake_writer.setblocking(False)
+        self.selector.register(self._wake_reader, selectors.EVENT_READ)
+
+    # --- Called from server threads ---
+    def add(self, game_id, game, sock, codec, leftover=b""):
+        """Hands sock over to the hub as a viewer of game. The caller's thread may then exit."""
+        sock.setblocking(False)
+        decoder = wire.FrameDecoder(codec)
+        decoder.feed(leftover)
+        viewer = _Viewer(sock, game_id, SpectatorQueue(game, codec), decoder)
+        with self.lock:
+            self.viewers[sock] = viewer
+            self.by_game.setdefault(game_id, {})[sock] = viewer
+            self._dirty.add(viewer)
+        self._wake()
+
+    def publish(self, game_id, batch=None):
+        """Queues a FrameBatch (None: a fresh snapshot) for every viewer of game_id. Never blocks."""
+        with self.lock:
+            viewers = self.by_game.get(game_id)
+            if not viewers: return
+            for viewer in viewers.values():
+                publish_to(viewer.queue, batch)
+                self._dirty.add(viewer)
+        self._wake()
+
+    def close_game(self, game_id):
+        """The game is gone: viewers are disconnected once their queued frames are written."""
+        with self.lock:
+            for viewer in self.by_game.get(game_id, {}).values():
+                viewer.queue.closing = True
+                self._dirty.add(viewer)
+        self._wake()
+
+    def count(self, game_id):
+        with self.lock:
+            return len(self.by_game.get(game_id, ()))
+
+    def _wake(self):
+        try: self._wake_writer.send(b'\0')
+        except (BlockingIOError, OSError): pass # Already woken
+
+    # --- Hub thread ---
+    def run(self):
+        while True:
+            try:
+                events = self.selector.select()
+                for key, mask in events:
+                    if key.fileobj is self._wake_reader:
+                        try:
+                            while self._wake_reader.recv(4096): pass
+                        except (BlockingIOError, OSError): pass
+                        continue
+                    viewer = key.data
+                    if mask & selectors.EVENT_READ: self._read(viewer)
+                    if mask & selectors.EVENT_WRITE and not viewer.dropped: self._flush(viewer)
+                with self.lock:
+                    dirty, self._dirty = self._dirty, set()
+                for viewer in dirty:
+                    if viewer.dropped: continue
+                    if not viewer.registered: # Newly added
+                        self.selector.register(viewer.sock, selectors.EVENT_READ, viewer)
+                        viewer.registered = True
+                    self._flush(viewer)
+            except Exception as e:
+                print(f"!!! ERROR IN SPECTATOR HUB: {e} !!!")
+                import traceback
+                traceback.print_exc()
+
+    def _read(self, viewer):
+        try:
+            if not viewer.decoder.recv_into(viewer.sock):
+                self._drop(viewer)
+                return
+            for message in viewer.decoder.messages():
+                with self.lock: spectator_reply(viewer.queue, message)
+            self._flush(viewer)
+        except BlockingIOError:
+            pass
+        except (OSError, WireError) as e:
+            print(f"Spectator error in game {viewer.game_id}: {e}")
+            self._drop(viewer)
+
+    def _flush(self, viewer):
+        """Writes as much as the socket takes without blocking; waits for EVENT_WRITE otherwise."""
+        try:
+            while True:
+                if viewer.partial is None:
+                    with self.lock: frame = viewer.queue.pop_frame()
+                    if frame is None: break
+                    viewer.partial = memoryview(frame)
+                sent = viewer.sock.send(viewer.partial[:SPECTATOR_SEND_SIZE])
+                viewer.partial = viewer.partial[sent:] if sent < len(viewer.partial) else None
+        except BlockingIOError:
+            pass
+        except (OSError, WireError):
+            self._drop(viewer)
+            return
+        idle = viewer.partial is None and not viewer.queue
+        if idle and viewer.queue.closing:
+            self._drop(viewer)
+            return
+        if viewer.writing == idle: # Interest changed
+            viewer.writing = not idle
+            events = selectors.EVENT_READ | (selectors.EVENT_WRITE if viewer.writing else 0)
+            self.selector.modify(viewer.sock, events, viewer)
+
+    def _drop(self, viewer):
+        if viewer.dropped: return
+        viewer.dropped = True
+        with self.lock:
+            self.viewers.pop(viewer.sock, None)
+            viewers = self.by_game.get(viewer.game_id)
+            if viewers is not None:
+                viewers.pop(viewer.sock, None)
+                if not viewers: del self.by_game[viewer.game_id]
+        if viewer.registered:
+            try: self.selector.unregister(viewer.sock)
+            except (KeyError, ValueError): pass
+        try: viewer.sock.close()
+        except OSError: pass
@@ -0,0 +1,348 @@
+# ######## supervisor.py (Multi-Process Server: Supervisor and Game Workers) ########
+# One Python process can only validate moves and serialize state on one core at a time, so
+# this mode forks N worker processes that each run server.py's game machinery on their own
+# disjoint set of games. The supervisor owns the listening socket: it accepts, reads the wire
+# handshake, pairs players, and passes both accepted sockets of a new game to one worker over
+# a Unix socket (SCM_RIGHTS), so the two players of a game always share a worker. Spectators
+# are passed to whichever worker holds the game they asked for.
+# With --journal DIR each worker journals its games to DIR/worker-<index>; after a restart a
+# worker recovers that journal and tells the supervisor which games it holds, so returning
+# players (wire ROLE_RESUME) are passed back to the worker that has their game.
+import json
+import os
+import selectors
+import signal
+import socket
+import sys
+import threading
+import time
+import uuid
+
+import wire
+import server
+from server import ClientSession, negotiate_codec, start_paired_game, run_game_communication
+from server import join_as_spectator, frame_message, close_connection, connection_alive, resume_seat
+from server import SERVER_IP, PORT, LISTEN_BACKLOG
+from registry import GameRegistry
+from spectators import SpectatorHub
+from clocks import ClockScheduler
+from matchmaking import Matchmaker, DEFAULT_RATING, MATCH_SWEEP_INTERVAL
+from zobrist import options_cache
+
+# --- Constants ---
+STATS_INTERVAL = 5.0 # Seconds between per-worker stats reports
+CONTROL_MESSAGE_SIZE = 64 * 1024 # Largest supervisor <-> worker control message
+RECOVERED_IDS_PER_MESSAGE = 1000 # Recovered game ids per report; keeps each under CONTROL_MESSAGE_SIZE
+
+
+# --- Worker Process ---
+def run_worker(index, control, journal_dir=None, metrics_port=None):
+    """Worker process body. Serves whatever the supervisor hands over until it goes away.
+    With metrics_port, its metrics are served on metrics_port + index."""
+    # Fresh per-process state; the copies inherited through fork() share the parent's fds
+    server.game_registry = GameRegistry()
+    server.spectator_hub = SpectatorHub()
+    server.clock_scheduler = ClockScheduler(server.handle_flag_fall)
+    server.legacy_ticks = ClockScheduler(server.send_legacy_tick)
+    send_lock = threading.Lock()
+
+    def report(message):
+        with send_lock:
+            try: control.send(json.dumps(message).encode())
+            except OSError: pass
+
+    def report_stats():
+        while True:
+            time.sleep(STATS_INTERVAL)
+            games = server.game_registry.values()
+            report({'op': 'stats', 'pid': os.getpid(), 'games': len(games),
+                    'players': len(server.connection_codecs), 'spectators': len(server.spectator_hub.viewers),
+                    'updates': sum(game.state_seq for game in games), 'cpu_seconds': time.process_time(),
+                    'options_cache': options_cache.stats()})
+
+    server.game_registry.removal_listener = lambda game_id: report({'op': 'game_closed', 'game_id': game_id})
+    if journal_dir:
+        recovered = [game.game_id for game in server.open_journal(os.path.join(journal_dir, f'worker-{index}'))]
+        for start in range(0, len(recovered), RECOVERED_IDS_PER_MESSAGE):
+            report({'op': 'games_recovered', 'game_ids': recovered[start:start + RECOVERED_IDS_PER_MESSAGE]})
+    for target in (server.clock_scheduler.run, server.legacy_ticks.run, server.spectator_hub.run, report_stats):
+        threading.Thread(target=target, daemon=True).start()
+    if metrics_port is not None:
+        try: server.export_metrics(metrics_port + index)
+        except OSError as e: print(f"Worker {index}: metrics endpoint not started: {e}")
+    print(f"Worker {index} (pid {os.getpid()}) ready.")
+
+    while True:
+        try:
+            data, fds, _, _ = socket.recv_fds(control, CONTROL_MESSAGE_SIZE, 2)
+        except OSError as e:
+            print(f"Worker {index}: control socket error: {e}")
+            break
+        if not data: break # Supervisor is gone
+        conns = [socket.socket(fileno=fd) for fd in fds]
+        try:
+            message = json.loads(data)
+            if message['op'] == 'pair':
+                white = worker_session(conns[0], message['white'])
+                black = worker_session(conns[1], message['black'])
+                threading.Thread(target=serve_pair, args=(white, black, message['game_id']), daemon=True).start()
+            elif message['op'] == 'resume':
+                session, leftover = worker_session(conns[0], message['player'])
+                threading.Thread(target=resume_seat, args=(session, message['game_id'], message['token'], leftover),
+                                 daemon=True).start()
+            elif message['op'] == 'spectate':
+                meta = message['viewer']
+                join_as_spectator(conns[0], tuple(meta['addr']), message['game_id'],
+                                  wire.CODECS[meta['codec']], bytes.fromhex(meta['leftover']))
+        except Exception as e:
+            print(f"Worker {index}: bad control message: {e}")
+            for conn in conns: close_connection(conn)
+    print(f"Worker {index} exiting.")
+    os._exit(0)
+
+
+def worker_session(conn, meta):
+    """Rebuilds a ClientSession for a socket that was accepted and negotiated by the supervisor."""
+    session = ClientSession(conn, tuple(meta['addr']))
+    session.codec = wire.CODECS[meta['codec']]
+    session.framed = meta['framed']
+    session.rating = meta['rating']
+    server.track_connection(conn, session.codec, session.framed)
+    return session, bytes.fromhex(meta['leftover'])
+
+
+def serve_pair(white, black, game_id):
+    # Same order as server.handle_client: the waiting player is already in its receive loop
+    # when the second player's thread sets up the game.
+    (white_session, white_leftover), (black_session, black_leftover) = white, black
+    threading.Thread(target=run_game_communication, args=(white_session, white_leftover), daemon=True).start()
+    if start_paired_game(white_session, black_session, game_id):
+        run_game_communication(black_session, black_leftover)
+    else:
+        server.forget_connection(black_session.conn)
+
+
+# --- Supervisor ---
+class WorkerLink:
+    """Supervisor-side view of one worker process."""
+    def __init__(self, index, pid, control):
+        self.index = index
+        self.pid = pid
+        self.control = control
+        self.games = set() # Game ids placed on this worker and not yet reported closed
+        self.stats = {}
+        self.alive = True
+
+
+class Supervisor:
+    def __init__(self, worker_count, journal_dir=None, metrics_port=None):
+        self.worker_count = worker_count
+        self.journal_dir = journal_dir
+        self.metrics_port = metrics_port # Worker i serves its metrics on metrics_port + i
+        self.workers = []
+        self.game_workers = {} # {game_id: WorkerLink}
+        self.matchmaker = Matchmaker() # Waiting players; payloads are (conn, meta)
+        self.lock = threading.Lock() # Guards the fields above; never held for blocking socket I/O
+
+    def start_workers(self):
+        """Forks the workers. Must run before any other thread or the listening socket exists."""
+        for index in range(self.worker_count):
+            parent_end, child_end = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+            pid = os.fork()
+            if pid == 0:
+                parent_end.close()
+                for worker in self.workers: worker.control.close()
+                try:
+                    run_worker(index, child_end, self.journal_dir, self.metrics_port)
+                finally:
+                    os._exit(1)
+            child_end.close()
+            self.workers.append(WorkerLink(index, pid, parent_end))
+        threading.Thread(target=self.read_reports, daemon=True).start()
+        threading.Thread(target=self.print_stats, daemon=True).start()
+        threading.Thread(target=self.run_matchmaking_sweeps, daemon=True).start()
+
+    def stop_workers(self):
+        for worker in self.workers:
+            try: os.kill(worker.pid, signal.SIGTERM)
+            except OSError: pass
+
+    # --- Admission (one short-lived thread per accepted connection) ---
+    def admit(self, conn, addr):
+        try:
+            hello = negotiate_codec(conn)
+            meta = {'addr': list(addr), 'codec': hello.codec.codec_id, 'framed': hello.framed,
+                    'leftover': hello.leftover.hex(), 'rating': hello.rating or DEFAULT_RATING}
+            game_id = hello.resume[0] if hello.resume is not None else hello.spectate_game_id
+            if game_id is not None:
+                with self.lock: worker = self.game_workers.get(game_id)
+                if worker is None:
+                    print(f"{addr} asked for unknown game {game_id}.")
+                    conn.sendall(frame_message('error:no_such_game', hello.codec))
+                    close_connection(conn)
+                elif hello.resume is not None:
+                    self.hand_off(worker, {'op': 'resume', 'game_id': game_id, 'token': hello.resume[1], 'player': meta}, [conn])
+                else:
+                    self.hand_off(worker, {'op': 'spectate', 'game_id': game_id, 'viewer': meta}, [conn])
+                return
+
+            stale = []
+            with self.lock:
+                opponent = self.matchmaker.join(conn, meta['rating'], (conn, meta), accept=self.vet(stale))
+            for dead in stale: close_connection(dead)
+            if opponent is None:
+                print(f"Added {addr} (rating {meta['rating']}) to waiting queue.")
+                return
+            self.place_game(opponent.payload, (conn, meta))
+        except (socket.error, OSError) as e:
+            print(f"Error admitting {addr}: {e}")
+            close_connection(conn)
+
+    def place_game(self, white, black):
+        """Sends both (conn, meta) players of a new game to the least-loaded live worker."""
+        with self.lock:
+            worker = min((w for w in self.workers if w.alive), key=lambda w: len(w.games), default=None)
+            game_id = str(uuid.uuid4())
+            if worker:
+                worker.games.add(game_id)
+                self.game_workers[game_id] = worker
+        if worker is None:
+            print("No live workers; dropping both players.")
+            for conn, _ in (white, black): close_connection(conn)
+            return
+        print(f"Pairing {tuple(black[1]['addr'])} with {tuple(white[1]['addr'])} on worker {worker.index} (game {game_id}).")
+        self.hand_off(worker, {'op': 'pair', 'game_id': game_id, 'white': white[1], 'black': black[1]},
+                      [white[0], black[0]])
+
+    def run_matchmaking_sweeps(self):
+        """Thread body: pairs waiting players once their widening rating windows overlap."""
+        while True:
+            time.sleep(MATCH_SWEEP_INTERVAL)
+            stale = []
+            with self.lock: pairs = self.matchmaker.sweep(accept=self.vet(stale))
+            for dead in stale: close_connection(dead)
+            for white, black in pairs: self.place_game(white.payload, black.payload)
+
+    @staticmethod
+    def vet(stale):
+        """Matchmaker accept hook: rejects waiting players that hung up, collecting them in stale."""
+        def accept(ticket):
+            if connection_alive(ticket.key): return True
+            stale.append(ticket.key)
+            return False
+        return accept
+
+    def hand_off(self, worker, message, conns):
+        """Passes the sockets to worker; the supervisor's copies are closed either way."""
+        try:
+            socket.send_fds(worker.control, [json.dumps(message).encode()], [c.fileno() for c in conns])
+        except OSError as e:
+            print(f"Could not hand connections to worker {worker.index}: {e}")
+            self.worker_lost(worker)
+        finally:
+            for conn in conns: close_connection(conn)
+
+    # --- Worker Reports ---
+    def read_reports(self):
+        selector = selectors.DefaultSelector()
+        for worker in self.workers: selector.register(worker.control, selectors.EVENT_READ, worker)
+        while any(worker.alive for worker in self.workers):
+            for key, _ in selector.select():
+                worker = key.data
+                try:
+                    data = worker.control.recv(CONTROL_MESSAGE_SIZE)
+                except OSError:
+                    data = b""
+                if not data:
+                    selector.unregister(worker.control)
+                    self.worker_lost(worker)
+                    continue
+                try:
+                    message = json.loads(data)
+                except ValueError:
+                    continue
+                with self.lock:
+                    if message.get('op') == 'stats':
+                        worker.stats = message
+                    elif message.get('op') == 'games_recovered':
+                        worker.games.update(message['game_ids'])
+                        for game_id in message['game_ids']: self.game_workers[game_id] = worker
+                    elif message.get('op') == 'game_closed':
+                        worker.games.discard(message['game_id'])
+                        self.game_workers.pop(message['game_id'], None)
+
+    def worker_lost(self, worker):
+        with self.lock:
+            if not worker.alive: return
+            worker.alive = False
+            for game_id in worker.games: self.game_workers.pop(game_id, None)
+            worker.games.clear()
+        print(f"!!! Worker {worker.index} (pid {worker.pid}) is gone; its games were lost. !!!")
+
+    def stats(self):
+        """Latest report of every worker, e.g. {'index': 0, 'alive': True, 'games': 12, ...}."""
+        with self.lock:
+            return [dict(worker.stats, index=worker.index, pid=worker.pid, alive=worker.alive,
+                         placed_games=len(worker.games)) for worker in self.workers]
+
+    def print_stats(self):
+        while True:
+            time.sleep(STATS_INTERVAL)
+            for s in self.stats():
+                if not s['alive']:
+                    print(f"[stats] worker {s['index']} pid {s['pid']}: dead")
+                    continue
+                if 'games' not in s: continue # No report yet
+                print(f"[stats] worker {s['index']} pid {s['pid']}: {s.get('games', 0)} games, "
+                      f"{s.get('players', 0)} players, {s.get('spectators', 0)} spectators, "
+                      f"{s.get('updates', 0)} updates, cpu {s.get('cpu_seconds', 0.0):.1f} s")
+                cache = s.get('options_cache')
+                if cache:
+                    print(f"[stats] worker {s['index']} options cache: {cache['entries']} positions, "
+                          f"{cache['hit_rate']:.1%} hits ({cache['hits']} of {cache['hits'] + cache['misses']}), "
+                          f"{cache['evictions']} evicted")
+            with self.lock: queue = self.matchmaker.stats()
+            if queue['pairings']:
+                print(f"[stats] matchmaking: {queue['waiting']} waiting, {queue['pairings']} paired, "
+                      f"wait p50 {queue['wait_p50']:.1f} s p90 {queue['wait_p90']:.1f} s p99 {queue['wait_p99']:.1f} s")
+
+
+# --- Main Supervisor Execution ---
+if __name__ == "__main__":
+    import argparse
+    arg_parser = argparse.ArgumentParser(description="Multi-process chess server (supervisor + workers)")
+    arg_parser.add_argument('--host', default=SERVER_IP)
+    arg_parser.add_argument('--port', type=int, default=PORT)
+    arg_parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    arg_parser.add_argument('--journal', metavar='DIR', help="each worker journals its games under DIR (keep --workers the same across restarts)")
+    arg_parser.add_argument('--metrics-port', type=int, help="worker i serves Prometheus metrics on this local port + i")
+    args = arg_parser.parse_args()
+
+    from server_async import raise_open_file_limit
+    raise_open_file_limit()
+    supervisor = Supervisor(max(1, args.workers), args.journal, args.metrics_port)
+    supervisor.start_workers() # Before the listener exists, so workers do not inherit it
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    try:
+        listener.bind((args.host, args.port))
+        listener.listen(LISTEN_BACKLOG)
+        print(f"Chess Supervisor Started on {args.host}:{args.port} with {args.workers} workers.")
+    except socket.error as e:
+        print(f"Socket bind/listen error: {e}")
+        supervisor.stop_workers()
+        sys.exit(1)
+
+    try:
+        while True:
+            try:
+                conn, addr = listener.accept()
+                threading.Thread(target=supervisor.admit, args=(conn, addr), daemon=True).start()
+            except socket.error as e:
+                print(f"Error accepting connection: {e}")
+                time.sleep(0.5)
+    except KeyboardInterrupt:
+        print("Supervisor stopped.")
+    finally:
+        supervisor.stop_workers()
@@ -0,0 +1,520 @@
+# ######## wire.py (Wire Codecs and Connect-Time Negotiation) ########
+# Every message is sent as a 4-byte big-endian length prefix followed by a payload encoded
+# with the codec negotiated when the connection opened:
+#   client -> server: WIRE_MAGIC, version (u8), codec count (u8), codec ids in preference order
+#                     [version >= 2: role (u8); spectators add game id length (u8) and id (ascii)]
+#                     [version >= 3: rated players add a u16 rating]
+#                     [version >= 4: a resuming player adds game id and seat token, each u8 length + ascii]
+#   server -> client: WIRE_MAGIC, version (u8), chosen codec id (u8)
+# Clients that never send the handshake are treated as legacy pickle clients: they send
+# unframed pickles and are sent a full pickled state (with chat history) for every update.
+import collections
+import io
+import pickle
+import struct
+
+from movegen import SQUARE_COORDS
+
+# --- Constants ---
+WIRE_MAGIC = b'CHSW'
+WIRE_VERSION = 4
+ROLE_PLAYER = 0
+ROLE_SPECTATOR = 1
+ROLE_RESUME = 2
+CODEC_PICKLE = 0
+CODEC_BINARY = 1
+HEADER_FORMAT = struct.Struct('>I')
+HEADER_SIZE = HEADER_FORMAT.size
+HANDSHAKE_ACK_SIZE = len(WIRE_MAGIC) + 2
+
+
+class WireError(ValueError):
+    """Raised when a message cannot be encoded or a payload cannot be decoded."""
+
+
+# --- Legacy Pickle Codec ---
+class ForbiddenGlobalError(pickle.UnpicklingError):
+    """A pickle tried to reference a class or function."""
+
+
+class RestrictedUnpickler(pickle.Unpickler):
+    """Unpickler that refuses every global, so a payload can only build plain containers.
+
+    Game messages are dicts, lists, tuples, strings and numbers; anything that needs
+    find_class is an attempt to run code and is rejected.
+    """
+    def find_class(self, module, name):
+        raise ForbiddenGlobalError(f"global '{module}.{name}' is forbidden")
+
+def safe_loads(data):
+    return RestrictedUnpickler(io.BytesIO(data)).load()
+
+def safe_load_prefix(data):
+    """Loads one pickle from the start of data. Returns (message, bytes_consumed)."""
+    stream = io.BytesIO(data)
+    message = RestrictedUnpickler(stream).load()
+    return message, stream.tell()
+
+class PickleCodec:
+    codec_id = CODEC_PICKLE
+    name = 'pickle'
+
+    def encode(self, message):
+        return pickle.dumps(message)
+
+    def decode(self, payload):
+        try:
+            return safe_loads(payload)
+        except (pickle.UnpicklingError, EOFError, IndexError, TypeError, ValueError, AttributeError) as e:
+            raise WireError(f"bad pickle payload: {e}")
+
+
+# --- Binary Codec ---
+# Squares are one byte (y * 8 + x), pieces one byte (index into PIECE_CODES), colours one byte.
+PIECE_CODES = ('pawn', 'rook', 'knight', 'bishop', 'queen', 'king')
+PIECE_TO_CODE = {piece: code for code, piece in enumerate(PIECE_CODES)}
+COLOR_CODES = ('white', 'black')
+COLOR_TO_CODE = {'white': 0, 'black': 1}
+NONE_CODE = 0xFF
+
+_U16 = struct.Struct('>H')
+_U32 = struct.Struct('>I')
+_F64 = struct.Struct('>d')
+
+SQUARE_TO_BYTE = {coords: sq for sq, coords in enumerate(SQUARE_COORDS)}
+
+def _square_byte(coords):
+    try: return SQUARE_TO_BYTE[tuple(coords)]
+    except (KeyError, TypeError): raise WireError(f"square out of range: {coords}")
+
+# Each kind is (encode(out: bytearray, value), decode(view, offset) -> (value, offset))
+def _enc_u8(out, value): out.append(value)
+def _dec_u8(view, o): return view[o], o + 1
+
+def _enc_u32(out, value): out += _U32.pack(value)
+def _dec_u32(view, o): return _U32.unpack_from(view, o)[0], o + 4
+
+def _enc_f64(out, value): out += _F64.pack(value)
+def _dec_f64(view, o): return _F64.unpack_from(view, o)[0], o + 8
+
+def _enc_bool(out, value): out.append(1 if value else 0)
+def _dec_bool(view, o): return view[o] != 0, o + 1
+
+def _enc_str(out, value):
+    if not isinstance(value, str): raise WireError(f"expected a string, got {type(value).__name__}")
+    data = value.encode('utf-8')
+    if len(data) > 0xFFFF: raise WireError("string too long")
+    out += _U16.pack(len(data)); out += data
+def _dec_str(view, o):
+    length = _U16.unpack_from(view, o)[0]; o += 2
+    return bytes(view[o:o + length]).decode('utf-8'), o + length
+
+def _enc_color(out, value): out.append(COLOR_TO_CODE[value] if value in COLOR_TO_CODE else NONE_CODE)
+def _dec_color(view, o):
+    code = view[o]
+    return (COLOR_CODES[code] if code < 2 else ''), o + 1
+
+def _enc_square(out, value): out.append(_square_byte(value))
+def _dec_square(view, o): return SQUARE_COORDS[view[o]], o + 1
+
+def _enc_piece_opt(out, value): out.append(NONE_CODE if value is None else PIECE_TO_CODE[value])
+def _dec_piece_opt(view, o):
+    code = view[o]
+    return (None if code == NONE_CODE else PIECE_CODES[code]), o + 1
+
+def _enc_index_opt(out, value): out.append(NONE_CODE if value is None else value)
+def _dec_index_opt(view, o):
+    code = view[o]
+    return (None if code == NONE_CODE else code), o + 1
+
+def _enc_pieces(out, value):
+    out.append(len(value)); out += bytes(map(PIECE_TO_CODE.__getitem__, value))
+def _dec_pieces(view, o):
+    count = view[o]; o += 1
+    return [PIECE_CODES[code] for code in view[o:o + count]], o + count
+
+def _enc_squares(out, value):
+    out.append(len(value))
+    try: out += bytes(map(SQUARE_TO_BYTE.__getitem__, value))
+    except (KeyError, TypeError): out += bytes(map(_square_byte, value)) # Lists or bad squares
+def _dec_squares(view, o):
+    count = view[o]; o += 1
+    return [SQUARE_COORDS[code] for code in view[o:o + count]], o + count
+
+def _enc_options(out, value):
+    out.append(len(value))
+    lookup = SQUARE_TO_BYTE.__getitem__
+    try:
+        for moves in value:
+            out.append(len(moves)); out += bytes(map(lookup, moves))
+    except (KeyError, TypeError):
+        raise WireError("bad square in options")
+def _dec_options(view, o):
+    count = view[o]; o += 1
+    options = []
+    for _ in range(count):
+        moves, o = _dec_squares(view, o)
+        options.append(moves)
+    return options, o
+
+def _enc_option_changes(out, value):
+    out.append(len(value))
+    for color, changed in value.items():
+        _enc_color(out, color); out.append(len(changed))
+        for index, moves in changed.items():
+            out.append(index); _enc_squares(out, moves)
+def _dec_option_changes(view, o):
+    result = {}
+    count = view[o]; o += 1
+    for _ in range(count):
+        color, o = _dec_color(view, o)
+        entries = view[o]; o += 1
+        changed = {}
+        for _ in range(entries):
+            index = view[o]; o += 1
+            changed[index], o = _dec_squares(view, o)
+        result[color] = changed
+    return result, o
+
+def _enc_chat_message(out, value):
+    _enc_color(out, value.get('sender')); _enc_str(out, value.get('text', '')); _enc_str(out, value.get('timestamp', ''))
+def _dec_chat_message(view, o):
+    sender, o = _dec_color(view, o)
+    text, o = _dec_str(view, o)
+    timestamp, o = _dec_str(view, o)
+    return {'sender': sender, 'text': text, 'timestamp': timestamp}, o
+
+def _enc_chat_list(out, value):
+    out += _U16.pack(len(value))
+    for message in value: _enc_chat_message(out, message)
+def _dec_chat_list(view, o):
+    count = _U16.unpack_from(view, o)[0]; o += 2
+    messages = []
+    for _ in range(count):
+        message, o = _dec_chat_message(view, o)
+        messages.append(message)
+    return messages, o
+
+def _enc_chat_entries(out, value):
+    out += _U16.pack(len(value))
+    for message in value: out += _U32.pack(message['id']); _enc_chat_message(out, message)
+def _dec_chat_entries(view, o):
+    count = _U16.unpack_from(view, o)[0]; o += 2
+    messages = []
+    for _ in range(count):
+        message_id = _U32.unpack_from(view, o)[0]
+        message, o = _dec_chat_message(view, o + 4)
+        message['id'] = message_id
+        messages.append(message)
+    return messages, o
+
+def _enc_moves(out, value):
+    out.append(len(value))
+    for move in value:
+        _enc_color(out, move['color']); out.append(move['index']); _enc_square(out, move['to'])
+        _enc_piece_opt(out, move.get('promoted')); _enc_index_opt(out, move.get('captured_index'))
+def _dec_moves(view, o):
+    count = view[o]; o += 1
+    moves = []
+    for _ in range(count):
+        color, o = _dec_color(view, o)
+        index = view[o]; o += 1
+        to, o = _dec_square(view, o)
+        promoted, o = _dec_piece_opt(view, o)
+        captured_index, o = _dec_index_opt(view, o)
+        moves.append({'color': color, 'index': index, 'to': to, 'promoted': promoted, 'captured_index': captured_index})
+    return moves, o
+
+def _enc_move_data(out, value):
+    selection_index, target_coords = value
+    out.append(selection_index); _enc_square(out, target_coords)
+def _dec_move_data(view, o):
+    return (view[o], SQUARE_COORDS[view[o + 1]]), o + 2
+
+def _enc_chat_data(out, value):
+    _enc_str(out, value.get('text', '')); _enc_str(out, value.get('timestamp', ''))
+def _dec_chat_data(view, o):
+    text, o = _dec_str(view, o)
+    timestamp, o = _dec_str(view, o)
+    return {'text': text, 'timestamp': timestamp}, o
+
+def _enc_time_sync_data(out, value):
+    _enc_f64(out, value['client']); _enc_f64(out, value.get('server', float('nan')))
+def _dec_time_sync_data(view, o):
+    client, o = _dec_f64(view, o)
+    server, o = _dec_f64(view, o)
+    data = {'client': client}
+    if server == server: data['server'] = server # NaN marks a probe that has no server time yet
+    return data, o
+
+KINDS = {
+    'u8': (_enc_u8, _dec_u8), 'u32': (_enc_u32, _dec_u32), 'f64': (_enc_f64, _dec_f64),
+    'bool': (_enc_bool, _dec_bool), 'str': (_enc_str, _dec_str), 'color': (_enc_color, _dec_color),
+    'piece': (_enc_piece_opt, _dec_piece_opt), 'square': (_enc_square, _dec_square),
+    'pieces': (_enc_pieces, _dec_pieces), 'squares': (_enc_squares, _dec_squares),
+    'options': (_enc_options, _dec_options), 'option_changes': (_enc_option_changes, _dec_option_changes),
+    'chat_list': (_enc_chat_list, _dec_chat_list), 'chat_entries': (_enc_chat_entries, _dec_chat_entries),
+    'moves': (_enc_moves, _dec_moves),
+    'move_data': (_enc_move_data, _dec_move_data), 'chat_data': (_enc_chat_data, _dec_chat_data),
+    'time_sync_data': (_enc_time_sync_data, _dec_time_sync_data),
+}
+
+# --- Message Schemas ---
+# name: (tag, typed, fields). Typed messages carry a 'type' key equal to their name; the full
+# state snapshot historically has none. Each encoded dict message starts with a u32 bitmap of
+# which fields are present, so optional fields (and fields added in later versions) cost nothing.
+# Chat now travels as numbered chat_append events (chat.py). The delta's chat field is left in
+# place, unused, so later fields keep their bits; the state's chat_history, castling and
+# en_passant are only filled in the journal's game snapshots.
+MESSAGE_SCHEMAS = {
+    'state': (3, False, (
+        ('game_id', 'str'), ('seq', 'u32'),
+        ('white_pieces', 'pieces'), ('white_locations', 'squares'),
+        ('black_pieces', 'pieces'), ('black_locations', 'squares'),
+        ('captured_white', 'pieces'), ('captured_black', 'pieces'),
+        ('turn_step', 'u8'), ('game_over', 'bool'), ('winner', 'color'),
+        ('white_options', 'options'), ('black_options', 'options'),
+        ('chat_history', 'chat_list'), ('white_time', 'f64'), ('black_time', 'f64'),
+        ('game_started', 'bool'), ('clock_ts', 'f64'), ('chat_id', 'u32'),
+        ('castling', 'str'), ('en_passant', 'square'),
+    )),
+    'delta': (4, True, (
+        ('seq', 'u32'), ('base_seq', 'u32'), ('turn_step', 'u8'),
+        ('white_time', 'f64'), ('black_time', 'f64'),
+        ('game_over', 'bool'), ('winner', 'color'), ('game_started', 'bool'),
+        ('moves', 'moves'), ('chat', 'chat_list'), ('options', 'option_changes'),
+        ('clock_ts', 'f64'),
+    )),
+    'move': (5, True, (('data', 'move_data'), ('promotion', 'piece'))), # promotion: a pawn reaching the last rank
+    'chat': (6, True, (('data', 'chat_data'),)),
+    'resync': (7, True, ()),
+    'time_sync': (8, True, (('data', 'time_sync_data'),)),
+    'seat': (9, True, (('game_id', 'str'), ('token', 'str'))),
+    'chat_append': (10, True, (('messages', 'chat_entries'),)),
+    'chat_sync': (11, True, (('data', 'u32'), ('messages', 'chat_entries'))), # Request: data; reply: messages
+}
+TAG_ASSIGN = 1
+ASSIGN_CODES = COLOR_CODES + ('spectator',)
+ASSIGN_TO_CODE = {role: code for code, role in enumerate(ASSIGN_CODES)}
+TAG_ERROR = 2
+SCHEMA_BY_TAG = {tag: (name, typed, fields) for name, (tag, typed, fields) in MESSAGE_SCHEMAS.items()}
+
+
+class BinaryCodec:
+    codec_id = CODEC_BINARY
+    name = 'binary'
+
+    def encode(self, message):
+        out = bytearray()
+        try:
+            if isinstance(message, str):
+                if message in ASSIGN_TO_CODE:
+                    out.append(TAG_ASSIGN); out.append(ASSIGN_TO_CODE[message])
+                elif message.startswith('error:'):
+                    out.append(TAG_ERROR); _enc_str(out, message[len('error:'):])
+                else: raise WireError(f"no binary form for string message {message!r}")
+                return bytes(out)
+
+            if not isinstance(message, dict): raise WireError(f"no binary form for {type(message).__name__}")
+            name = message.get('type')
+            if name is None and 'turn_step' in message and 'white_pieces' in message: name = 'state'
+            if name not in MESSAGE_SCHEMAS: raise WireError(f"unknown message type {name!r}")
+            tag, typed, fields = MESSAGE_SCHEMAS[name]
+            out.append(tag)
+            bitmap_at = len(out); out += b'\0\0\0\0'
+            bitmap = 0
+            for bit, (field, kind) in enumerate(fields):
+                value = message.get(field)
+                if value is None: continue
+                bitmap |= 1 << bit
+                KINDS[kind][0](out, value)
+            _U32.pack_into(out, bitmap_at, bitmap)
+            return bytes(out)
+        except (KeyError, TypeError, ValueError, AttributeError, struct.error) as e:
+            if isinstance(e, WireError): raise
+            raise WireError(f"cannot encode message: {e}")
+
+    def decode(self, payload):
+        view = memoryview(payload)
+        try:
+            tag = view[0]
+            if tag == TAG_ASSIGN: return ASSIGN_CODES[view[1]]
+            if tag == TAG_ERROR: return 'error:' + _dec_str(view, 1)[0]
+            if tag not in SCHEMA_BY_TAG: raise WireError(f"unknown message tag {tag}")
+            name, typed, fields = SCHEMA_BY_TAG[tag]
+            bitmap = _U32.unpack_from(view, 1)[0]
+            o = 5
+            message = {'type': name} if typed else {}
+            for bit, (field, kind) in enumerate(fields):
+                if bitmap & (1 << bit):
+                    message[field], o = KINDS[kind][1](view, o)
+            if typed and len(message) == 1: message['data'] = None # e.g. {'type': 'resync', 'data': None}
+            if o != len(view): raise WireError(f"{len(view) - o} trailing bytes in {name} message")
+            return message
+        except (IndexError, KeyError, struct.error, UnicodeDecodeError) as e:
+            raise WireError(f"malformed binary payload: {e}")
+
+
+PICKLE_CODEC = PickleCodec()
+BINARY_CODEC = BinaryCodec()
+CODECS = {CODEC_PICKLE: PICKLE_CODEC, CODEC_BINARY: BINARY_CODEC}
+SERVER_CODEC_PREFERENCE = (CODEC_BINARY, CODEC_PICKLE)
+
+
+# --- Framing ---
+DECODER_INITIAL_CAPACITY = 16 * 1024
+MAX_INBOUND_FRAME = 64 * 1024 # Client messages are tiny; anything bigger is a broken or hostile peer
+
+def frame_message(message, codec=PICKLE_CODEC):
+    payload = codec.encode(message)
+    return HEADER_FORMAT.pack(len(payload)) + payload
+
+
+class FrameBatch:
+    """The messages of one broadcast, framed at most once per codec.
+
+    Every recipient that negotiated the same codec is written the same bytes object.
+    """
+    def __init__(self, messages):
+        self.messages = messages
+        self._frames = {} # {codec_id: bytes}
+
+    def __bool__(self):
+        return bool(self.messages)
+
+    def frame_for(self, codec):
+        frame = self._frames.get(codec.codec_id)
+        if frame is None:
+            frame = b''.join(frame_message(message, codec) for message in self.messages)
+            self._frames[codec.codec_id] = frame
+        return frame
+
+
+class FrameDecoder:
+    """Incremental decoder for length-prefixed frames arriving on a stream socket.
+
+    Bytes are received straight into one preallocated bytearray with recv_into. Complete
+    frames are decoded from memoryview slices of it, so nothing is re-parsed or copied per
+    frame, and any number of frames per read is handled in one pass. The buffer is used as a
+    ring: the read cursor chases the write cursor, both snap back to zero whenever the
+    buffer drains, and only an incomplete tail frame is ever moved (when the write cursor
+    reaches the end).
+    """
+    def __init__(self, codec, capacity=DECODER_INITIAL_CAPACITY, max_frame=MAX_INBOUND_FRAME):
+        self.codec = codec
+        self.max_frame = max_frame
+        self._buffer = bytearray(capacity)
+        self._view = memoryview(self._buffer)
+        self._start = 0 # First unconsumed byte
+        self._end = 0 # One past the last received byte
+
+    def _make_room(self, needed):
+        pending = self._end - self._start
+        if self._start and pending: # Move the partial frame to the front
+            self._view[:pending] = self._view[self._start:self._end]
+        self._start, self._end = 0, pending
+        if len(self._buffer) - pending < needed: # One frame larger than the whole buffer
+            new_buffer = bytearray(max(len(self._buffer) * 2, pending + needed))
+            new_buffer[:pending] = self._view[:pending]
+            self._buffer = new_buffer
+            self._view = memoryview(new_buffer)
+
+    def recv_into(self, sock):
+        """Reads once from sock into the buffer. Returns the byte count (0 means EOF)."""
+        if self._end == len(self._buffer): self._make_room(1)
+        received = sock.recv_into(self._view[self._end:])
+        self._end += received
+        return received
+
+    def feed(self, data):
+        """Adds bytes obtained elsewhere (e.g. from an asyncio stream or a handshake read)."""
+        if len(self._buffer) - self._end < len(data): self._make_room(len(data))
+        self._view[self._end:self._end + len(data)] = data
+        self._end += len(data)
+
+    def messages(self):
+        """Yields every complete decoded message currently buffered, oldest first.
+
+        The read cursor moves past a frame before it is yielded, so a caller that stops
+        early leaves the remaining frames buffered for the next call.
+        """
+        view = self._view
+        while self._end - self._start >= HEADER_SIZE:
+            frame_length = HEADER_FORMAT.unpack_from(view, self._start)[0]
+            if frame_length > self.max_frame: raise WireError(f"inbound frame of {frame_length} bytes")
+            frame_end = self._start + HEADER_SIZE + frame_length
+            if frame_end > self._end:
+                if frame_end - self._start > len(self._buffer): self._make_room(frame_end - self._end)
+                break
+            payload = view[self._start + HEADER_SIZE:frame_end]
+            self._start = frame_end
+            yield self.codec.decode(payload)
+        if self._start == self._end: self._start = self._end = 0
+
+
+class LegacyPickleDecoder(FrameDecoder):
+    """Same interface for clients that send bare, unframed pickles back to back."""
+    def __init__(self, capacity=DECODER_INITIAL_CAPACITY, max_frame=MAX_INBOUND_FRAME):
+        super().__init__(PICKLE_CODEC, capacity, max_frame)
+
+    def messages(self):
+        while self._start < self._end:
+            try:
+                message, consumed = safe_load_prefix(self._view[self._start:self._end])
+            except ForbiddenGlobalError as e:
+                raise WireError(str(e))
+            except (pickle.UnpicklingError, EOFError, IndexError, TypeError, ValueError, AttributeError, KeyError):
+                if self._end - self._start > self.max_frame: raise WireError("unparseable legacy pickle stream")
+                break # Need more data
+            self._start += consumed
+            yield message
+        if self._start == self._end: self._start = self._end = 0
+
+
+def inbound_decoder(codec, framed):
+    return FrameDecoder(codec) if framed else LegacyPickleDecoder()
+
+
+# --- Negotiation ---
+# What a server learned from a connection's handshake. resume is (game_id, seat_token) for a
+# player reclaiming its seat in a game recovered from the journal, else None.
+Hello = collections.namedtuple('Hello', 'codec framed leftover spectate_game_id rating resume')
+
+
+def _short_ascii(value, what):
+    data = value.encode('ascii')
+    if len(data) > 0xFF: raise WireError(f"{what} too long")
+    return bytes((len(data),)) + data
+
+def client_handshake(codec_ids=SERVER_CODEC_PREFERENCE, spectate_game_id=None, rating=None, resume=None):
+    """Bytes a client sends right after connecting, listing the codecs it can speak.
+
+    Unrated players send the version 1 form, which every server understands; a spectator
+    appends its role and the id of the game to watch (version 2), a rated player its role
+    and a u16 rating for matchmaking (version 3), and a player returning to a game after a
+    server restart its role, the game id and its seat token (version 4).
+    """
+    if resume is not None:
+        game_id, token = resume
+        return WIRE_MAGIC + bytes((WIRE_VERSION, len(codec_ids))) + bytes(codec_ids) + \
+            bytes((ROLE_RESUME,)) + _short_ascii(game_id, "game id") + _short_ascii(token, "seat token")
+    if spectate_game_id is None:
+        if rating is None: return WIRE_MAGIC + bytes((1, len(codec_ids))) + bytes(codec_ids)
+        if not 0 < rating <= 0xFFFF: raise WireError(f"rating {rating} out of range")
+        return WIRE_MAGIC + bytes((WIRE_VERSION, len(codec_ids))) + bytes(codec_ids) + \
+            bytes((ROLE_PLAYER,)) + _U16.pack(rating)
+    return WIRE_MAGIC + bytes((WIRE_VERSION, len(codec_ids))) + bytes(codec_ids) + \
+        bytes((ROLE_SPECTATOR,)) + _short_ascii(spectate_game_id, "game id")
+
+def choose_codec(offered_ids):
+    for codec_id in SERVER_CODEC_PREFERENCE:
+        if codec_id in offered_ids: return CODECS[codec_id]
+    return PICKLE_CODEC
+
+def server_handshake_ack(codec):
+    return WIRE_MAGIC + bytes((WIRE_VERSION, codec.codec_id))
+
+def parse_handshake_ack(data):
+    """Returns the codec the server picked, or None if data is not a valid ack."""
+    if len(data) != HANDSHAKE_ACK_SIZE or not data.startswith(WIRE_MAGIC): return None
+    return CODECS.get(data[len(WIRE_MAGIC) + 1])
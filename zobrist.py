@@ -0,0 +1,128 @@
+# ######## zobrist.py (Zobrist Position Hashing and the Shared Options Cache) ########
+# Every (colour, piece, square), castling right, en passant square and the side to move has
+# a fixed random 64-bit key; a position's hash is the XOR of the keys of what is in it. A
+# move only XORs out what it removes and XORs in what it adds, so Game keeps its hash up to
+# date in O(1) per move. The hash then serves two purposes:
+# - OptionsCache: positions recur constantly across games (every game starts from the same
+#   one, and openings repeat), so option lists generated for one game are kept, keyed by
+#   hash, for any game in the process that reaches the same position.
+# - threefold repetition: a game counts how often each hash has come up.
+# The en passant square only counts when a pawn of the side to move stands next to it, so
+# positions that only differ by an en passant capture nobody can make hash the same.
+import random
+import threading
+from collections import OrderedDict
+
+from movegen import PIECE_NAMES, PAWN_ATTACKS, SQUARE_BITS
+
+# --- Constants ---
+ZOBRIST_SEED = 0x5EED_C4E55 # Fixed, so a position hashes the same in every process and run
+OPTIONS_CACHE_SIZE = 4096 # Positions kept by the shared cache (a few KB each)
+ADMISSION_MEMORY = 8 * OPTIONS_CACHE_SIZE # Hashes of once-seen positions remembered for admission
+
+_rng = random.Random(ZOBRIST_SEED)
+PIECE_KEYS = {color: {piece: tuple(_rng.getrandbits(64) for _ in range(64)) for piece in PIECE_NAMES}
+              for color in ('white', 'black')} # PIECE_KEYS[color][piece][sq]
+CASTLING_KEYS = {right: _rng.getrandbits(64) for right in 'KQkq'}
+EN_PASSANT_KEYS = tuple(_rng.getrandbits(64) for _ in range(64))
+BLACK_TO_MOVE_KEY = _rng.getrandbits(64)
+
+
+# --- Hashing ---
+def piece_key(color, piece, coords):
+    return PIECE_KEYS[color][piece][coords[1] * 8 + coords[0]]
+
+def castling_key(castling):
+    key = 0
+    for right in castling: key ^= CASTLING_KEYS[right]
+    return key
+
+def en_passant_key(en_passant, pawns):
+    """Key of en passant square en_passant, or 0 if None or no pawn on bitboard pawns (the
+    side to move's) could take there."""
+    if en_passant is None: return 0
+    x, y = en_passant
+    sq = y * 8 + x
+    skipped_by = 'white' if y == 2 else 'black' # The square a white pawn skips is on y == 2
+    return EN_PASSANT_KEYS[sq] if PAWN_ATTACKS[skipped_by][sq] & pawns else 0
+
+def position_hash(white_pieces, white_locations, black_pieces, black_locations, to_move, castling='', en_passant=None):
+    """Hash of a whole position, computed from scratch."""
+    key = 0
+    pawns = 0 # The side to move's, for the en passant key
+    for color, pieces, locations in (('white', white_pieces, white_locations), ('black', black_pieces, black_locations)):
+        keys = PIECE_KEYS[color]
+        for piece, (x, y) in zip(pieces, locations):
+            key ^= keys[piece][y * 8 + x]
+            if piece == 'pawn' and color == to_move: pawns |= SQUARE_BITS[y * 8 + x]
+    key ^= castling_key(castling) ^ en_passant_key(en_passant, pawns)
+    if to_move == 'black': key ^= BLACK_TO_MOVE_KEY
+    return key
+
+
+# --- Shared Options Cache ---
+class OptionsCache:
+    """Bounded map of position hash -> option lists, least recently used evicted first.
+
+    Most positions past the opening never come up again, and storing each of them would
+    only churn the cache, so a position is admitted the second time it is seen (see admit).
+    One instance (options_cache) is shared by every game in the process. Values must be
+    treated as read-only by everyone who gets them. Thread-safe.
+    """
+    def __init__(self, capacity=OPTIONS_CACHE_SIZE):
+        self.capacity = capacity
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._seen_once = set() # Hashes admit() turned away; forgotten wholesale when full
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """The value stored for key (now the most recently used), or None."""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def admit(self, key):
+        """True if key is worth a put(): it was offered once before. Remembers it otherwise."""
+        with self._lock:
+            if key in self._seen_once:
+                self._seen_once.discard(key)
+                return True
+            if len(self._seen_once) >= ADMISSION_MEMORY: self._seen_once.clear()
+            self._seen_once.add(key)
+            return False
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Drops every entry and zeroes the counters."""
+        with self._lock:
+            self._entries.clear()
+            self._seen_once.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """{'entries', 'hits', 'misses', 'evictions', 'hit_rate'} (hit_rate 0.0 before any lookup)."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'hit_rate': self.hits / lookups if lookups else 0.0}
+
+
+options_cache = OptionsCache()